@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Append throughput and random lookup latency, BlockLog vs Storage.
+
+    python3 pico/bench/blocklog_bench.py [block count]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.storage import Storage
+from libs.blocklog import BlockLog, STORAGE_LENGTHS
+
+BENCH_DIR = '/tmp/pico-bench-blocklog'
+LOOKUPS = 20000
+
+
+def make_blocks(count):
+    types = list(STORAGE_LENGTHS)
+    return [(types[i % len(types)], os.urandom(32), os.urandom(STORAGE_LENGTHS[types[i % len(types)]]))
+            for i in range(count)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    os.makedirs(BENCH_DIR)
+
+    blocks = make_blocks(count)
+    hashes = [block_hash for _, block_hash, _ in random.sample(blocks, min(LOOKUPS, count))]
+    megabytes = sum(32 + len(data) for _, _, data in blocks) / 2 ** 20
+    print('%d blocks, %.0f MiB of hashes and storage bytes' % (count, megabytes))
+
+    log_path = os.path.join(BENCH_DIR, 'blocks.log')
+    start = time.perf_counter()
+    with BlockLog(log_path, readonly=False) as log:
+        log.append_blocks(blocks)
+        appended = time.perf_counter()
+    indexed = time.perf_counter()
+    with BlockLog(log_path) as log:
+        lookup_start = time.perf_counter()
+        for block_hash in hashes:
+            log.get(block_hash)
+        lookup = (time.perf_counter() - lookup_start) / len(hashes)
+    print('BlockLog  append %6.1f MiB/s, index %5.2f s, lookup %5.2f us, files %.0f MiB' % (
+        megabytes / (appended - start), indexed - appended, lookup * 1e6,
+        (os.path.getsize(log_path) + os.path.getsize(log_path + '.idx')) / 2 ** 20))
+
+    storage = Storage(os.path.join(BENCH_DIR, 'storage.ldb'), readonly=False, durability='nosync')
+    start = time.perf_counter()
+    storage.put_blocks(blocks)
+    appended = time.perf_counter()
+    with storage.snapshot() as snap:
+        lookup_start = time.perf_counter()
+        for block_hash in hashes:
+            snap.get_block_any(block_hash)
+        lookup = (time.perf_counter() - lookup_start) / len(hashes)
+    print('Storage   put    %6.1f MiB/s,                lookup %5.2f us, file  %.0f MiB' % (
+        megabytes / (appended - start), lookup * 1e6, storage.stats()['used_bytes'] / 2 ** 20))
+    storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Walking a long account chain: one get_block() per hop vs iter_chain(), with and without indexes.
+
+    python3 pico/bench/chain_bench.py [chain length]
+"""
+
+import os
+import sys
+import time
+import shutil
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.storage import Storage
+from libs.block import Block
+
+BENCH_DIR = '/tmp/pico-bench-chain'
+OTHER_BLOCKS = 100000
+
+
+def make_chain(account, length):
+    """
+    A state chain with next fields, hashes are random: only the links matter here.
+    """
+
+    hashes = [os.urandom(32) for _ in range(length)]
+    blocks = []
+    for i, block_hash in enumerate(hashes):
+        previous = hashes[i - 1] if i else bytes(32)
+        next_hash = hashes[i + 1] if i + 1 < length else bytes(32)
+        data = account + previous + account + (length - i).to_bytes(16, 'big') + os.urandom(32 + 72) + next_hash
+        blocks.append(('state', block_hash, data))
+    return blocks
+
+
+def walk_get_block(storage, frontier):
+    count = 0
+    block_hash = frontier
+    while block_hash != bytes(32):
+        block = Block(type='state')
+        block.from_storage_bytes(storage.get_block('state', block_hash))
+        block_hash = block.previous
+        count += 1
+    return count
+
+
+def timed(fn):
+    start = time.perf_counter()
+    count = fn()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    os.makedirs(BENCH_DIR)
+
+    account = os.urandom(32)
+    chain = make_chain(account, length)
+    # other accounts' blocks, so the chain is spread over the table like in a real ledger.
+    others = [block for _ in range(OTHER_BLOCKS // 10) for block in make_chain(os.urandom(32), 10)]
+    frontier = chain[-1][1]
+
+    print('chain of %d blocks among %d others, blocks per second, backward' % (length, len(others)))
+    for indexes in [False, True]:
+        storage = Storage(os.path.join(BENCH_DIR, 'indexes.ldb' if indexes else 'plain.ldb'), readonly=False,
+                          durability='nosync', indexes=indexes)
+        storage.put_blocks(chain + others)
+        frontier = chain[-1][1]
+        name = 'indexes' if indexes else 'plain'
+        if not indexes:
+            print('%-8s get_block per hop:   %9.0f' % (name, timed(lambda: walk_get_block(storage, frontier))))
+        print('%-8s iter_chain:          %9.0f' % (name, timed(lambda: sum(1 for _ in storage.iter_chain(frontier, 'backward')))))
+        with storage.snapshot(buffers=True) as snap:
+            print('%-8s iter_chain, buffers: %9.0f' % (name, timed(lambda: sum(1 for _ in snap.iter_chain(frontier, 'backward')))))
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Size and read latency of state blocks, storage bytes vs the compact dictionary encoded format.
+
+    python3 pico/bench/compact_bench.py [block count]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.storage import Storage
+
+BENCH_DIR = '/tmp/pico-bench-compact'
+BLOCKS_PER_ACCOUNT = 8
+REPRESENTATIVES = 2000
+LOOKUPS = 20000
+
+
+def make_ledger(count):
+    """
+    State chains of BLOCKS_PER_ACCOUNT blocks, the representatives are picked with a long tail like the live network.
+    """
+
+    random.seed(1)
+    representatives = [os.urandom(32) for _ in range(REPRESENTATIVES)]
+    blocks = []
+    for _ in range(count // BLOCKS_PER_ACCOUNT):
+        account = os.urandom(32)
+        representative = representatives[int(random.paretovariate(1.2)) % REPRESENTATIVES]
+        hashes = [os.urandom(32) for _ in range(BLOCKS_PER_ACCOUNT)] + [bytes(32)]
+        previous = bytes(32)
+        for i in range(BLOCKS_PER_ACCOUNT):
+            balance = random.getrandbits(random.randint(60, 110)).to_bytes(16, 'big')
+            link = bytes(32) if random.random() < 0.05 else os.urandom(32)
+            data = (account + previous + representative + balance + link + os.urandom(64 + 8) + hashes[i + 1])
+            blocks.append(('state', hashes[i], data))
+            previous = hashes[i]
+    return blocks
+
+
+def table_bytes(storage, db_name):
+    stat = storage.table_stats(db_name)
+    return (stat['branch_pages'] + stat['leaf_pages'] + stat['overflow_pages']) * stat['psize']
+
+
+def bench(storage, hashes):
+    start = time.perf_counter()
+    for block_hash in hashes:
+        storage.get_block('state', block_hash)
+    per_call = (time.perf_counter() - start) / len(hashes)
+
+    start = time.perf_counter()
+    with storage.snapshot() as snap:
+        for block_hash in hashes:
+            snap.get_block('state', block_hash)
+    in_snapshot = (time.perf_counter() - start) / len(hashes)
+
+    return per_call * 1e6, in_snapshot * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    os.makedirs(BENCH_DIR)
+
+    blocks = make_ledger(count)
+    hashes = [block_hash for _, block_hash, _ in random.sample(blocks, min(LOOKUPS, len(blocks)))]
+
+    print('%d state blocks, %d representatives, %d lookups' % (len(blocks), REPRESENTATIVES, len(hashes)))
+    print('format    table MiB  dict MiB  file MiB  us per lookup (per call / in one snapshot)')
+    for compact_state in [False, True]:
+        name = 'compact' if compact_state else 'plain'
+        storage = Storage(os.path.join(BENCH_DIR, name + '.ldb'), readonly=False, durability='nosync',
+                          compact_state=compact_state)
+        storage.put_blocks(blocks)
+
+        dict_bytes = sum(table_bytes(storage, db_name) for db_name in [b'keydict', b'keydict_ids']) if compact_state else 0
+        print('%-8s  %9.1f  %8.1f  %8.1f  %6.2f / %6.2f' % (
+            (name, table_bytes(storage, 'state') / 2 ** 20, dict_bytes / 2 ** 20,
+             storage.stats()['used_bytes'] / 2 ** 20) + bench(storage, hashes)))
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
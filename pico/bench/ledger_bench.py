@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Blocks applied per second by Ledger: in memory only, with a BlockLog, with a Storage, and arriving out of
+order through an UncheckedCache.
+
+    python3 pico/bench/ledger_bench.py [block count] [accounts]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.storage import Storage
+from libs.blocklog import BlockLog
+from libs.ledger import LedgerState, Ledger, APPLIED, state_block_hash
+from libs.unchecked import UncheckedCache
+
+BENCH_DIR = '/tmp/pico-bench-ledger'
+GENESIS = b'\x99' * 32
+# out of order arrival: blocks are shuffled within windows of SHUFFLE_WINDOW blocks.
+SHUFFLE_WINDOW = 1000
+
+
+def genesis_state():
+    state = LedgerState()
+    state.apply('state', GENESIS, GENESIS + bytes(32) + GENESIS + (10 ** 30).to_bytes(16, 'big') + bytes(136))
+    return state
+
+
+def make_blocks(count, accounts):
+    """
+    Valid state blocks: random sends between funded accounts, every send is received a little later.
+    """
+
+    random.seed(1)
+    accounts = [os.urandom(32) for _ in range(accounts)]
+    chains = {GENESIS: (GENESIS, 10 ** 30)}
+    funded = [GENESIS]
+    pending = []
+    blocks = []
+    while len(blocks) < count:
+        if pending and (len(pending) > 100 or random.random() < 0.5):
+            link, account, amount = pending.pop(random.randrange(len(pending)))
+            previous, balance = chains.get(account, (bytes(32), 0))
+            balance += amount
+            if previous == bytes(32):
+                funded.append(account)
+        else:
+            account = random.choice(funded)
+            previous, balance = chains[account]
+            if balance < 2:
+                continue
+            amount = random.randint(1, balance // 2)
+            balance -= amount
+            link = random.choice(accounts)
+        data = account + previous + GENESIS + balance.to_bytes(16, 'big') + link + bytes(72)
+        block_hash = state_block_hash(data)
+        if balance < chains.get(account, (None, 0))[1]:
+            pending.append((block_hash, link, amount))
+        chains[account] = (block_hash, balance)
+        blocks.append((block_hash, data))
+    return blocks
+
+
+def run(blocks, storage=None, log=None):
+    ledger = Ledger(storage, genesis_state(), log)
+    start = time.perf_counter()
+    for block_hash, data in blocks:
+        ledger.apply(block_hash, data)
+    ledger.close()
+    seconds = time.perf_counter() - start
+    assert ledger.results['bad_amount'] == ledger.results['gap_source'] == ledger.results['fork'] == 0
+    return seconds
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    accounts = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    os.makedirs(BENCH_DIR)
+    blocks = make_blocks(count, accounts)
+
+    print('%d blocks, %d accounts' % (count, accounts))
+    seconds = run(blocks)
+    print('memory:       %9.0f blocks/s' % (count / seconds))
+    seconds = run(blocks, log=BlockLog(os.path.join(BENCH_DIR, 'blocks.log'), readonly=False))
+    print('block log:    %9.0f blocks/s' % (count / seconds))
+    storage = Storage(os.path.join(BENCH_DIR, 'ledger.ldb'), readonly=False)
+    seconds = run(blocks, storage=storage)
+    print('storage:      %9.0f blocks/s' % (count / seconds))
+    assert storage._get_db_size('state') == count
+
+    shuffled = []
+    for start in range(0, count, SHUFFLE_WINDOW):
+        window = blocks[start:start + SHUFFLE_WINDOW]
+        random.shuffle(window)
+        shuffled += window
+    ledger = Ledger(state=genesis_state(), unchecked=UncheckedCache())
+    start = time.perf_counter()
+    for block_hash, data in shuffled:
+        ledger.process(block_hash, data)
+    seconds = time.perf_counter() - start
+    stats = ledger.unchecked.stats()
+    assert sum(ledger.results[result] for result in APPLIED) == count and not stats['blocks']
+    released = stats['released_per_arrival']
+    print('out of order: %9.0f blocks/s, %d blocks waited, %.2f released per arrival, at most %d' % (
+        count / seconds, stats['added'], stats['released'] / sum(released.values()), max(released)))
+
+
+if __name__ == '__main__':
+    main()
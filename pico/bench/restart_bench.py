@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Startup time of the in-memory ledger state: cold (apply every block of a BlockLog) vs snapshot (load the
+snapshot and apply the blocks written since).
+
+    python3 pico/bench/restart_bench.py [block count] [accounts]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.blocklog import BlockLog
+from libs.ledger import LedgerState, restore
+
+BENCH_DIR = '/tmp/pico-bench-restart'
+# the blocks appended after the snapshot was taken.
+NEW_BLOCKS = 0.01
+
+
+def make_blocks(count, accounts):
+    """
+    State blocks of random accounts, sending random amounts to each other.
+    """
+
+    random.seed(1)
+    accounts = [os.urandom(32) for _ in range(accounts)]
+    representatives = accounts[:100]
+    state = {}
+    for i in range(count):
+        account = random.choice(accounts)
+        previous, balance = state.get(account, (bytes(32), 10 ** 30))
+        balance -= random.randint(0, balance // 100)
+        block_hash = os.urandom(32)
+        data = (account + previous + random.choice(representatives) + balance.to_bytes(16, 'big')
+                + random.choice(accounts) + bytes(64 + 8 + 32))
+        state[account] = (block_hash, balance)
+        yield 'state', block_hash, data
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    accounts = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    os.makedirs(BENCH_DIR)
+
+    log_path = os.path.join(BENCH_DIR, 'blocks.log')
+    snapshot_path = os.path.join(BENCH_DIR, 'ledger.snapshot')
+    blocks = make_blocks(count, accounts)
+    old = int(count * (1 - NEW_BLOCKS))
+    with BlockLog(log_path, readonly=False) as log:
+        for _ in range(old):
+            log.append(*next(blocks))
+
+    with BlockLog(log_path) as log:
+        state = LedgerState()
+        state.apply_blocks(log)
+    _, save_time = timed(lambda: state.save(snapshot_path))
+
+    with BlockLog(log_path, readonly=False) as log:
+        log.append_blocks(blocks)
+
+    with BlockLog(log_path) as log:
+        cold, cold_time = timed(lambda: restore(os.path.join(BENCH_DIR, 'none.snapshot'), log))
+        warm, warm_time = timed(lambda: restore(snapshot_path, log))
+    assert cold.accounts == warm.accounts and cold.pending == warm.pending
+
+    print('%d blocks, %d accounts, %d pending, snapshot %.1f MiB saved in %.2f s' % (
+        count, len(cold.accounts), len(cold.pending), os.path.getsize(snapshot_path) / 2 ** 20, save_time))
+    print('cold start:     %6.2f s' % cold_time)
+    print('snapshot start: %6.2f s (%d blocks replayed)' % (warm_time, count - old))
+
+
+if __name__ == '__main__':
+    main()
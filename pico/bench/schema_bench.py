@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Lookup latency of blocks of unknown type, typed schema (one table per type) vs unified schema.
+
+    python3 pico/bench/schema_bench.py [block count]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.storage import Storage
+
+BENCH_DIR = '/tmp/pico-bench-schema'
+# storage bytes length of every block type.
+BLOCK_LENGTHS = {'send': 184, 'receive': 168, 'open': 200, 'change': 168, 'state': 248}
+LOOKUPS = 20000
+
+
+def make_blocks(count):
+    types = list(BLOCK_LENGTHS)
+    blocks = []
+    for i in range(count):
+        block_type = types[i % len(types)]
+        blocks.append((block_type, os.urandom(32), os.urandom(BLOCK_LENGTHS[block_type])))
+    return blocks
+
+
+def bench(storage, hashes):
+    start = time.perf_counter()
+    for block_hash in hashes:
+        storage.get_block_any(block_hash)
+    per_call = (time.perf_counter() - start) / len(hashes)
+
+    start = time.perf_counter()
+    with storage.snapshot() as snap:
+        for block_hash in hashes:
+            snap.get_block_any(block_hash)
+    in_snapshot = (time.perf_counter() - start) / len(hashes)
+
+    return per_call * 1e6, in_snapshot * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    os.makedirs(BENCH_DIR)
+
+    blocks = make_blocks(count)
+    known = [block_hash for _, block_hash, _ in random.sample(blocks, min(LOOKUPS, count))]
+    unknown = [os.urandom(32) for _ in range(LOOKUPS)]
+
+    print('%d blocks, %d lookups, microseconds per lookup (per call / in one snapshot)' % (count, LOOKUPS))
+    for schema in ['typed', 'unified']:
+        storage = Storage(os.path.join(BENCH_DIR, schema + '.ldb'), readonly=False, schema=schema, durability='nosync')
+        storage.put_blocks(blocks)
+        print('%-8s known:   %6.2f / %6.2f' % ((schema, ) + bench(storage, known)))
+        print('%-8s unknown: %6.2f / %6.2f' % ((schema, ) + bench(storage, unknown)))
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Balances and receivables of a wallet of many accounts: per account lookups vs Storage.scan_wallet().
+
+    python3 pico/bench/wallet_bench.py [accounts in the ledger] [accounts in the wallet]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.storage import Storage
+
+BENCH_DIR = '/tmp/pico-bench-wallet'
+
+
+def make_ledger(storage, count):
+    """
+    count accounts open with a random balance, half of them send a part of it to another account.
+    """
+
+    random.seed(1)
+    accounts = [os.urandom(32) for _ in range(count)]
+    blocks = []
+    for account in accounts:
+        block_hash = os.urandom(32)
+        balance = random.randint(10 ** 20, 10 ** 30)
+        blocks.append(('state', block_hash, account + bytes(32) + account + balance.to_bytes(16, 'big')
+                       + os.urandom(32) + bytes(104)))
+        if random.random() < 0.5:
+            balance -= random.randint(1, 10 ** 20)
+            blocks.append(('state', os.urandom(32), account + block_hash + account + balance.to_bytes(16, 'big')
+                           + random.choice(accounts) + bytes(104)))
+    storage.put_blocks(blocks)
+    return accounts
+
+
+def lookup_each(storage, accounts):
+    result = {}
+    for account in accounts:
+        frontier = storage.get_frontier(account)
+        with storage.snapshot() as snap:
+            info = snap.get_block_info(frontier) if frontier else None
+        receivables = storage.get_receivables(account)
+        result[account] = {
+            'frontier':     frontier,
+            'balance':      None if info is None else info[3],
+            'pending':      sum(amount or 0 for _, amount in receivables),
+            'receivables':  len(receivables),
+        }
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    wallet = min(int(sys.argv[2]) if len(sys.argv) > 2 else 20000, count)
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    os.makedirs(BENCH_DIR)
+
+    storage = Storage(os.path.join(BENCH_DIR, 'wallet.ldb'), readonly=False, indexes=True)
+    accounts = random.sample(make_ledger(storage, count), wallet)
+
+    start = time.perf_counter()
+    each = lookup_each(storage, accounts)
+    each_time = time.perf_counter() - start
+    scan = storage.scan_wallet(accounts)
+    assert scan['accounts'] == each
+
+    print('%d accounts in the ledger, %d in the wallet, %d receivables' % (
+        count, wallet, sum(account['receivables'] for account in each.values())))
+    print('per account lookups: %7.1f ms, %5.2f us per account' % (each_time * 1e3, each_time / wallet * 1e6))
+    print('scan_wallet():       %7.1f ms, %5.2f us per account' % (scan['seconds'] * 1e3,
+                                                                  scan['seconds_per_account'] * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Representative weights: full recomputation from the accounts vs incremental updates by LedgerState.apply(),
+and top-N queries.
+
+    python3 pico/bench/weights_bench.py [accounts] [representatives]
+"""
+
+import os
+import sys
+import time
+import random
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.ledger import LedgerState
+from libs.weights import RepWeights
+
+UPDATES = 100000
+
+
+def main():
+    accounts = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    reps = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    random.seed(1)
+    representatives = [os.urandom(32) for _ in range(reps)]
+    state = LedgerState()
+    for _ in range(accounts):
+        data = (os.urandom(32) + bytes(32) + random.choice(representatives)
+                + random.randint(0, 10 ** 30).to_bytes(16, 'big') + bytes(136))
+        state.apply('state', os.urandom(32), data)
+
+    start = time.perf_counter()
+    state.weights = weights = RepWeights.from_state(state)
+    full = time.perf_counter() - start
+
+    updates = min(UPDATES, len(state.accounts))
+    half = updates // 2
+    owners = random.sample(list(state.accounts), updates)
+    blocks = []
+    for account in owners:
+        frontier, balance, _, _ = state.accounts[account]
+        data = (account + frontier + random.choice(representatives)
+                + random.randint(0, balance).to_bytes(16, 'big') + os.urandom(32) + bytes(104))
+        blocks.append(('state', os.urandom(32), data))
+
+    start = time.perf_counter()
+    state.weights = None
+    state.apply_blocks(blocks[:half])
+    bare = time.perf_counter() - start
+    start = time.perf_counter()
+    state.weights = weights
+    state.apply_blocks(blocks[half:])
+    tracked = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(100):
+        weights.top(20)
+    top = (time.perf_counter() - start) / 100
+
+    print('%d accounts, %d representatives' % (accounts, reps))
+    print('full recomputation:   %8.1f ms' % (full * 1e3))
+    print('apply() per block:    %8.2f us, %.2f us with weights' % (bare / max(half, 1) * 1e6,
+                                                                   tracked / max(updates - half, 1) * 1e6))
+    print('top(20):              %8.2f ms' % (top * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import SCAN_BATCH_SIZE
+
+READER_THREADS = 4
+# put_blocks() calls waiting for the writer, more callers wait in put_blocks() without blocking the loop.
+WRITE_QUEUE_SIZE = 64
+# the writer coalesces queued calls into one transaction of up to WRITE_COALESCE_BLOCKS blocks.
+WRITE_COALESCE_BLOCKS = 10000
+
+# latency histogram buckets, powers of 2 microseconds: <1us, <2us, <4us, ... <2**HISTOGRAM_BUCKETS us.
+HISTOGRAM_BUCKETS = 32
+
+
+class LatencyHistogram(object):
+
+    def __init__(self):
+        """
+        Count latencies in power of 2 microseconds buckets, thread safe.
+        """
+
+        self.buckets    = [0] * (HISTOGRAM_BUCKETS + 1)
+        self.count      = 0
+        self.total      = 0.0
+        self.max        = 0.0
+        self._lock      = threading.Lock()
+
+    def record(self, seconds):
+        bucket = min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS)
+        with self._lock:
+            self.buckets[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """
+        Return the upper bound in seconds of the bucket holding the p-th percentile, 0 <= p <= 100.
+        """
+
+        with self._lock:
+            rank = self.count * p / 100
+            seen = 0
+            for bucket, count in enumerate(self.buckets):
+                seen += count
+                if count and seen >= rank:
+                    return (1 << bucket) / 1e6
+        return 0.0
+
+    def stats(self):
+        return {
+            'count':    self.count,
+            'mean':     self.total / self.count if self.count else 0.0,
+            'p50':      self.percentile(50),
+            'p99':      self.percentile(99),
+            'max':      self.max,
+            'buckets':  {(1 << bucket) / 1e6: count for bucket, count in enumerate(self.buckets) if count},
+        }
+
+
+class AsyncStorage(object):
+
+    def __init__(self, storage, readers=READER_THREADS, queue_size=WRITE_QUEUE_SIZE,
+                 coalesce_blocks=WRITE_COALESCE_BLOCKS):
+        """
+        An asyncio facade of a Storage, the event loop never waits for lmdb:
+
+            db = AsyncStorage(Storage(db_path, readonly=False))
+            await db.put_blocks(blocks)
+            data = await db.get_block('state', block_hash)
+            async for key, value in db.iter_items('state'):
+                ...
+            await db.close()
+
+        Reads run on a pool of readers threads. Writes are queued to a single writer thread, which commits
+        the queued put_blocks() calls together, in one transaction of up to coalesce_blocks blocks.
+        When queue_size calls are waiting for the writer, put_blocks() waits (asynchronously) for room.
+        If a coalesced transaction fails, its calls are retried in a transaction each, so only the failing
+        call gets the error.
+        """
+
+        self.storage            = storage
+        self.queue_size         = queue_size
+        self.coalesce_blocks    = coalesce_blocks
+        self.latency            = {}
+        self._latency_lock      = threading.Lock()
+        self._readers           = ThreadPoolExecutor(readers, thread_name_prefix='storage-reader')
+        self._queue             = queue.Queue()
+        self._slots             = None
+        self._closed            = False
+        self._writer            = threading.Thread(target=self._write_loop, name='storage-writer')
+        self._writer.daemon     = True
+        self._writer.start()
+
+    def _record(self, operation, seconds):
+        histogram = self.latency.get(operation)
+        if histogram is None:
+            with self._latency_lock:
+                histogram = self.latency.setdefault(operation, LatencyHistogram())
+        histogram.record(seconds)
+
+    async def _read(self, operation, fn, *args):
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._readers, fn, *args)
+        finally:
+            self._record(operation, time.perf_counter() - start)
+
+    async def get_block(self, block_type, block_hash):
+        return await self._read('get_block', self.storage.get_block, block_type, block_hash)
+
+    async def get_block_any(self, block_hash):
+        return await self._read('get_block_any', self.storage.get_block_any, block_hash)
+
+    async def get_many(self, db_name, keys):
+        return await self._read('get_many', self.storage.get_many, db_name, keys)
+
+    async def iter_items(self, db_name, start=None, stop=None, prefix=None, reverse=False, batch=SCAN_BATCH_SIZE):
+        """
+        Yield (key, value) of a table in key order, see Storage.iter_batches().
+        Every batch is read on a reader thread, in its own read transaction.
+        """
+
+        batches = self.storage.iter_batches(db_name, start, stop, prefix, reverse, batch)
+        while True:
+            items = await self._read('iter_items', next, batches, None)
+            if items is None:
+                return
+            for item in items:
+                yield item
+
+    async def put_block(self, block_type, block_hash, data):
+        return await self.put_blocks([(block_type, block_hash, data)])
+
+    async def put_blocks(self, blocks):
+        """
+        Queue the blocks for the writer, return (inserted, overwritten) counts once they are committed.
+        """
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_size)
+
+        start = time.perf_counter()
+        async with self._slots:
+            # checked once the slot is taken, close() may have been called while waiting for it.
+            if self._closed:
+                raise ValueError('put_blocks() on a closed AsyncStorage')
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._queue.put((list(blocks), loop, future))
+            try:
+                return await future
+            finally:
+                self._record('put_blocks', time.perf_counter() - start)
+
+    def _write_loop(self):
+        """
+        The writer thread: take a queued call, add the calls queued meanwhile up to coalesce_blocks blocks,
+        and write them all in one transaction.
+        """
+
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            jobs = [job]
+            count = len(job[0])
+            stop = False
+            while count < self.coalesce_blocks:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                jobs.append(job)
+                count += len(job[0])
+
+            start = time.perf_counter()
+            try:
+                results = self.storage.put_block_groups([blocks for blocks, _, _ in jobs])
+            except Exception as e:
+                results = [e] if len(jobs) == 1 else [self._write_one(blocks) for blocks, _, _ in jobs]
+            self._record('commit', time.perf_counter() - start)
+
+            for (_, loop, future), result in zip(jobs, results):
+                loop.call_soon_threadsafe(_resolve, future, result)
+
+            if stop:
+                return
+
+    def _write_one(self, blocks):
+        """
+        Write the blocks of one call in their own transaction, return its result or the exception it raised.
+        """
+
+        try:
+            return self.storage.put_block_groups([blocks])[0]
+        except Exception as e:
+            return e
+
+    def queue_depth(self):
+        """
+        How many put_blocks() calls are queued for the writer, not counting the transaction being written.
+        """
+
+        return self._queue.qsize()
+
+    def stats(self):
+        """
+        Return the queue depth and the latency histograms in seconds: get_block, get_block_any, get_many,
+        iter_items (per batch) and put_blocks as seen by the caller, commit per writer transaction.
+        """
+
+        return {
+            'queue_depth':  self.queue_depth(),
+            'queue_size':   self.queue_size,
+            'latency':      {operation: histogram.stats() for operation, histogram in list(self.latency.items())},
+        }
+
+    async def close(self):
+        """
+        Let the writer commit the queued calls, then stop the threads. The Storage is left open.
+        put_blocks() raises ValueError from now on.
+        """
+
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._writer.join)
+        self._readers.shutdown()
+
+
+def _resolve(future, result):
+    if future.cancelled():
+        return
+    if isinstance(result, Exception):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
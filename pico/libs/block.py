@@ -4,7 +4,7 @@
 import os
 from pyblake2 import blake2b
 
-from .types_convert import to_bytes, int_to_bytes
+from .types_convert import to_bytes, int_to_bytes, hex_to_bytes, buffer_to_bytes
 from .account import address_to_verifying_key, address_valid
 
 
@@ -13,6 +13,9 @@ GENESIS_HASH = bytes.fromhex('991CF190094C00F0B68E2E5F75F6BEE95A2E0BD93CEAA4A673
 EMPTY_HASH = '0000000000000000000000000000000000000000000000000000000000000000'
 STATE_BLOCK_PREAMBLE = bytes.fromhex('0000000000000000000000000000000000000000000000000000000000000006')
 
+# the 5 block types, also the names of the block tables in Storage.
+BLOCK_TYPES = ['send', 'receive', 'open', 'change', 'state']
+
 
 class Block(object):
 
@@ -128,12 +131,29 @@ class Block(object):
         h.update(self._link_bytes)
         return h.digest()
 
+    def _field_bytes(self, data, length):
+        """
+        Convert a field to bytes of length, empty bytes if it's not set or not legal.
+        One strict fast path per input type, instead of the generic to_bytes().
+        """
+
+        if data is None:
+            return b''
+        try:
+            if isinstance(data, str):
+                return hex_to_bytes(data, length)
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                return buffer_to_bytes(data, length)
+        except ValueError:
+            pass
+        return b''
+
     def _to_verifying_key(self, data):
         """
         Convert data to verifying key if legal, return bytes.
         """
 
-        vk = to_bytes(data, 32)
+        vk = self._field_bytes(data, 32)
         if not vk and isinstance(data, str) and address_valid(data):
             vk = address_to_verifying_key(data)
         return vk
@@ -143,7 +163,7 @@ class Block(object):
         Convert data to 128-bits bytes if legal, return bytes.
         """
 
-        balance = to_bytes(data, 16)
+        balance = self._field_bytes(data, 16)
         if not balance and isinstance(data, int):
             balance = int_to_bytes(data, 128)
         return balance
@@ -153,19 +173,19 @@ class Block(object):
         Convert all available fields to bytes.
         """
 
-        self._previous_bytes = to_bytes(self.previous, 32)
-        self._source_bytes = to_bytes(self.source, 32)
+        self._previous_bytes = self._field_bytes(self.previous, 32)
+        self._source_bytes = self._field_bytes(self.source, 32)
 
         self._balance_bytes = self._to_balance(self.balance)
 
         self._destination_bytes = self._to_verifying_key(self.destination)
         self._account_bytes = self._to_verifying_key(self.account)
         self._representative_bytes = self._to_verifying_key(self.representative)
-        self._link_bytes = to_bytes(self.link, 32)
+        self._link_bytes = self._field_bytes(self.link, 32)
 
-        self._signature_bytes = to_bytes(self.signature, 64)
-        self._work_bytes = to_bytes(self.work, 8)
-        self._next_bytes = to_bytes(self.next, 32)
+        self._signature_bytes = self._field_bytes(self.signature, 64)
+        self._work_bytes = self._field_bytes(self.work, 8)
+        self._next_bytes = self._field_bytes(self.next, 32)
 
     def _validate_fields(self):
         """
@@ -385,19 +405,47 @@ class Block(object):
 
     def to_storage_bytes(self):
         packed_bytes = self._pack()
-        next_bytes = to_bytes(self.next, 32)
-        packed_bytes += next_bytes
+        # _pack() has already prepared _next_bytes.
+        packed_bytes += self._next_bytes
         return packed_bytes
 
-    def from_network_bytes(self, data):
+    def from_network_bytes(self, data, copy=True):
         """
         Should pass sliced data from network (remove `type` field and the 3 previous fields in packets.)
+        With copy=False, a memoryview is sliced without copy, see detach().
         """
-        packed_bytes = to_bytes(data)
+        packed_bytes = to_bytes(data, copy=copy)
         self._unpack(packed_bytes)
 
-    def from_storage_bytes(self, data):
-        packed_bytes = to_bytes(data)
-        self._next_bytes = packed_bytes[-32:]
+    def from_storage_bytes(self, data, copy=True):
+        """
+        With copy=False, a memoryview (e.g. from a Snapshot with buffers=True) is sliced without copy,
+        the fields are only valid while the memory is alive, call detach() to keep the block longer.
+        """
+        packed_bytes = to_bytes(data, copy=copy)
+        self.next = packed_bytes[-32:]
+        self._next_bytes = self.next
         self._unpack(packed_bytes[:-32])
 
+    def _set_hash_bytes(self, hash_bytes):
+        """
+        Set the hash of a block read from storage: the raw bytes (or memoryview) in _hash_bytes,
+        the hex string in hash, like everywhere else.
+        """
+
+        self._hash_bytes = hash_bytes
+        self.hash = hash_bytes.hex().upper()
+
+    def detach(self):
+        """
+        Copy the memoryview fields left by from_storage_bytes(copy=False) to bytes, return self.
+        """
+
+        for name in ['previous', 'source', 'balance', 'destination', 'account', 'representative', 'link',
+                     'signature', 'work', 'hash', 'next', '_next_bytes', '_hash_bytes']:
+            value = getattr(self, name)
+            if isinstance(value, memoryview):
+                setattr(self, name, bytes(value))
+
+        return self
+
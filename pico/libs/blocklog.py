@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+import struct
+
+from .block import BLOCK_TYPES
+
+# the storage bytes length of every block type: the packed block of Block._pack() and the next hash.
+STORAGE_LENGTHS = {'open': 200, 'send': 184, 'receive': 168, 'change': 168, 'state': 248}
+
+# log file: header, then fixed size records: type code(1) + block hash(32) + storage bytes padded to RECORD_DATA.
+LOG_MAGIC = b'PICOLOG1'
+LOG_HEADER = struct.Struct('>8sI4x')
+RECORD_DATA = max(STORAGE_LENGTHS.values())
+RECORD_SIZE = 1 + 32 + RECORD_DATA
+
+# index file: header with the number of records it covers, then (block hash(32) + record number(8)) sorted by hash.
+INDEX_MAGIC = b'PICOIDX1'
+INDEX_HEADER = struct.Struct('>8sQ')
+INDEX_ENTRY = 40
+
+WRITE_BUFFER = 1024 * 1024
+
+
+class BlockLog(object):
+
+    def __init__(self, path, readonly=True):
+        """
+        An append-only file of blocks, path, and its sorted hash index, path + '.idx':
+
+            with BlockLog(path, readonly=False) as log:
+                log.append('state', block_hash, data)
+
+            with BlockLog(path) as log:
+                block_type, data = log.get(block_hash)
+
+        Records have a fixed size and type codes of rai/lib/blocks.hpp, appends are buffered sequential writes.
+        The index is written by close(), sorted in memory. Readers map both files and binary search the
+        index, nothing is loaded. Records appended after the index (e.g. a crash before close()) are found
+        by a scan of the tail, until the next close() of a writer. A writer drops the partial record a crash
+        in the middle of an append may leave at the end. A reader of a file with no header yet sees no records.
+        """
+
+        self.path       = path
+        self.index_path = path + '.idx'
+        self.readonly   = readonly
+        self._file      = None
+        self._log       = None
+        self._index     = None
+
+        if readonly:
+            self._open_maps()
+        else:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size >= LOG_HEADER.size:
+                self._check_header(path)
+                partial = (size - LOG_HEADER.size) % RECORD_SIZE
+            else:
+                partial = size
+            if partial:
+                os.truncate(path, size - partial)
+            self._file = open(path, 'ab', buffering=WRITE_BUFFER)
+            if size < LOG_HEADER.size:
+                self._file.write(LOG_HEADER.pack(LOG_MAGIC, RECORD_SIZE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _check_header(self, path):
+        with open(path, 'rb') as f:
+            magic, record_size = LOG_HEADER.unpack(f.read(LOG_HEADER.size))
+        if magic != LOG_MAGIC or record_size != RECORD_SIZE:
+            raise ValueError('not a block log: %s' % path)
+
+    def _open_maps(self):
+        self._indexed = 0
+        if os.path.getsize(self.path) < LOG_HEADER.size:
+            return
+
+        with open(self.path, 'rb') as f:
+            self._log = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, record_size = LOG_HEADER.unpack(self._log[:LOG_HEADER.size])
+        if magic != LOG_MAGIC or record_size != RECORD_SIZE:
+            raise ValueError('not a block log: %s' % self.path)
+
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) > INDEX_HEADER.size:
+            with open(self.index_path, 'rb') as f:
+                self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self._indexed = INDEX_HEADER.unpack(self._index[:INDEX_HEADER.size])
+            if magic != INDEX_MAGIC:
+                raise ValueError('not a block log index: %s' % self.index_path)
+
+    def __len__(self):
+        if self.readonly:
+            return (len(self._log) - LOG_HEADER.size) // RECORD_SIZE if self._log is not None else 0
+        self._file.flush()
+        return (os.path.getsize(self.path) - LOG_HEADER.size) // RECORD_SIZE
+
+    def append(self, block_type, block_hash, data):
+        """
+        Append a block: block_type name, 32 bytes hash and its storage bytes.
+        """
+
+        if STORAGE_LENGTHS.get(block_type) != len(data) or len(block_hash) != 32:
+            raise ValueError('invalid %s block: %d bytes' % (block_type, len(data)))
+        self._file.write(bytes([BLOCK_TYPES.index(block_type) + 2]) + bytes(block_hash) + bytes(data)
+                         + bytes(RECORD_DATA - len(data)))
+
+    def append_blocks(self, blocks):
+        """
+        Append an iterable of (block_type, block_hash, data), return how many were appended.
+        """
+
+        count = 0
+        for block_type, block_hash, data in blocks:
+            self.append(block_type, block_hash, data)
+            count += 1
+        return count
+
+    def _record(self, number):
+        """
+        Return (block_type, block_hash, data) of a record.
+        """
+
+        offset = LOG_HEADER.size + number * RECORD_SIZE
+        block_type = BLOCK_TYPES[self._log[offset] - 2]
+        block_hash = self._log[offset + 1:offset + 33]
+        return block_type, block_hash, self._log[offset + 33:offset + 33 + STORAGE_LENGTHS[block_type]]
+
+    def get(self, block_hash):
+        """
+        Return (block_type, data) of a block, (None, None) if not found. Binary search of the index.
+        """
+
+        if not self.readonly:
+            raise ValueError('lookups need a readonly BlockLog')
+
+        block_hash = bytes(block_hash)
+        index = self._index
+        lo, hi = 0, self._indexed
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = INDEX_HEADER.size + mid * INDEX_ENTRY
+            key = index[offset:offset + 32]
+            if key < block_hash:
+                lo = mid + 1
+            elif key > block_hash:
+                hi = mid
+            else:
+                number = int.from_bytes(index[offset + 32:offset + 40], 'big')
+                block_type, _, data = self._record(number)
+                return block_type, data
+
+        for number in range(self._indexed, len(self)):
+            block_type, key, data = self._record(number)
+            if key == block_hash:
+                return block_type, data
+
+        return None, None
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        """
+        Yield (block_type, block_hash, data) in append order, from record number start.
+        """
+
+        if not self.readonly:
+            raise ValueError('reading needs a readonly BlockLog')
+
+        for number in range(start, len(self)):
+            yield self._record(number)
+
+    def read(self, number):
+        """
+        Return (block_type, block_hash, data) of a record by number, in O(1).
+        """
+
+        if not self.readonly:
+            raise ValueError('reading needs a readonly BlockLog')
+        if not 0 <= number < len(self):
+            raise IndexError('no record %d' % number)
+        return self._record(number)
+
+    def close(self):
+        """
+        Writer: flush the appends and write the index of the whole log. Reader: unmap the files.
+        """
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            write_index(self.path)
+
+        for m in [self._log, self._index]:
+            if m is not None:
+                m.close()
+        self._log = None
+        self._index = None
+
+
+def write_index(path):
+    """
+    Write the sorted hash index of the log at path, to path + '.idx'. The hashes are sorted in memory.
+    """
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        count = (size - LOG_HEADER.size) // RECORD_SIZE
+        entries = []
+        if count:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as log:
+                for number in range(count):
+                    offset = LOG_HEADER.size + number * RECORD_SIZE + 1
+                    entries.append(log[offset:offset + 32] + number.to_bytes(8, 'big'))
+    entries.sort()
+
+    tmp_path = path + '.idx.tmp'
+    with open(tmp_path, 'wb', buffering=WRITE_BUFFER) as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, count))
+        f.write(b''.join(entries))
+    os.replace(tmp_path, path + '.idx')
+    return count
+
+
+def storage_to_log(storage, path):
+    """
+    Append every block of a Storage to the BlockLog at path, return how many were appended.
+    """
+
+    with BlockLog(path, readonly=False) as log:
+        return log.append_blocks(storage.iter_block_items())
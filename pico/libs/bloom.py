@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import math
+import os
+import struct
+import threading
+from pyblake2 import blake2b
+
+BLOOM_MAGIC = b'PICOBLM1'
+# magic, bits, hashes, count, tag
+BLOOM_HEADER = struct.Struct('>8sQIQQ')
+
+
+class BloomFilter(object):
+
+    def __init__(self, bits, hashes, count=0, data=None):
+        """
+        A Bloom filter of block hashes: `key in bloom` is False only if the key was never added.
+        Block hashes are already uniformly distributed, so the bit positions are derived from the
+        key itself with double hashing, other keys are hashed with blake2b first.
+        """
+
+        self.bits       = bits
+        self.hashes     = hashes
+        self.count      = count
+        self.data       = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+        self._lock      = threading.Lock()
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.01):
+        """
+        Create a filter sized for capacity keys at the given false positive rate.
+        """
+
+        capacity = max(capacity, 1)
+        bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        hashes = max(1, int(round(bits / capacity * math.log(2))))
+        return cls(bits, hashes)
+
+    def _positions(self, key):
+        if len(key) < 16:
+            key = blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(key[0:8], 'little')
+        h2 = int.from_bytes(key[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            for pos in positions:
+                self.data[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, key):
+        data = self.data
+        for pos in self._positions(key):
+            if not data[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def false_positive_rate(self):
+        """
+        Expected false positive rate with the keys added so far.
+        """
+
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    def save(self, path, tag=0):
+        """
+        Write the filter to path atomically, tag is stored to check the filter is still current on load.
+        """
+
+        tmp_path = path + '.tmp'
+        with self._lock, open(tmp_path, 'wb') as f:
+            f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.bits, self.hashes, self.count, tag))
+            f.write(self.data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return (filter, tag) read from path, (None, None) if the file is missing or invalid.
+        """
+
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(BLOOM_HEADER.size)
+                magic, bits, hashes, count, tag = BLOOM_HEADER.unpack(header)
+                data = f.read()
+        except (OSError, struct.error):
+            return None, None
+
+        if magic != BLOOM_MAGIC or len(data) != (bits + 7) // 8:
+            return None, None
+
+        return cls(bits, hashes, count, data), tag
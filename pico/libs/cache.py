@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import OrderedDict
+
+# bytes counted for every entry besides the value: the key, the OrderedDict node and the bytes objects.
+ENTRY_OVERHEAD = 160
+
+
+class LRUCache(object):
+
+    def __init__(self, max_bytes):
+        """
+        A thread-safe LRU cache of bytes values, bounded by the total size of the entries.
+        Writers must call invalidate() after changing the backing store. A reader that missed calls
+        token() before reading the backing store and fill() after, the fill is dropped if any
+        invalidation happened in between, so a stale value never gets in.
+        """
+
+        self.max_bytes      = max_bytes
+        self.size           = 0
+        self.hits           = 0
+        self.misses         = 0
+        self.evictions      = 0
+
+        self._entries       = OrderedDict()
+        self._lock          = threading.Lock()
+        self._generation    = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return the cached value or None, count a hit or a miss.
+        """
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def token(self):
+        return self._generation
+
+    def fill(self, key, value, token):
+        """
+        Add a value read from the backing store, unless an invalidation happened since token().
+        """
+
+        entry_size = len(value) + ENTRY_OVERHEAD
+        if entry_size > self.max_bytes:
+            return
+
+        with self._lock:
+            if token != self._generation:
+                return
+
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old) + ENTRY_OVERHEAD
+            self._entries[key] = value
+            self.size += entry_size
+
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted) + ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        """
+        Drop keys from the cache, and reject the fills of reads that began before.
+        """
+
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self.size -= len(old) + ENTRY_OVERHEAD
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries':      len(self._entries),
+                'size':         self.size,
+                'max_bytes':    self.max_bytes,
+                'hits':         self.hits,
+                'misses':       self.misses,
+                'evictions':    self.evictions,
+                'hit_rate':     self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+from .cache import LRUCache
+
+# the storage bytes of a state block: account, previous, representative, balance, link, signature, work, next.
+STATE_STORAGE_LENGTH = 248
+ZERO_HASH = bytes(32)
+
+# flags of a compact state value, for the 32 bytes fields that are often zero and then omitted.
+FLAG_PREVIOUS_ZERO  = 1
+FLAG_LINK_ZERO      = 2
+FLAG_NEXT_ZERO      = 4
+
+KEYS_TABLE = b'keydict'         # key(32) -> varint id
+IDS_TABLE = b'keydict_ids'      # id(8) -> key(32)
+KEY_CACHE_SIZE = 16 * 1024 * 1024
+
+
+def varint_encode(i):
+    """
+    Encode a non-negative int as LEB128 bytes.
+    """
+
+    out = bytearray()
+    while True:
+        byte = i & 0x7f
+        i >>= 7
+        if i:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def varint_decode(data, pos=0):
+    """
+    Decode a LEB128 int at pos, return (int, next pos).
+    """
+
+    i = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        i |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return i, pos
+        shift += 7
+
+
+class KeyDictionary(object):
+
+    def __init__(self, cache_size=KEY_CACHE_SIZE):
+        """
+        Map 32 bytes account/representative keys to small sequential ids, in the KEYS_TABLE and IDS_TABLE.
+        Ids are assigned in the write transaction of the block, so they are committed together.
+        A committed id never changes, so id -> key lookups are cached.
+        """
+
+        self._keys = LRUCache(cache_size)
+
+    def get_id(self, txn, keys_db, ids_db, key):
+        """
+        Return the id of key, assign the next id if it's new.
+        """
+
+        id_bytes = txn.get(key, db=keys_db)
+        if id_bytes is not None:
+            return varint_decode(id_bytes)[0]
+
+        key_id = txn.stat(ids_db)['entries']
+        txn.put(key, varint_encode(key_id), db=keys_db)
+        txn.put(key_id.to_bytes(8, 'big'), key, db=ids_db)
+        return key_id
+
+    def get_key(self, key_id, get):
+        """
+        Return the key of an id, get(db_name, key_bytes) reads from the database on a cache miss.
+        """
+
+        key = self._keys.get(key_id)
+        if key is None:
+            token = self._keys.token()
+            key = get(IDS_TABLE, key_id.to_bytes(8, 'big'))
+            if key is None:
+                raise ValueError('unknown key id: %d' % key_id)
+            key = bytes(key)
+            self._keys.fill(key_id, key, token)
+        return key
+
+    def encode_state(self, txn, keys_db, ids_db, data):
+        """
+        Encode the storage bytes of a state block:
+        flags(1) + account id + representative id (varints) + [previous(32)] + balance length(1) + balance
+        + [link(32)] + signature(64) + work(8) + [next(32)], the [] fields are omitted if zero.
+        """
+
+        data = bytes(data)
+        account, previous, representative = data[0:32], data[32:64], data[64:96]
+        balance, link, signature_work, next_hash = data[96:112], data[112:144], data[144:216], data[216:248]
+
+        flags = 0
+        if previous == ZERO_HASH:
+            flags |= FLAG_PREVIOUS_ZERO
+        if link == ZERO_HASH:
+            flags |= FLAG_LINK_ZERO
+        if next_hash == ZERO_HASH:
+            flags |= FLAG_NEXT_ZERO
+
+        balance = balance.lstrip(b'\x00')
+        parts = [bytes([flags]),
+                 varint_encode(self.get_id(txn, keys_db, ids_db, account)),
+                 varint_encode(self.get_id(txn, keys_db, ids_db, representative)),
+                 b'' if flags & FLAG_PREVIOUS_ZERO else previous,
+                 bytes([len(balance)]), balance,
+                 b'' if flags & FLAG_LINK_ZERO else link,
+                 signature_work,
+                 b'' if flags & FLAG_NEXT_ZERO else next_hash]
+        return b''.join(parts)
+
+    def decode_state(self, value, get):
+        """
+        Reverse encode_state(), return the exact storage bytes.
+        """
+
+        flags = value[0]
+        account_id, pos = varint_decode(value, 1)
+        representative_id, pos = varint_decode(value, pos)
+
+        if flags & FLAG_PREVIOUS_ZERO:
+            previous = ZERO_HASH
+        else:
+            previous, pos = value[pos:pos + 32], pos + 32
+
+        balance_length = value[pos]
+        balance = bytes(16 - balance_length) + bytes(value[pos + 1:pos + 1 + balance_length])
+        pos += 1 + balance_length
+
+        if flags & FLAG_LINK_ZERO:
+            link = ZERO_HASH
+        else:
+            link, pos = value[pos:pos + 32], pos + 32
+
+        signature_work, pos = value[pos:pos + 72], pos + 72
+        next_hash = ZERO_HASH if flags & FLAG_NEXT_ZERO else value[pos:pos + 32]
+
+        return b''.join([self.get_key(account_id, get), bytes(previous), self.get_key(representative_id, get),
+                         balance, bytes(link), bytes(signature_work), bytes(next_hash)])
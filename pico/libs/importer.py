@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+
+from .block import Block, BLOCK_TYPES
+from .storage import Storage, BATCH_SIZE
+
+
+REPORT_INTERVAL = 5
+# chunks being decoded per worker, bounds the memory used by an import.
+CHUNKS_PER_WORKER = 2
+
+
+def print_progress(progress):
+    print('{table}: {imported} imported, {skipped} skipped, {blocks_per_sec:.0f} blocks/sec'.format(**progress))
+
+
+def _decode_chunk(job):
+    """
+    Worker: decode every record of a chunk with Block.from_storage_bytes(), optionally check the hash.
+    Return (good items, skipped count, last key of the chunk).
+    """
+
+    block_type, items, verify = job
+    good = []
+    skipped = 0
+    for key, value in items:
+        block = Block(type=block_type)
+        try:
+            block.from_storage_bytes(value)
+            if verify and block.calculate_hash() != key:
+                raise ValueError('hash not match')
+        except Exception:
+            skipped += 1
+            continue
+        good.append((key, value))
+
+    return good, skipped, items[-1][0]
+
+
+def _decode_in_order(pool, workers, block_type, verify, chunks):
+    """
+    Yield the decoded chunks in order, with at most CHUNKS_PER_WORKER chunks per worker in flight,
+    so the source is not read faster than it's written. Without a pool, chunks are decoded in this process.
+    """
+
+    if pool is None:
+        for items in chunks:
+            yield _decode_chunk((block_type, items, verify))
+        return
+
+    pending = deque()
+    for items in chunks:
+        pending.append(pool.apply_async(_decode_chunk, ((block_type, items, verify), )))
+        if len(pending) >= workers * CHUNKS_PER_WORKER:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+def _load_checkpoint(checkpoint_path):
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            return json.load(f)
+    return {'done': [], 'table': None, 'after': None}
+
+
+def _save_checkpoint(checkpoint_path, checkpoint):
+    if checkpoint_path:
+        tmp_path = checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, checkpoint_path)
+
+
+def import_ledger(source_path, storage, tables=BLOCK_TYPES, workers=None, verify=False,
+                  batch_size=BATCH_SIZE, checkpoint_path=None, report=print_progress, report_interval=REPORT_INTERVAL):
+    """
+    Stream the block tables of a reference node data.ldb into a pico Storage.
+    Records are read in chunks of batch_size, decoded, and each chunk is written with one put_blocks()
+    transaction. With verify=True, the hashes are checked in worker processes. Without, decoding only checks
+    lengths and runs in this process: shipping the chunks to workers would cost more than the work.
+    Records that don't decode, e.g. from a newer database layout, are skipped and counted.
+    After every chunk, the position is saved to checkpoint_path, so an interrupted import resumes there.
+    report(progress) is called every report_interval seconds and at the end of each table.
+    Return the progress dict of the whole import.
+    """
+
+    source = Storage(source_path, readonly=True)
+    source_tables = source._get_db_names()
+    checkpoint = _load_checkpoint(checkpoint_path)
+
+    progress = {'table': None, 'imported': 0, 'skipped': 0, 'elapsed': 0.0, 'blocks_per_sec': 0.0}
+    start_time = time.time()
+    last_report = start_time
+
+    workers = workers or os.cpu_count()
+    pool = multiprocessing.get_context('spawn').Pool(workers) if verify else None
+    try:
+        for block_type in tables:
+            if block_type in checkpoint['done'] or block_type.encode() not in source_tables:
+                continue
+
+            after = None
+            if checkpoint['table'] == block_type and checkpoint['after']:
+                after = bytes.fromhex(checkpoint['after'])
+
+            progress['table'] = block_type
+            for good, skipped, last_key in _decode_in_order(pool, workers, block_type, verify,
+                                                            source.iter_batches(block_type, batch=batch_size, after=after)):
+                storage.put_blocks(((block_type, key, value) for key, value in good), batch_size=0)
+
+                checkpoint['table'] = block_type
+                checkpoint['after'] = last_key.hex()
+                _save_checkpoint(checkpoint_path, checkpoint)
+
+                progress['imported'] += len(good)
+                progress['skipped'] += skipped
+                now = time.time()
+                progress['elapsed'] = now - start_time
+                progress['blocks_per_sec'] = progress['imported'] / progress['elapsed'] if progress['elapsed'] else 0.0
+                if report and now - last_report >= report_interval:
+                    report(dict(progress))
+                    last_report = now
+
+            checkpoint['done'].append(block_type)
+            checkpoint['table'] = None
+            checkpoint['after'] = None
+            _save_checkpoint(checkpoint_path, checkpoint)
+            if report:
+                report(dict(progress))
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    source.close()
+    return progress
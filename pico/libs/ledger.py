@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+import struct
+from pyblake2 import blake2b
+
+from .block import STATE_BLOCK_PREAMBLE
+from .types_convert import to_bytes
+from .weights import RepWeights
+
+ZERO_HASH = bytes(32)
+
+# snapshot file: header, then the account records sorted by account, then the pending send records,
+# then the weight records in representative id order.
+#   header:  magic, position, last block hash, skipped count, account count, pending count,
+#            weight count (-1 if weights are not kept)
+#   account: account(32) + frontier(32) + representative(32) + balance(16, as 2 Q) + height(8)
+#   pending: send hash(32) + destination(32) + amount(16, as 2 Q)
+#   weight:  representative(32) + weight(16, as 2 Q)
+SNAPSHOT_MAGIC = b'PICOSTA2'
+SNAPSHOT_HEADER = struct.Struct('>8sQ32sQQQq')
+ACCOUNT_RECORD = struct.Struct('>32s32s32sQQQ')
+PENDING_RECORD = struct.Struct('>32s32sQQ')
+WEIGHT_RECORD = struct.Struct('>32sQQ')
+LOW_64 = (1 << 64) - 1
+
+# the fields of an account in LedgerState.accounts.
+FRONTIER, BALANCE, REPRESENTATIVE, HEIGHT = range(4)
+
+
+class LedgerState(object):
+
+    def __init__(self):
+        """
+        The derived state of a ledger, kept in memory and updated by apply() in block order:
+
+            accounts:  account -> [frontier, balance, representative, height]
+            frontiers: frontier hash -> account, to find the account of legacy blocks
+            pending:   send hash -> (destination, amount), sends not received yet
+
+        The voting weights of the representatives are kept in weights if set, see RepWeights,
+        and saved in the snapshot with the rest, so they are always at the same position.
+        position counts the blocks passed to apply(), last_hash is the last one: together they tag a snapshot
+        with its place in the ordered block source it was built from, see restore().
+        """
+
+        self.accounts   = {}
+        self.frontiers  = {}
+        self.pending    = {}
+        self.position   = 0
+        self.last_hash  = ZERO_HASH
+        self.skipped    = 0
+        self.weights    = None  # a RepWeights to keep up to date, optional
+
+    def get_balance(self, account):
+        info = self.accounts.get(bytes(account))
+        return 0 if info is None else info[BALANCE]
+
+    def get_frontier(self, account):
+        info = self.accounts.get(bytes(account))
+        return None if info is None else info[FRONTIER]
+
+    def get_representative(self, account):
+        info = self.accounts.get(bytes(account))
+        return None if info is None else info[REPRESENTATIVE]
+
+    def apply(self, block_type, block_hash, data):
+        """
+        Apply a block in storage bytes layout. Legacy blocks find their account through the frontier
+        they extend, a block whose account is unknown is counted in skipped and left out.
+        Receives take their amount from pending, 0 if the send is unknown.
+        """
+
+        block_hash = bytes(block_hash)
+        self.position += 1
+        self.last_hash = block_hash
+
+        if block_type == 'state':
+            account, representative = bytes(data[0:32]), bytes(data[64:96])
+            balance = int.from_bytes(data[96:112], 'big')
+            link = bytes(data[112:144])
+            info = self.accounts.get(account)
+            previous_balance = 0 if info is None else info[BALANCE]
+            if balance < previous_balance:
+                self.pending[block_hash] = (link, previous_balance - balance)
+            elif balance > previous_balance:
+                self.pending.pop(link, None)
+
+        elif block_type == 'open':
+            source, representative, account = bytes(data[0:32]), bytes(data[32:64]), bytes(data[64:96])
+            info = None
+            balance = self.pending.pop(source, (None, 0))[1]
+
+        else:
+            previous = bytes(data[0:32])
+            account = self.frontiers.get(previous)
+            info = self.accounts.get(account)
+            if info is None:
+                self.skipped += 1
+                return False
+            representative = info[REPRESENTATIVE]
+            balance = info[BALANCE]
+            if block_type == 'send':
+                balance = int.from_bytes(data[64:80], 'big')
+                self.pending[block_hash] = (bytes(data[32:64]), info[BALANCE] - balance)
+            elif block_type == 'receive':
+                balance += self.pending.pop(bytes(data[32:64]), (None, 0))[1]
+            elif block_type == 'change':
+                representative = bytes(data[32:64])
+
+        if info is None:
+            info = self.accounts[account] = [ZERO_HASH, 0, None, 0]
+        if self.weights is not None:
+            self.weights.move(info[REPRESENTATIVE], info[BALANCE], representative, balance)
+        self.frontiers.pop(info[FRONTIER], None)
+        self.frontiers[block_hash] = account
+        info[FRONTIER] = block_hash
+        info[BALANCE] = balance
+        info[REPRESENTATIVE] = representative
+        info[HEIGHT] += 1
+        return True
+
+    def apply_blocks(self, blocks):
+        """
+        Apply an iterable of (block_type, block_hash, data), return how many were applied.
+        """
+
+        count = 0
+        for block_type, block_hash, data in blocks:
+            if self.apply(block_type, block_hash, data):
+                count += 1
+        return count
+
+    def save(self, path):
+        """
+        Write the state to path, atomically.
+        """
+
+        tmp_path = path + '.tmp'
+        weights = self.weights
+        with open(tmp_path, 'wb', buffering=1024 * 1024) as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.position, self.last_hash, self.skipped,
+                                         len(self.accounts), len(self.pending),
+                                         -1 if weights is None else len(weights)))
+            pack = ACCOUNT_RECORD.pack
+            for account in sorted(self.accounts):
+                frontier, balance, representative, height = self.accounts[account]
+                f.write(pack(account, frontier, representative, balance >> 64, balance & LOW_64, height))
+            pack = PENDING_RECORD.pack
+            for send_hash, (destination, amount) in self.pending.items():
+                f.write(pack(send_hash, destination, amount >> 64, amount & LOW_64))
+            if weights is not None:
+                pack = WEIGHT_RECORD.pack
+                for representative, weight in zip(weights.reps, weights.weights):
+                    f.write(pack(representative, weight >> 64, weight & LOW_64))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a snapshot written by save(), None if there is no file.
+        The records are unpacked straight from the mapped file by struct.iter_unpack().
+        """
+
+        if not os.path.exists(path):
+            return None
+
+        state = cls()
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, memoryview(m) as view:
+            magic = bytes(view[:len(SNAPSHOT_MAGIC)])
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError('not a ledger snapshot: %s' % path)
+            header = SNAPSHOT_HEADER.unpack_from(view)
+            _, state.position, state.last_hash, state.skipped, accounts, pending, weights = header
+
+            start = SNAPSHOT_HEADER.size
+            end = start + accounts * ACCOUNT_RECORD.size
+            state.accounts = {
+                account: [frontier, high << 64 | low, representative, height]
+                for account, frontier, representative, high, low, height
+                in ACCOUNT_RECORD.iter_unpack(view[start:end])
+            }
+            start = end
+            end = start + pending * PENDING_RECORD.size
+            state.pending = {
+                send_hash: (destination, high << 64 | low)
+                for send_hash, destination, high, low
+                in PENDING_RECORD.iter_unpack(view[start:end])
+            }
+            if weights >= 0:
+                # every representative is dirty: the next RepWeights.save() writes the table at this position.
+                state.weights = RepWeights()
+                with view[end:end + weights * WEIGHT_RECORD.size] as records:
+                    for representative, high, low in WEIGHT_RECORD.iter_unpack(records):
+                        state.weights.add(representative, high << 64 | low)
+
+        state.frontiers = {info[FRONTIER]: account for account, info in state.accounts.items()}
+        return state
+
+
+def restore(snapshot_path, log, weights=False):
+    """
+    Return the LedgerState of the blocks of a BlockLog (readonly): load the snapshot and apply only the
+    records after it. If there is no snapshot, or it doesn't match the log, start over from the first record.
+    The weights saved in the snapshot are restored and kept up to date with it. With weights=True, or if the
+    snapshot kept weights, the returned state keeps them even if it starts over or the snapshot has none.
+    """
+
+    state = LedgerState.load(snapshot_path)
+    if state is not None:
+        weights = weights or state.weights is not None
+        if state.position and (state.position > len(log)
+                               or bytes(log.read(state.position - 1)[1]) != state.last_hash):
+            state = None
+
+    if state is None:
+        state = LedgerState()
+    if weights and state.weights is None:
+        state.weights = RepWeights.from_state(state)
+
+    state.apply_blocks(log.iter_from(state.position))
+    return state
+
+
+# blocks written to Storage per transaction by Ledger.
+LEDGER_BATCH_SIZE = 10000
+
+# Ledger.apply() results, the first four are applied.
+APPLIED = ['open', 'send', 'receive', 'change']
+REJECTED = ['old', 'fork', 'gap_previous', 'gap_source', 'bad_amount', 'bad_length', 'bad_hash']
+
+
+def state_block_hash(data):
+    """
+    Hash of a state block in packed or storage bytes layout, the same as Block.calculate_hash().
+    """
+
+    h = blake2b(digest_size=32)
+    h.update(STATE_BLOCK_PREAMBLE)
+    h.update(data[0:144])
+    return h.digest()
+
+
+class Ledger(object):
+
+    def __init__(self, storage=None, state=None, log=None, batch_size=LEDGER_BATCH_SIZE, unchecked=None,
+                 check_hash=True):
+        """
+        Apply state blocks to a LedgerState, each in O(1) with dict lookups:
+        the previous must be the account frontier (or zero for a new account), the balance delta tells
+        a send (< 0) from a receive (> 0, the link must be a pending send to this account of that amount)
+        and a change (= 0).
+        Applied blocks are written to storage every batch_size blocks, with the next field of their
+        previous block set, and appended to log (a writable BlockLog) so restore() can replay them.
+        process() keeps the blocks with a gap in unchecked, an UncheckedCache, until their dependency is applied.
+        With check_hash, apply() rejects a block whose hash is not the hash of its data as bad_hash.
+        Turn it off only if every (block_hash, data) pair passed in was verified before: the ledger is keyed
+        by these hashes, a wrong one corrupts the frontiers and pending sends for good.
+        """
+
+        self.state          = state if state is not None else LedgerState()
+        self.storage        = storage
+        self.log            = log
+        self.batch_size     = batch_size
+        self.unchecked      = unchecked
+        self.check_hash     = check_hash
+        self.results        = dict.fromkeys(APPLIED + REJECTED, 0)
+        self._writes        = {}    # block hash -> bytearray storage bytes, waiting for the next flush
+        self._next_links    = {}    # previous hash not in _writes -> hash of the block after it
+
+    def apply_block(self, block):
+        """
+        Apply a state Block, see apply(). Its hash, hex or bytes, is calculated if not set.
+        """
+
+        block._prepare_block()
+        block_hash = to_bytes(block.hash, 32, strict=True) if block.hash else block.calculate_hash()
+        data = (block._account_bytes + block._previous_bytes + block._representative_bytes + block._balance_bytes
+                + block._link_bytes + block._signature_bytes + block._work_bytes)
+        return self.apply(block_hash, data)
+
+    def apply(self, block_hash, data):
+        """
+        Apply a state block of 216 packed bytes or 248 storage bytes, return its result: a name in APPLIED
+        if applied, in REJECTED if not. The hash is checked against data unless check_hash is off,
+        signatures and work are not checked here.
+        """
+
+        result = self._check(block_hash, data)
+        self.results[result] += 1
+        if result not in APPLIED:
+            return result
+
+        block_hash = bytes(block_hash)
+        storage_bytes = bytearray(data[:216]) + ZERO_HASH
+        self.state.apply('state', block_hash, storage_bytes)
+        if self.log is not None:
+            self.log.append('state', block_hash, storage_bytes)
+
+        if self.storage is not None:
+            previous = bytes(data[32:64])
+            if previous in self._writes:
+                self._writes[previous][216:248] = block_hash
+            elif previous != ZERO_HASH:
+                self._next_links[previous] = block_hash
+            self._writes[block_hash] = storage_bytes
+            if len(self._writes) >= self.batch_size:
+                self.flush()
+
+        return result
+
+    def process(self, block_hash, data):
+        """
+        apply() a block, keep it in unchecked if its previous or source is missing, and if it's applied,
+        apply the blocks waiting for it, then the blocks waiting for those, and so on.
+        Return its result.
+        """
+
+        result = self.apply(block_hash, data)
+        if result in ['gap_previous', 'gap_source'] and self.unchecked is not None:
+            self.unchecked.add(data[32:64] if result == 'gap_previous' else data[112:144], block_hash, data)
+        elif result in APPLIED and self.unchecked is not None:
+            released = 0
+            arrived = [block_hash]
+            while arrived:
+                for waiting_hash, waiting_data in self.unchecked.release(arrived.pop()):
+                    released += 1
+                    waiting_result = self.apply(waiting_hash, waiting_data)
+                    if waiting_result in APPLIED:
+                        arrived.append(waiting_hash)
+                    elif waiting_result == 'gap_source':
+                        # the previous arrived, the source is still missing.
+                        self.unchecked.add(waiting_data[112:144], waiting_hash, waiting_data)
+            self.unchecked.record_arrival(released)
+        return result
+
+    def _check(self, block_hash, data):
+        if len(data) not in (216, 248):
+            return 'bad_length'
+        if self.check_hash and state_block_hash(data) != bytes(block_hash):
+            return 'bad_hash'
+
+        account = bytes(data[0:32])
+        previous = bytes(data[32:64])
+        balance = int.from_bytes(data[96:112], 'big')
+        info = self.state.accounts.get(account)
+
+        if info is None:
+            if previous != ZERO_HASH:
+                return 'gap_previous'
+            previous_balance = 0
+        elif previous != info[FRONTIER]:
+            if bytes(block_hash) == info[FRONTIER] or self._known(block_hash):
+                return 'old'
+            # another block already follows previous, or previous didn't arrive yet.
+            return 'fork' if self._known(previous) else 'gap_previous'
+        else:
+            previous_balance = info[BALANCE]
+
+        if balance < previous_balance:
+            return 'send'
+        if balance == previous_balance:
+            return 'change' if info is not None else 'gap_source'
+
+        pending = self.state.pending.get(bytes(data[112:144]))
+        if pending is None or pending[0] != account:
+            return 'gap_source'
+        if pending[1] != balance - previous_balance:
+            return 'bad_amount'
+        return 'open' if info is None else 'receive'
+
+    def _known(self, block_hash):
+        """
+        True if the block was applied, only blocks written to storage or waiting for the next flush are known:
+        without storage, a block whose previous is not the frontier is always a gap.
+        """
+
+        block_hash = bytes(block_hash)
+        return block_hash in self._writes or (self.storage is not None and self.storage.block_known(block_hash))
+
+    def flush(self):
+        """
+        Write the applied blocks to storage in one transaction, with the next field of their previous blocks
+        written in earlier batches set.
+        """
+
+        if self.storage is None or not self._writes:
+            return
+
+        writes = [('state', block_hash, data) for block_hash, data in self._writes.items()]
+        with self.storage.snapshot() as snap:
+            for previous in sorted(self._next_links):
+                block_type, data = snap.get_block_any(previous, hint='state')
+                if block_type is not None:
+                    data = bytearray(data)
+                    data[-32:] = self._next_links[previous]
+                    writes.append((block_type, previous, data))
+
+        self.storage.put_blocks(writes, batch_size=0)
+        self._writes = {}
+        self._next_links = {}
+
+    def close(self):
+        self.flush()
+        if self.log is not None:
+            self.log.close()
+
+    def stats(self):
+        return {
+            'accounts':     len(self.state.accounts),
+            'pending':      len(self.state.pending),
+            'unwritten':    len(self._writes),
+            'unchecked':    len(self.unchecked) if self.unchecked is not None else 0,
+            'results':      dict(self.results),
+        }
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import time
+
+from .block import Block
+from .storage import INDEX_TABLES, ZERO_HASH
+
+# how many blocks of every account are kept, the frontier included.
+KEEP_BLOCKS = 100
+# blocks deleted per write transaction, small enough that writers never wait long.
+PRUNE_BATCH_SIZE = 1000
+
+
+def print_progress(progress):
+    print('{accounts} accounts, {deleted} blocks deleted, {pending_kept} pending sends kept'.format(**progress))
+
+
+def _read_block(snap, block_hash):
+    """
+    Return the decoded Block, None if not found.
+    """
+
+    block_type, data = snap.get_block_any(block_hash)
+    if block_type is None:
+        return None
+
+    block = Block(type=block_type)
+    block.from_storage_bytes(data)
+    block._prepare_block()
+    block._set_hash_bytes(bytes(block_hash))
+    return block
+
+
+def _scan_ledger(storage):
+    """
+    One pass over every block: return (frontier hashes, hashes referenced as a received send).
+    With indexes=True, the frontiers are read from idx_frontiers. Without, next is not maintained, so a
+    frontier is a block that is not the previous of another block. The link of every state block
+    is counted as received, a link that is a destination account is never a block hash, so this only errs
+    on the safe side.
+    """
+
+    received = set()
+    hashes = []
+    previous = set()
+    for block_type, block_hash, data in storage.iter_block_items():
+        if not storage.indexes:
+            hashes.append(bytes(block_hash))
+            if block_type == 'state':
+                previous.add(bytes(data[32:64]))
+            elif block_type != 'open':
+                previous.add(bytes(data[:32]))
+        if block_type in ['open', 'receive']:
+            received.add(bytes(data[:32]) if block_type == 'open' else bytes(data[32:64]))
+        elif block_type == 'state':
+            received.add(bytes(data[112:144]))
+
+    if storage.indexes:
+        frontiers = [bytes(block_hash) for _, block_hash in storage.iter_items(b'idx_frontiers')]
+    else:
+        frontiers = [block_hash for block_hash in hashes if block_hash not in previous]
+    return frontiers, received
+
+
+def _is_pending_send(block, previous, received):
+    """
+    True if block may be a send that is not received yet, previous is its previous Block or None if unknown.
+    """
+
+    if block._hash_bytes in received:
+        return False
+    if block.type == 'send':
+        return True
+    if block.type != 'state':
+        return False
+    if block._previous_bytes == ZERO_HASH:
+        return False
+    if previous is None or previous.type not in ['send', 'state']:
+        # the previous balance is unknown, it may be a send.
+        return True
+    return int.from_bytes(block._balance_bytes, 'big') < int.from_bytes(previous._balance_bytes, 'big')
+
+
+def _chain_garbage(snap, frontier, keep, received):
+    """
+    Walk a chain backwards from its frontier, return ([(block_type, block_hash)] to delete, pending sends kept).
+    """
+
+    garbage = []
+    pending_kept = 0
+
+    block = _read_block(snap, frontier)
+    depth = 0
+    while block is not None:
+        previous = None
+        if block._previous_bytes and block._previous_bytes != ZERO_HASH:
+            previous = _read_block(snap, block._previous_bytes)
+
+        if depth >= keep:
+            if _is_pending_send(block, previous, received):
+                pending_kept += 1
+            else:
+                garbage.append((block.type, block._hash_bytes))
+
+        block = previous
+        depth += 1
+
+    return garbage, pending_kept
+
+
+def prune_ledger(storage, keep=KEEP_BLOCKS, batch_size=PRUNE_BATCH_SIZE, report=None):
+    """
+    Delete the blocks of every account chain older than its last keep blocks, the frontier is always kept,
+    and so are sends that are not received yet, a wallet can still receive them.
+    Chains are walked backwards through previous from their frontiers, see _scan_ledger(), each chain once.
+    Chains are read in short snapshots and deleted in write transactions of batch_size blocks, so writers
+    are never blocked for long, and the pruning can run on a live database. Blocks written meanwhile are
+    safe: they are newer than every deleted block.
+    The hashes of the received sends are held in memory during the run.
+    Pruned databases lose the history: rebuild_indexes() can't index a chain whose open block is deleted.
+    report(progress) is called after every transaction. Return the progress dict, with the table pages
+    freed (lmdb reuses them, the file doesn't shrink) as bytes_reclaimed.
+    """
+
+    if keep < 1:
+        raise ValueError('the frontier must be kept: keep >= 1')
+
+    start_time = time.time()
+    storage.flush()
+    pages_before, page_size = _table_pages(storage)
+    frontiers, received = _scan_ledger(storage)
+
+    progress = {
+        'accounts':         0,
+        'deleted':          0,
+        'pending_kept':     0,
+        'transactions':     0,
+    }
+
+    def delete(garbage):
+        progress['deleted'] += storage.delete_blocks(garbage, batch_size=0)
+        progress['transactions'] += 1
+        if report:
+            report(dict(progress))
+
+    garbage = []
+    position = 0
+    while position < len(frontiers):
+        # a new snapshot for every batch, so old pages are not pinned during the whole run.
+        with storage.snapshot() as snap:
+            while position < len(frontiers) and len(garbage) < batch_size:
+                chain_garbage, pending_kept = _chain_garbage(snap, frontiers[position], keep, received)
+                garbage += chain_garbage
+                progress['pending_kept'] += pending_kept
+                progress['accounts'] += 1
+                position += 1
+
+        while len(garbage) >= batch_size:
+            delete(garbage[:batch_size])
+            garbage = garbage[batch_size:]
+
+    if garbage:
+        delete(garbage)
+
+    pages_after, _ = _table_pages(storage)
+    progress['bytes_reclaimed'] = (pages_before - pages_after) * page_size
+    progress['seconds'] = time.time() - start_time
+    return progress
+
+
+def _table_pages(storage):
+    """
+    Return (pages used by the block and index tables, page size).
+    """
+
+    db_names = storage._get_db_names()
+    pages = 0
+    page_size = storage.stats()['page_size']
+    for db_name in storage._block_tables() + INDEX_TABLES:
+        if db_name in db_names:
+            stat = storage.table_stats(db_name)
+            pages += stat['branch_pages'] + stat['leaf_pages'] + stat['overflow_pages']
+    return pages, page_size
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import Storage, BATCH_SIZE, SCAN_BATCH_SIZE, META_TABLE, KEY_DICTIONARY_TABLES
+
+SHARDS_META = 'shards.json'
+# Storage options that must match how the shards were written, recorded in SHARDS_META.
+SHARD_OPTIONS = ['schema', 'compact_state']
+
+
+class ShardedStorage(object):
+
+    def __init__(self, db_dir, shards=None, readonly=True, group_commit=True, **options):
+        """
+        Spread blocks over several lmdb environments in db_dir by the leading bytes of their hash,
+        shard i is db_dir/shard-i.ldb. lmdb allows one writer per environment, so every shard has
+        its own writer: with group_commit=True, its own flusher thread and batched commits.
+        The shard count is fixed when db_dir is created (saved in shards.json), use reshard() to change it.
+        Other options are passed to every shard's Storage, indexes are per shard so they are not supported.
+        The SHARD_OPTIONS are saved in shards.json too, and used when db_dir is opened without them.
+        """
+
+        if options.get('indexes'):
+            raise ValueError('indexes can not follow account chains across shards')
+
+        meta_path = os.path.join(db_dir, SHARDS_META)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            count = meta['shards']
+            if shards and shards != count:
+                raise ValueError('%s has %d shards, use reshard() to change it' % (db_dir, count))
+            for name in SHARD_OPTIONS:
+                if name in meta:
+                    options.setdefault(name, meta[name])
+        else:
+            if readonly or not shards:
+                raise ValueError('%s is not a sharded storage' % db_dir)
+            count = shards
+            os.makedirs(db_dir, exist_ok=True)
+            meta = {'shards': count}
+            meta.update((name, options[name]) for name in SHARD_OPTIONS if name in options)
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+
+        self.db_dir     = db_dir
+        self.readonly   = readonly
+        self.shards     = [Storage(os.path.join(db_dir, 'shard-%d.ldb' % i), readonly=readonly,
+                                   group_commit=group_commit and not readonly, **options)
+                           for i in range(count)]
+        self._executor  = ThreadPoolExecutor(count)
+
+    def _shard_index(self, block_hash_bytes):
+        """
+        The leading 2 bytes of the hash select the shard, so every shard holds a contiguous key range.
+        """
+
+        return (int.from_bytes(block_hash_bytes[:2], 'big') * len(self.shards)) >> 16
+
+    def _get_shard(self, block_hash):
+        block_hash_bytes = self.shards[0]._to_block_hash_bytes(block_hash)
+        return self.shards[self._shard_index(block_hash_bytes)], block_hash_bytes
+
+    def put_block(self, block_type, block_hash, data):
+        shard, block_hash_bytes = self._get_shard(block_hash)
+        shard.put_block(block_type, block_hash_bytes, data)
+
+    def put_blocks(self, blocks, batch_size=BATCH_SIZE):
+        """
+        Split the blocks by shard and write the shards in parallel, return (inserted, overwritten) counts.
+        """
+
+        parts = [[] for _ in self.shards]
+        for block_type, block_hash, data in blocks:
+            block_hash_bytes = self.shards[0]._to_block_hash_bytes(block_hash)
+            parts[self._shard_index(block_hash_bytes)].append((block_type, block_hash_bytes, data))
+
+        futures = [self._executor.submit(shard.put_blocks, part, batch_size)
+                   for shard, part in zip(self.shards, parts) if part]
+        counts = [future.result() for future in futures]
+        return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+    def put_items(self, db_name, items):
+        """
+        Write (key, value) items of a table that is not a block table, each to the shard of its leading bytes,
+        keys are not converted to block hashes. Return (inserted, overwritten) counts.
+        """
+
+        db_name = self.shards[0]._to_db_name(db_name)
+        parts = [[] for _ in self.shards]
+        for key, value in items:
+            key = bytes(key)
+            parts[self._shard_index(key)].append((db_name, key, bytes(value)))
+
+        inserted = 0
+        overwritten = 0
+        for shard, part in zip(self.shards, parts):
+            if part:
+                shard._get_db_handle(db_name)
+                added, replaced = shard._put_items(part)
+                inserted += added
+                overwritten += replaced
+        return inserted, overwritten
+
+    def get_block(self, block_type, block_hash):
+        shard, block_hash_bytes = self._get_shard(block_hash)
+        return shard.get_block(block_type, block_hash_bytes)
+
+    def get_many(self, db_name, keys):
+        """
+        Get the values of many keys, one get_many() per shard, in the order of keys.
+        """
+
+        parts = [[] for _ in self.shards]
+        for i, key in enumerate(keys):
+            key_bytes = self.shards[0]._to_block_hash_bytes(key)
+            parts[self._shard_index(key_bytes)].append((i, key_bytes))
+
+        values = [None] * len(keys)
+        for shard, part in zip(self.shards, parts):
+            if part:
+                for (i, _), value in zip(part, shard.get_many(db_name, [key for _, key in part])):
+                    values[i] = value
+        return values
+
+    def iter_items(self, db_name, batch=SCAN_BATCH_SIZE):
+        """
+        Yield (key, value) of a table over all shards, in key order since shards hold contiguous ranges.
+        """
+
+        for shard in self.shards:
+            if shard._to_db_name(db_name) in shard._get_db_names():
+                for item in shard.iter_items(db_name, batch=batch):
+                    yield item
+
+    def iter_block_items(self, batch=SCAN_BATCH_SIZE):
+        """
+        Yield (block_type, block_hash, data) of every stored block over all shards, in the storage bytes layout.
+        """
+
+        for shard in self.shards:
+            for item in shard.iter_block_items(batch=batch):
+                yield item
+
+    def get_db_names(self):
+        names = set()
+        for shard in self.shards:
+            names.update(shard._get_db_names())
+        return sorted(names)
+
+    def flush(self):
+        for future in [self._executor.submit(shard.flush) for shard in self.shards]:
+            future.result()
+
+    def close(self):
+        self.flush()
+        for shard in self.shards:
+            shard.close()
+        self._executor.shutdown()
+
+    def stats(self):
+        return [shard.stats() for shard in self.shards]
+
+
+def reshard(src_dir, dst_dir, shards, batch_size=BATCH_SIZE, **options):
+    """
+    Copy every table of a ShardedStorage into a new one with another shard count, return the items copied.
+    The new one is written with the SHARD_OPTIONS of the source, other options are passed to both.
+    Blocks are copied as blocks, in the storage bytes layout, so compact state blocks are encoded again
+    with the key dictionary of their new shard. Other tables are copied by raw key, except the meta data
+    and the key dictionaries that every shard writes itself.
+    """
+
+    src = ShardedStorage(src_dir, readonly=True, **options)
+    for name in SHARD_OPTIONS:
+        options[name] = getattr(src.shards[0], name)
+    dst = ShardedStorage(dst_dir, shards=shards, readonly=False, group_commit=False, **options)
+
+    copied = 0
+    batch = []
+    for item in src.iter_block_items():
+        batch.append(item)
+        if len(batch) >= batch_size:
+            copied += sum(dst.put_blocks(batch, batch_size=0))
+            batch = []
+    if batch:
+        copied += sum(dst.put_blocks(batch, batch_size=0))
+
+    skipped = set(src.shards[0]._block_tables() + KEY_DICTIONARY_TABLES + [META_TABLE])
+    for db_name in src.get_db_names():
+        if db_name in skipped:
+            continue
+        batch = []
+        for item in src.iter_items(db_name):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                copied += sum(dst.put_items(db_name, batch))
+                batch = []
+        if batch:
+            copied += sum(dst.put_items(db_name, batch))
+
+    src.close()
+    dst.close()
+    return copied
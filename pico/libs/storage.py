@@ -2,13 +2,93 @@
 
 import lmdb
 import os
+import threading
+import time
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from itertools import groupby, islice
+from operator import itemgetter, add
 
-from .types_convert import to_bytes
+from .types_convert import to_bytes, buffer_to_bytes
+from .cache import LRUCache
+from .bloom import BloomFilter
+from .compact import KeyDictionary, KEYS_TABLE, IDS_TABLE, STATE_STORAGE_LENGTH
+from .block import Block, BLOCK_TYPES
+from .account import Account, address_to_verifying_key, address_valid
 
 HOME_DIR = os.path.expanduser('~')
 DEFAULT_DB_DIR = os.path.join(HOME_DIR, 'RaiBlocks')
 DEFAULT_DB_PATH = os.path.join(DEFAULT_DB_DIR, 'data.ldb')
 
+# put_blocks() commits every BATCH_SIZE blocks, 0 means everything in one transaction.
+BATCH_SIZE = 10000
+
+# the map starts at MAP_SIZE bytes and grows by MAP_GROWTH times on MapFullError, up to max_map_size if given.
+MAP_SIZE = 64 * 1024 * 1024
+MAP_GROWTH = 2
+
+# the Bloom filter of block hashes is sized for BLOOM_HEADROOM times the stored blocks, at BLOOM_ERROR_RATE.
+BLOOM_HEADROOM = 2
+BLOOM_MIN_CAPACITY = 100000
+BLOOM_ERROR_RATE = 0.01
+
+# iter_items() reads SCAN_BATCH_SIZE items per read transaction.
+SCAN_BATCH_SIZE = 1000
+
+# parallel_scan() splits the key space into PARTITIONS_PER_WORKER ranges per worker, to even out the load.
+PARTITIONS_PER_WORKER = 4
+
+# iter_chain() directions, and how many chain entries of idx_chains are read ahead and looked up together.
+CHAIN_DIRECTIONS = ['forward', 'backward']
+CHAIN_PREFETCH = 64
+
+# group commit mode: the buffer is flushed every GROUP_COMMIT_INTERVAL seconds, or when it holds GROUP_COMMIT_ENTRIES blocks.
+GROUP_COMMIT_INTERVAL = 0.05
+GROUP_COMMIT_ENTRIES = 1000
+
+# secondary index tables, written in the same transaction as the blocks when Storage(indexes=True):
+#   idx_block_info:  block hash -> block type(1) + account(32) + height(8) + balance(16, empty if unknown)
+#   idx_frontiers:   account -> hash of the latest block
+#   idx_chains:      account + height(8) -> block hash, so a cursor walks a chain in order
+#   idx_receivables: destination account + send block hash -> amount(16, empty if unknown)
+#   idx_unindexed:   previous hash + block hash -> block type code(1), blocks waiting for their previous block
+#   idx_forks:       block hash -> account + previous hash, blocks rejected because another block follows previous
+INDEX_TABLES = [b'idx_block_info', b'idx_frontiers', b'idx_chains', b'idx_receivables', b'idx_unindexed',
+                b'idx_forks']
+ZERO_HASH = bytes(32)
+
+# block type codes of rai/lib/blocks.hpp, used as the type byte of idx_block_info and the unified schema.
+BLOCK_TYPE_CODES = {block_type: code for code, block_type in enumerate(BLOCK_TYPES, 2)}
+
+# schemas of the block tables:
+#   typed:   one table per block type, the block type is the table name. (like the reference node)
+#   unified: all blocks in the UNIFIED_TABLE, value = block type code(1) + storage bytes,
+#            so a block of unknown type is found with a single lookup.
+SCHEMAS = ['typed', 'unified']
+UNIFIED_TABLE = b'blocks'
+
+# Storage(compact_state=True) writes state blocks in the compact format of compact.py, account and representative
+# become ids of the KEYS_TABLE/IDS_TABLE dictionary. A compact value is always shorter than the storage bytes,
+# so a database can hold both formats, e.g. after enabling it on an existing database.
+KEY_DICTIONARY_TABLES = [KEYS_TABLE, IDS_TABLE]
+
+# how the database was written, checked on open: b'schema' -> schema name, b'compact_state' -> b'1' once enabled.
+# Not b'meta': the reference node has its own table of that name.
+META_TABLE = b'pico_meta'
+
+# lmdb.open() options. What a system crash (not a process crash) may cost:
+#   durable:    nothing, every commit is fsynced. (lmdb default)
+#   nometasync: the last commit, the database stays intact.
+#   nosync:     the commits since the last OS flush, the database stays intact.
+#   unsafe:     the commits since the last OS flush, and the database may be corrupted.
+DURABILITY_PROFILES = {
+    'durable':    dict(sync=True,  metasync=True,  map_async=False, writemap=False),
+    'nometasync': dict(sync=True,  metasync=False, map_async=False, writemap=False),
+    'nosync':     dict(sync=False, metasync=False, map_async=False, writemap=False),
+    'unsafe':     dict(sync=False, metasync=False, map_async=True,  writemap=True),
+}
+
 
 # tables in my desktop wallet database, got with env.begin(db=None)
 _db_name_list_example = [
@@ -34,11 +114,132 @@ _db_name_list_example = [
 
 class Storage(object):
 
-    def __init__(self, db_path=DEFAULT_DB_PATH, readonly=True):
+    def __init__(self, db_path=DEFAULT_DB_PATH, readonly=True, durability='durable', schema='typed', indexes=False,
+            group_commit=False, flush_interval=GROUP_COMMIT_INTERVAL, flush_entries=GROUP_COMMIT_ENTRIES,
+            map_size=MAP_SIZE, max_map_size=None, map_growth=MAP_GROWTH, cache_size=0, bloom=False,
+            compact_state=False):
+        """
+        durability is a name in DURABILITY_PROFILES.
+        schema is a name in SCHEMAS, a database must always be opened with the schema it was written with.
+        A writable map starts at map_size bytes (or the current database size), when a write transaction
+        fails with MapFullError, the map grows by map_growth times and the transaction is retried. Growth waits
+        for the open snapshots and iterators of other threads to close, and raises MapGrowthBlocked if the
+        writing thread holds one itself.
+        With cache_size > 0, get_block() reads through an LRU cache of up to cache_size bytes,
+        writes invalidate the cached blocks after they are committed (or buffered).
+        With bloom=True, a Bloom filter of all block hashes answers block_known() without lmdb for unknown
+        blocks, it's saved to db_path.bloom on close() (by readers too) and rebuilt if the database changed since.
+        The filter only sees the writes of this Storage: once another process commits, block_known()
+        looks up the blocks missing from the filter in lmdb, until rebuild_bloom().
+        With indexes=True, the INDEX_TABLES are maintained by every write, see rebuild_indexes() for old databases.
+        With compact_state=True, state blocks are written dictionary encoded (see compact.py) and expanded
+        back to the storage bytes on read, like schema it must match how the database was written.
+        With group_commit=True, put_block() only buffers the block, a background thread writes the buffer
+        in one transaction every flush_interval seconds or flush_entries blocks. Call flush() or close()
+        to make sure buffered blocks are written.
+        """
+
+        if durability not in DURABILITY_PROFILES:
+            raise ValueError('unknown durability profile: %s' % durability)
+        if schema not in SCHEMAS:
+            raise ValueError('unknown schema: %s' % schema)
+        if group_commit and readonly:
+            raise ValueError('group commit needs a writable database')
+
         self.db_path            = db_path
         self.readonly           = readonly
-        self.env                = lmdb.open(db_path, subdir=False, readonly=readonly, max_dbs=128)
+        self.durability         = durability
+        self.schema             = schema
+        self.max_map_size       = max_map_size
+        self.map_growth         = map_growth
+        self.map_growths        = 0
+        self._gate              = _TxnGate()
+        self._bloom_txnid       = None  # the last transaction whose blocks are all in the Bloom filter
+
+        options = dict(DURABILITY_PROFILES[durability])
+        if not readonly:
+            options['map_size'] = map_size
+        self.env                = lmdb.open(db_path, subdir=False, readonly=readonly, max_dbs=128, **options)
         self._db_handle_dict    = {}
+        self._db_handle_lock    = threading.Lock()
+        self.cache              = LRUCache(cache_size) if cache_size else None
+
+        try:
+            self._check_meta(compact_state)
+        except ValueError:
+            self.env.close()
+            raise
+
+        self.indexes            = indexes
+        if indexes and not readonly:
+            # the index writes read blocks of any type in their write transaction.
+            for db_name in INDEX_TABLES + self._block_tables():
+                self._get_db_handle(db_name)
+
+        self.compact_state      = compact_state
+        self.keydict            = KeyDictionary()
+        if compact_state and not readonly:
+            for db_name in KEY_DICTIONARY_TABLES:
+                self._get_db_handle(db_name)
+
+        # group commit: {(db_name, key_bytes): data_bytes} waiting to be written, readers look here first.
+        self.group_commit       = group_commit
+        self.flush_interval     = flush_interval
+        self.flush_entries      = flush_entries
+        self._buffer            = {}
+        self._buffer_cond       = threading.Condition()
+        self._buffered_seq      = 0     # how many items have been buffered
+        self._flushed_seq       = 0     # how many of them have been committed
+        self._flush_requested   = False
+        self._flush_error       = None
+        self._closing           = False
+        self._flusher           = None
+
+        self.bloom_path         = db_path + '.bloom'
+        self.bloom              = None
+        if bloom:
+            self.bloom, tag = BloomFilter.load(self.bloom_path)
+            if self.bloom is None or tag != self.env.info()['last_txnid']:
+                self.rebuild_bloom()
+            else:
+                self._bloom_txnid = tag
+
+        if group_commit:
+            self._flusher = threading.Thread(target=self._flush_loop, name='storage-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _check_meta(self, compact_state):
+        """
+        Raise ValueError if the database was written with another schema, or with compact_state=True and is
+        opened without. A database without META_TABLE (older, or from the reference node) has the schema of
+        its block tables. A writer records the schema, and compact_state once enabled.
+        """
+
+        db_names = self._get_db_names()
+        meta = {}
+        if META_TABLE in db_names:
+            meta = dict((bytes(key), bytes(value)) for key, value in self.iter_items(META_TABLE))
+
+        schema = meta.get(b'schema', b'').decode()
+        if not schema:
+            if UNIFIED_TABLE in db_names:
+                schema = 'unified'
+            elif any(block_type.encode() in db_names for block_type in BLOCK_TYPES):
+                schema = 'typed'
+        if schema and schema != self.schema:
+            raise ValueError('%s was written with the %s schema, not %s' % (self.db_path, schema, self.schema))
+        if meta.get(b'compact_state') == b'1' and not compact_state:
+            raise ValueError('%s holds compact state blocks, it needs compact_state=True' % self.db_path)
+
+        if not self.readonly:
+            updates = {b'schema': self.schema.encode()}
+            if compact_state:
+                updates[b'compact_state'] = b'1'
+            updates = [(key, value) for key, value in updates.items() if meta.get(key) != value]
+            db = self._get_db_handle(META_TABLE)
+            if updates:
+                self._write(lambda txn: txn.cursor(db=db).putmulti(updates))
 
     def _to_db_name(self, db_name):
         if isinstance(db_name, (bytes, bytearray)):
@@ -53,22 +254,33 @@ class Storage(object):
         """
 
         db_names = []
-        with self.env.begin() as txn:
+        with self._begin() as txn:
             cursor = txn.cursor()
             for key, value in cursor:
                 db_names.append(key)
 
         return db_names
 
-    def _get_db_handle(self, db_name):
+    def _get_db_handle(self, db_name, create=True):
         """
         open named db and store the handles in a dict to avoid too much open actions.
+        With create=False, return None if the table doesn't exist, read paths never create tables.
         """
 
         db_name = self._to_db_name(db_name)
         if db_name not in self._db_handle_dict:
-            db_handle = self.env.open_db(db_name)
-            self._db_handle_dict[db_name] = db_handle
+            with self._db_handle_lock:
+                if db_name in self._db_handle_dict:
+                    pass
+                elif create and not self.readonly:
+                    # in a write transaction of this Storage, like any other write, see _bloom_cover().
+                    self._db_handle_dict[db_name] = self._write(lambda txn: self.env.open_db(db_name, txn=txn))
+                else:
+                    try:
+                        with self._gate:
+                            self._db_handle_dict[db_name] = self.env.open_db(db_name, create=False)
+                    except lmdb.NotFoundError:
+                        return None
 
         return self._db_handle_dict[db_name]
 
@@ -78,16 +290,146 @@ class Storage(object):
         """
 
         db = self._get_db_handle(db_name)
-        with self.env.begin(db=db, write=True) as txn:
-            txn.put(key_bytes, data_bytes)
+        self._write(lambda txn: txn.put(key_bytes, data_bytes, db=db))
 
     def _get_data(self, db_name, key_bytes):
-        db = self._get_db_handle(db_name)
+        if self._buffer:
+            data = self._buffer.get((self._to_db_name(db_name), key_bytes))
+            if data is not None:
+                return data
 
-        with self.env.begin(db=db) as txn:
+        db = self._get_db_handle(db_name, create=False)
+        if db is None:
+            return None
+
+        with self._begin(db=db) as txn:
             cursor = txn.cursor()
             return cursor.get(key_bytes)
 
+    @contextmanager
+    def _begin(self, write=False, **kwargs):
+        """
+        Begin a transaction through the gate, so the map is never resized under it.
+        If another process has grown the map, adopt the new size and begin again.
+        """
+
+        while True:
+            # the token, not the current thread, releases the gate: a snapshot may be closed by another thread.
+            token = self._gate.enter()
+            try:
+                try:
+                    txn = self.env.begin(write=write, **kwargs)
+                except lmdb.MapResizedError:
+                    pass
+                else:
+                    with txn:
+                        yield txn
+                    return
+            finally:
+                self._gate.exit(token)
+            self._gate.resize(lambda: self.env.set_mapsize(0))
+
+    def _write(self, fn):
+        """
+        Run fn(txn) in a write transaction and return its result.
+        On MapFullError, the transaction is aborted, the map grows and fn is called again in a new transaction.
+        """
+
+        while True:
+            txnid = None
+            try:
+                with self._begin(write=True) as txn:
+                    result = fn(txn)
+                    txnid = self._bloom_cover(txn)
+                return result
+            except lmdb.MapFullError:
+                self._bloom_uncover(txnid)
+                self._grow_map()
+            except BaseException:
+                self._bloom_uncover(txnid)
+                raise
+
+    def _bloom_cover(self, txn):
+        """
+        Count a write transaction as covered by the Bloom filter if the one before it is: lmdb has a single
+        writer, no other commit can come between them. The transaction records its id in META_TABLE, an empty
+        transaction would commit without taking the id, and the next writer would get it.
+        Return the id, None if not covered.
+        """
+
+        txnid = txn.id()
+        if self._bloom_txnid is None or self._bloom_txnid != txnid - 1:
+            return None
+        txn.put(b'bloom_txnid', txnid.to_bytes(8, 'big'), db=self._db_handle_dict[META_TABLE])
+        self._bloom_txnid = txnid
+        return txnid
+
+    def _bloom_uncover(self, txnid):
+        """
+        A write failed after it was counted as covered by the Bloom filter, its transaction id may be reused.
+        """
+
+        if txnid is not None and self._bloom_txnid == txnid:
+            self._bloom_txnid = None
+
+    def _grow_map(self):
+        """
+        Grow the map by map_growth times, up to max_map_size.
+        """
+
+        map_size = self.env.info()['map_size']
+        new_size = int(map_size * self.map_growth)
+        if self.max_map_size:
+            new_size = min(new_size, self.max_map_size)
+        if new_size <= map_size:
+            raise lmdb.MapFullError('map_size %d reached max_map_size' % map_size)
+
+        self._gate.resize(lambda: self.env.set_mapsize(new_size))
+        self.map_growths += 1
+
+    def stats(self):
+        """
+        Return the numbers of env.info() and env.stat() for monitoring, in O(1).
+        """
+
+        info = self.env.info()
+        stat = self.env.stat()
+        return {
+            'map_size':     info['map_size'],
+            'page_size':    stat['psize'],
+            'used_pages':   info['last_pgno'] + 1,
+            'used_bytes':   (info['last_pgno'] + 1) * stat['psize'],
+            'readers':      info['num_readers'],
+            'max_readers':  info['max_readers'],
+            'last_txnid':   info['last_txnid'],
+            'map_growths':  self.map_growths,
+            'tables':       stat['entries'],
+            'cache':        self.cache.stats() if self.cache is not None else None,
+            'bloom':        self.bloom_stats(),
+        }
+
+    def bloom_stats(self):
+        if self.bloom is None:
+            return None
+
+        return {
+            'bits':                 self.bloom.bits,
+            'hashes':               self.bloom.hashes,
+            'count':                self.bloom.count,
+            'false_positive_rate':  self.bloom.false_positive_rate(),
+        }
+
+    def table_stats(self, db_name):
+        """
+        Return txn.stat() of a table: entries, depth, branch/leaf/overflow pages, in O(1).
+        """
+
+        db = self._get_db_handle(db_name, create=False)
+        if db is None:
+            raise ValueError('no table %s in %s' % (self._to_db_name(db_name).decode(), self.db_path))
+        with self._begin() as txn:
+            return txn.stat(db)
+
     def _to_block_hash_bytes(self, data):
         """
         Convert data to 32 bytes hash if legal, return bytes.
@@ -95,23 +437,846 @@ class Storage(object):
 
         return to_bytes(data, 32)
 
+    def _block_table(self, block_type):
+        """
+        Return the name of the table a block type is stored in, depends on the schema.
+        """
+
+        db_name = self._to_db_name(block_type)
+        if self.schema == 'unified' and db_name.decode() in BLOCK_TYPES:
+            return UNIFIED_TABLE
+        return db_name
+
+    def _block_tables(self):
+        if self.schema == 'unified':
+            return [UNIFIED_TABLE]
+        return [block_type.encode() for block_type in BLOCK_TYPES]
+
+    def _decode_block_value(self, block_type, value, get=None):
+        """
+        Unified schema: check and strip the type byte of a stored value, None if it's another type.
+        Compact state blocks are expanded to the storage bytes, see _expand_state().
+        """
+
+        if value is None:
+            return value
+        type_name = self._to_db_name(block_type).decode()
+        if self._block_table(block_type) == UNIFIED_TABLE:
+            if value[0] != BLOCK_TYPE_CODES[type_name]:
+                return None
+            value = value[1:]
+        if type_name == 'state':
+            value = self._expand_state(value, get)
+        return value
+
+    def _item_block(self, db_name, value, get=None):
+        """
+        Return (block_type, storage bytes) of a stored item, None if the table is not a block table.
+        """
+
+        if db_name == UNIFIED_TABLE and self.schema == 'unified':
+            block_type, value = BLOCK_TYPES[value[0] - 2], value[1:]
+        elif self.schema == 'typed' and db_name.decode() in BLOCK_TYPES:
+            block_type = db_name.decode()
+        else:
+            return None
+
+        if block_type == 'state':
+            value = self._expand_state(value, get)
+        return block_type, value
+
+    def _expand_state(self, data, get=None):
+        """
+        Return the storage bytes of a stored state block, decoding the compact format.
+        get(db_name, key_bytes) reads the key dictionary, in a new read transaction by default.
+        """
+
+        if not self.compact_state or len(data) == STATE_STORAGE_LENGTH:
+            return data
+        return self.keydict.decode_state(data, get or self._get_data)
+
+    def _compact_value(self, txn, db_name, data):
+        """
+        Encode a state block value to the compact format in the write transaction, other values are unchanged.
+        """
+
+        if db_name == UNIFIED_TABLE and self.schema == 'unified':
+            # the type byte stays in front of the compact record.
+            if data[0] != BLOCK_TYPE_CODES['state'] or len(data) != 1 + STATE_STORAGE_LENGTH:
+                return data
+            return data[:1] + self._compact_value(txn, b'state', data[1:])
+        if db_name != b'state' or len(data) != STATE_STORAGE_LENGTH:
+            return data
+
+        keys_db, ids_db = [self._db_handle_dict[table] for table in KEY_DICTIONARY_TABLES]
+        return self.keydict.encode_state(txn, keys_db, ids_db, data)
+
+    def _to_block_item(self, block_type, block_hash, data):
+        """
+        Convert a block to a (db_name, key_bytes, data_bytes) item, and open its db before any write transaction.
+        """
+
+        db_name = self._block_table(block_type)
+        data_bytes = buffer_to_bytes(data)
+        if db_name == UNIFIED_TABLE:
+            data_bytes = bytes([BLOCK_TYPE_CODES[self._to_db_name(block_type).decode()]]) + data_bytes
+
+        self._get_db_handle(db_name)
+        return db_name, self._to_block_hash_bytes(block_hash), data_bytes
+
+    def _write_items(self, txn, items):
+        """
+        Write (db_name, key_bytes, data_bytes) items in the given write transaction.
+        Consecutive items of the same db are written with a single cursor.putmulti().
+        putmulti() can't tell which keys already existed, so a group with existing keys is written twice.
+        With compact_state=True, state blocks are encoded here, so new dictionary ids commit with the blocks.
+        Return (inserted, overwritten) counts.
+        """
+
+        inserted = 0
+        overwritten = 0
+        for db_name, group in groupby(items, key=itemgetter(0)):
+            if self.compact_state:
+                pairs = [(key, self._compact_value(txn, db_name, data)) for _, key, data in group]
+            else:
+                pairs = [(key, data) for _, key, data in group]
+            cursor = txn.cursor(db=self._db_handle_dict[db_name])
+            consumed, added = cursor.putmulti(pairs, overwrite=False)
+            if added < consumed:
+                cursor.putmulti(pairs)
+            inserted += added
+            overwritten += consumed - added
+
+        return inserted, overwritten
+
+    def _put_items(self, items):
+        """
+        Write items in one transaction, return (inserted, overwritten) counts.
+        """
+
+        return self._put_item_groups([items])[0]
+
+    def _put_item_groups(self, groups):
+        """
+        Write lists of items in one transaction, return (inserted, overwritten) counts per list.
+        """
+
+        items = [item for group in groups for item in group]
+        # add to the filter before the commit, a reader may get a false positive but never a false negative.
+        self._bloom_add(items)
+
+        def write(txn):
+            counts = [self._write_items(txn, group) for group in groups]
+            if self.indexes:
+                self._index_items(txn, items)
+            return counts
+
+        counts = self._write(write)
+        if self.cache is not None:
+            self.cache.invalidate([(db_name, key_bytes) for db_name, key_bytes, _ in items])
+        return counts
+
+    def _index_handles(self):
+        return [self._db_handle_dict[db_name] for db_name in INDEX_TABLES]
+
+    def _index_items(self, txn, items):
+        """
+        Index the block items in the write transaction, in any order: a block waits for its previous block
+        and the send block it receives in the same batch, it's indexed as soon as they are, every block is
+        decoded once. A send that can't be indexed doesn't hold back its receive, which is indexed with an
+        unknown amount. Blocks whose previous block is unknown are kept in idx_unindexed, and indexed by the
+        write that brings their previous block. Return how many blocks were left waiting.
+        """
+
+        dbs = self._index_handles()
+        blocks = {}
+        for db_name, block_hash, data in items:
+            block = self._item_block(db_name, data)
+            if block:
+                blocks[block_hash] = self._prepare_index_block(*block)
+
+        unindexed = set(blocks)
+        for waiting in [unindexed, ()]:
+            children = {}
+            ready = deque(block_hash for block_hash in blocks if block_hash in unindexed)
+            while ready:
+                block_hash = ready.popleft()
+                if block_hash not in unindexed:
+                    continue
+                missing = self._index_block(txn, dbs, block_hash, blocks[block_hash], waiting)
+                if missing is None:
+                    unindexed.discard(block_hash)
+                    ready.extend(children.pop(block_hash, ()))
+                    ready.extend(self._take_unindexed(txn, dbs, block_hash, blocks, unindexed))
+                else:
+                    children.setdefault(missing, []).append(block_hash)
+
+        unindexed_db = dbs[4]
+        for block_hash in unindexed:
+            block = blocks[block_hash]
+            txn.put(block._previous_bytes + block_hash, bytes([BLOCK_TYPE_CODES[block.type]]), db=unindexed_db)
+        return len(unindexed)
+
+    def _prepare_index_block(self, block_type, data):
+        block = Block(type=block_type)
+        block.from_storage_bytes(data)
+        block._prepare_block()
+        return block
+
+    def _take_unindexed(self, txn, dbs, previous, blocks, unindexed):
+        """
+        Remove the blocks waiting in idx_unindexed for previous, add them to blocks and unindexed, return
+        their hashes. Blocks deleted meanwhile are dropped.
+        """
+
+        unindexed_db = dbs[4]
+        cursor = txn.cursor(db=unindexed_db)
+        waiting = []
+        found = cursor.set_range(previous)
+        while found and cursor.key()[:32] == previous:
+            waiting.append((bytes(cursor.key()[32:]), BLOCK_TYPES[cursor.value()[0] - 2]))
+            found = cursor.delete()
+
+        txn_get = lambda db_name, key_bytes: txn.get(key_bytes, db=self._db_handle_dict[db_name])
+        hashes = []
+        for block_hash, block_type in waiting:
+            data = txn.get(block_hash, db=self._db_handle_dict[self._block_table(block_type)])
+            data = self._decode_block_value(block_type, data, get=txn_get)
+            if data is not None:
+                blocks[block_hash] = self._prepare_index_block(block_type, data)
+                unindexed.add(block_hash)
+                hashes.append(block_hash)
+        return hashes
+
+    def _index_block(self, txn, dbs, block_hash, block, waiting=()):
+        """
+        Update the index tables for one prepared Block. Return the hash it waits for: its previous block
+        if not indexed yet, or the send block it receives if in waiting. Return None if it's indexed,
+        or if it's a fork: its previous is not the frontier of the account (or an account is opened twice),
+        then it's recorded in idx_forks and the indexes are left alone.
+        Balances and receivable amounts are tracked where the chain makes them known, b'' otherwise.
+        """
+
+        info_db, frontier_db, chain_db, receivable_db, _, fork_db = dbs
+        if txn.get(block_hash, db=info_db) is not None:
+            return None
+
+        block_type = block.type
+        if block_type == 'open' or (block_type == 'state' and block._previous_bytes == ZERO_HASH):
+            account = block._account_bytes
+            height = 1
+            previous_balance = 0
+            frontier = ZERO_HASH
+        else:
+            previous_info = txn.get(block._previous_bytes, db=info_db)
+            if previous_info is None:
+                return block._previous_bytes
+            _, account, height, previous_balance = unpack_block_info(previous_info)
+            height += 1
+            frontier = block._previous_bytes
+
+        if (txn.get(account, db=frontier_db) or ZERO_HASH) != frontier:
+            txn.put(block_hash, account + block._previous_bytes, db=fork_db)
+            return None
+
+        balance = None
+        send_to = None
+        receive_from = None
+
+        if block_type == 'send':
+            balance = int.from_bytes(block._balance_bytes, 'big')
+            send_to = block._destination_bytes
+        elif block_type in ['open', 'receive']:
+            receive_from = block._source_bytes
+        elif block_type == 'change':
+            balance = previous_balance
+        elif block_type == 'state':
+            balance = int.from_bytes(block._balance_bytes, 'big')
+            if previous_balance is not None and balance < previous_balance:
+                send_to = block._link_bytes
+            elif previous_balance is not None and balance > previous_balance:
+                receive_from = block._link_bytes
+
+        if receive_from in waiting:
+            return receive_from
+
+        if send_to:
+            amount = b''
+            if previous_balance is not None:
+                amount = (previous_balance - balance).to_bytes(16, 'big')
+            txn.put(send_to + block_hash, amount, db=receivable_db)
+
+        if receive_from:
+            amount = txn.pop(account + receive_from, db=receivable_db)
+            if balance is None and amount and previous_balance is not None:
+                balance = previous_balance + int.from_bytes(amount, 'big')
+
+        txn.put(block_hash, pack_block_info(block_type, account, height, balance), db=info_db)
+        txn.put(account + height.to_bytes(8, 'big'), block_hash, db=chain_db)
+        txn.put(account, block_hash, db=frontier_db)
+
+        return None
+
+    def rebuild_indexes(self, batch_size=BATCH_SIZE):
+        """
+        Backfill the index tables of an existing database from its block tables.
+        Blocks are indexed after their previous block and the send block they receive, blocks whose previous
+        block is missing wait in idx_unindexed, forks go to idx_forks. Return how many blocks were indexed.
+        """
+
+        dbs = self._index_handles()
+
+        def drop(txn):
+            for db in dbs:
+                txn.drop(db, delete=False)
+
+        self._write(drop)
+
+        # find the dependencies of every block, only hashes and types are kept in memory.
+        block_types = {}
+        dependencies = {}
+        with self.snapshot() as snap:
+            for block in snap.iter_all_blocks():
+                block._prepare_block()
+                block_types[block._hash_bytes] = block.type
+                dependencies[block._hash_bytes] = [block._previous_bytes, block._source_bytes, block._link_bytes]
+
+        waiting = {}
+        waiting_count = {}
+        ready = deque()
+        for block_hash, links in dependencies.items():
+            links = set(link for link in links if link in block_types and link not in (block_hash, ZERO_HASH))
+            for link in links:
+                waiting.setdefault(link, []).append(block_hash)
+            waiting_count[block_hash] = len(links)
+            if not links:
+                ready.append(block_hash)
+        dependencies = None
+
+        # compact state blocks are expanded with the key dictionary, read in the write transaction.
+        db_names = self._get_db_names()
+        for db_name in KEY_DICTIONARY_TABLES:
+            if db_name in db_names:
+                self._get_db_handle(db_name)
+
+        def index_batch(txn):
+            txn_get = lambda db_name, key_bytes: txn.get(key_bytes, db=self._db_handle_dict[db_name])
+            count = 0
+            for block_hash in batch:
+                block_type = block_types[block_hash]
+                data = txn.get(block_hash, db=self._db_handle_dict[self._block_table(block_type)])
+                block = self._prepare_index_block(block_type, self._decode_block_value(block_type, data, get=txn_get))
+                if self._index_block(txn, dbs, block_hash, block) is None:
+                    count += 1
+                else:
+                    txn.put(block._previous_bytes + block_hash, bytes([BLOCK_TYPE_CODES[block_type]]), db=dbs[4])
+            return count
+
+        indexed = 0
+        while ready:
+            batch = [ready.popleft() for _ in range(min(batch_size or len(ready), len(ready)))]
+            indexed += self._write(index_batch)
+
+            for block_hash in batch:
+                for child in waiting.pop(block_hash, []):
+                    waiting_count[child] -= 1
+                    if waiting_count[child] == 0:
+                        ready.append(child)
+
+        return indexed
+
+    def _to_account_bytes(self, account):
+        """
+        Convert an Account, an address or a verifying key to 32 bytes, return bytes.
+        """
+
+        if isinstance(account, Account):
+            return account._verifying_key_bytes
+        account_bytes = to_bytes(account, 32)
+        if not account_bytes and isinstance(account, str) and address_valid(account):
+            account_bytes = address_to_verifying_key(account)
+        return account_bytes
+
+    def get_frontier(self, account):
+        """
+        Return the hash of the latest block of the account, None if unknown.
+        Needs indexes, raises ValueError without.
+        """
+
+        with self.snapshot() as snap:
+            return snap.get_frontier(account)
+
+    def get_chain(self, account):
+        """
+        Return the block hashes of the account, from open block to frontier.
+        Needs indexes, raises ValueError without.
+        """
+
+        with self.snapshot() as snap:
+            return snap.get_chain(account)
+
+    def get_receivables(self, account):
+        """
+        Return [(send_hash, amount)] not received by the account yet, amount is None if unknown.
+        Needs indexes, raises ValueError without.
+        """
+
+        with self.snapshot() as snap:
+            return snap.get_receivables(account)
+
+    def scan_wallet(self, accounts):
+        """
+        Return the balances and receivables of many accounts read in one snapshot, see Snapshot.scan_wallet(),
+        with the time the scan took: {'accounts': {...}, 'seconds': ..., 'seconds_per_account': ...}.
+        Needs indexes, raises ValueError without. In group commit mode, the buffer is flushed first, so the buffered blocks are indexed
+        and the whole scan reads one committed state.
+        """
+
+        accounts = list(accounts)
+        start = time.perf_counter()
+        self.flush()
+        with self.snapshot(buffers=True) as snap:
+            result = snap.scan_wallet(accounts)
+        seconds = time.perf_counter() - start
+        return {
+            'accounts':             result,
+            'seconds':              seconds,
+            'seconds_per_account':  seconds / len(accounts) if accounts else 0.0,
+        }
+
     def put_block(self, block_type, block_hash, data):
         """
         block_type as db name, block_hash as key.
         if called twice with the same block_hash, the last data will overwrite the previous one.
         """
 
-        block_hash_bytes = self._to_block_hash_bytes(block_hash)
-        if isinstance(data, (bytes, bytearray)):
-            data_bytes = bytes(data)
+        item = self._to_block_item(block_type, block_hash, data)
+        if self.group_commit:
+            self._bloom_add([item])
+            self._buffer_item(item)
+            if self.cache is not None:
+                self.cache.invalidate([item[:2]])
         else:
-            raise ValueError('data is not bytes')
+            self._put_items([item])
+
+    def put_blocks(self, blocks, batch_size=BATCH_SIZE):
+        """
+        Write an iterable of (block_type, block_hash, data) in one transaction.
+        For very large imports, commit every batch_size blocks, batch_size=0 means never split.
+        Return (inserted, overwritten) counts.
+        """
+
+        # buffered blocks are older, write them first so they can't overwrite this batch later.
+        if self.group_commit:
+            self.flush()
+
+        inserted = 0
+        overwritten = 0
+        items = []
+        for block_type, block_hash, data in blocks:
+            items.append(self._to_block_item(block_type, block_hash, data))
+            if batch_size and len(items) >= batch_size:
+                added, replaced = self._put_items(items)
+                inserted += added
+                overwritten += replaced
+                items = []
+
+        if items:
+            added, replaced = self._put_items(items)
+            inserted += added
+            overwritten += replaced
 
-        self._put_data(block_type, block_hash_bytes, data)
+        return inserted, overwritten
+
+    def put_block_groups(self, groups):
+        """
+        Write several iterables of (block_type, block_hash, data) in one transaction, e.g. the puts of many
+        callers coalesced by a writer thread. Return an (inserted, overwritten) count per iterable.
+        """
+
+        self.flush()
+        return self._put_item_groups([[self._to_block_item(*block) for block in blocks] for blocks in groups])
+
+    def delete_blocks(self, blocks, batch_size=BATCH_SIZE):
+        """
+        Delete an iterable of (block_type, block_hash), committing every batch_size blocks.
+        With indexes=True, their idx_block_info and idx_chains entries go too, and idx_frontiers if it points
+        to a deleted block. Blocks that are not stored are ignored. Return how many blocks were deleted.
+        """
+
+        self.flush()
+
+        deleted = 0
+        keys = []
+        for block_type, block_hash in blocks:
+            db_name = self._block_table(block_type)
+            self._get_db_handle(db_name)
+            keys.append((self._to_db_name(block_type).decode(), db_name, self._to_block_hash_bytes(block_hash)))
+            if batch_size and len(keys) >= batch_size:
+                deleted += self._delete_keys(keys)
+                keys = []
+
+        if keys:
+            deleted += self._delete_keys(keys)
+
+        return deleted
+
+    def _delete_keys(self, keys):
+        """
+        Delete (block_type, db_name, key_bytes) blocks in one transaction, return how many were deleted.
+        """
+
+        def delete(txn):
+            dbs = self._index_handles() if self.indexes else None
+            count = 0
+            for block_type, db_name, key_bytes in keys:
+                db = self._db_handle_dict[db_name]
+                value = txn.get(key_bytes, db=db)
+                if value is None or (db_name == UNIFIED_TABLE and value[0] != BLOCK_TYPE_CODES[block_type]):
+                    continue
+                txn.delete(key_bytes, db=db)
+                count += 1
+                if dbs:
+                    self._unindex_block(txn, dbs, key_bytes)
+            return count
+
+        count = self._write(delete)
+        if self.cache is not None:
+            self.cache.invalidate([(db_name, key_bytes) for _, db_name, key_bytes in keys])
+        return count
+
+    def _unindex_block(self, txn, dbs, block_hash):
+        info_db, frontier_db, chain_db = dbs[:3]
+        info = txn.pop(block_hash, db=info_db)
+        if info is None:
+            return
+
+        _, account, height, _ = unpack_block_info(info)
+        chain_key = account + height.to_bytes(8, 'big')
+        if txn.get(chain_key, db=chain_db) == block_hash:
+            txn.delete(chain_key, db=chain_db)
+        if txn.get(account, db=frontier_db) == block_hash:
+            txn.delete(account, db=frontier_db)
 
     def get_block(self, block_type, block_hash):
         block_hash_bytes = self._to_block_hash_bytes(block_hash)
-        return self._get_data(block_type, block_hash_bytes)
+        db_name = self._block_table(block_type)
+        if self.cache is None:
+            return self._decode_block_value(block_type, self._get_data(db_name, block_hash_bytes))
+
+        key = (db_name, block_hash_bytes)
+        data = self._buffer.get(key) if self._buffer else None
+        if data is None:
+            data = self.cache.get(key)
+        if data is None:
+            token = self.cache.token()
+            data = self._get_data(db_name, block_hash_bytes)
+            if data is not None:
+                self.cache.fill(key, data, token)
+
+        return self._decode_block_value(block_type, data)
+
+    def get_block_any(self, block_hash):
+        """
+        Return (block_type, data) of a block of unknown type, (None, None) if not found.
+        A single lookup in the unified schema, one lookup per block table in the typed schema.
+        """
+
+        with self.snapshot() as snap:
+            return snap.get_block_any(block_hash)
+
+    def iter_chain(self, account_or_hash, direction='forward', limit=None):
+        """
+        Yield the decoded Blocks of a chain in one snapshot, see Snapshot.iter_chain().
+        The snapshot stays open until the generator is exhausted or closed.
+        """
+
+        with self.snapshot() as snap:
+            for block in snap.iter_chain(account_or_hash, direction, limit):
+                yield block
+
+    def iter_block_items(self, batch=SCAN_BATCH_SIZE):
+        """
+        Yield (block_type, block_hash, data) of every stored block, in the storage bytes layout.
+        """
+
+        db_names = self._get_db_names()
+        for db_name in self._block_tables():
+            if db_name not in db_names:
+                continue
+            for items in self.iter_batches(db_name, batch=batch):
+                for key, value in items:
+                    block_type, data = self._item_block(db_name, value)
+                    yield block_type, key, data
+
+    def _bloom_add(self, items):
+        if self.bloom is not None:
+            for db_name, key_bytes, data in items:
+                if self._item_block(db_name, data):
+                    self.bloom.add(key_bytes)
+
+    def rebuild_bloom(self, error_rate=BLOOM_ERROR_RATE):
+        """
+        Create a new Bloom filter sized from the table stats, and add every stored block hash.
+        """
+
+        # taken first: blocks committed during the scan may be missed, the filter covers this transaction.
+        txnid = self.env.info()['last_txnid']
+        tables = [t for t in self._block_tables() if t in self._get_db_names()]
+        count = sum(self.table_stats(t)['entries'] for t in tables)
+        bloom = BloomFilter.for_capacity(max(count * BLOOM_HEADROOM, BLOOM_MIN_CAPACITY), error_rate)
+        for block_type in tables:
+            for keys in self.iter_batches(block_type, batch=SCAN_BATCH_SIZE * 10):
+                for key, _ in keys:
+                    bloom.add(key)
+
+        self.bloom = bloom
+        self._bloom_txnid = txnid
+        for (db_name, key_bytes), data in list(self._buffer.items()):
+            if self._item_block(db_name, data):
+                bloom.add(key_bytes)
+
+    def save_bloom(self):
+        """
+        Save the Bloom filter, tagged with the last transaction it covers so a stale file is detected.
+        A filter that missed the commits of another process is not saved. Readers save it too, if they can
+        write next to the database, so the next reader loads it instead of scanning every table again.
+        """
+
+        if self.bloom is None or self._bloom_txnid != self.env.info()['last_txnid']:
+            return
+        try:
+            self.bloom.save(self.bloom_path, self._bloom_txnid)
+        except OSError:
+            if not self.readonly:
+                raise
+
+    def block_known(self, block_hash):
+        """
+        Return True if a block with this hash is stored in any block table.
+        With bloom=True, most unknown blocks are answered without touching lmdb, as long as no other
+        process committed since the filter was built: the filter doesn't have their blocks, so a block
+        missing from it is looked up in lmdb, and added to it if found.
+        """
+
+        block_hash_bytes = self._to_block_hash_bytes(block_hash)
+        if self.bloom is not None and block_hash_bytes not in self.bloom:
+            if self._bloom_txnid == self.env.info()['last_txnid']:
+                return False
+            block_type, _ = self.get_block_any(block_hash_bytes)
+            if block_type is not None:
+                self.bloom.add(block_hash_bytes)
+            return block_type is not None
+
+        block_type, _ = self.get_block_any(block_hash_bytes)
+        return block_type is not None
+
+    def snapshot(self, buffers=False):
+        """
+        Return a Snapshot that reuses one read transaction for many lookups, use it as a context manager.
+        With buffers=True the values are zero-copy memoryviews, see Snapshot.
+        """
+
+        return Snapshot(self, buffers)
+
+    def get_many(self, db_name, keys):
+        """
+        Get the values of many keys in one read transaction, in the order of keys, None if not found.
+        """
+
+        with self.snapshot() as snap:
+            return snap.get_many(db_name, keys)
+
+    def _buffer_item(self, item):
+        """
+        Group commit: add an item to the buffer, wake up the flusher if the buffer is full.
+        """
+
+        db_name, key_bytes, data_bytes = item
+        with self._buffer_cond:
+            if self._flush_error:
+                raise self._flush_error
+            self._buffer[(db_name, key_bytes)] = data_bytes
+            self._buffered_seq += 1
+            if len(self._buffer) >= self.flush_entries:
+                self._buffer_cond.notify_all()
+
+    def _flush_loop(self):
+        """
+        Group commit: the background thread that writes the buffer in one transaction.
+        Items stay in the buffer until committed, so readers never miss them.
+        """
+
+        cond = self._buffer_cond
+        while True:
+            with cond:
+                cond.wait_for(lambda: self._closing or self._flush_requested
+                              or len(self._buffer) >= self.flush_entries, timeout=self.flush_interval)
+                self._flush_requested = False
+                if not self._buffer:
+                    self._flushed_seq = self._buffered_seq
+                    cond.notify_all()
+                    if self._closing:
+                        return
+                    continue
+                pending = sorted(self._buffer.items())
+                pending_seq = self._buffered_seq
+
+            try:
+                self._put_items([(db_name, key_bytes, data_bytes) for (db_name, key_bytes), data_bytes in pending])
+                error = None
+            except Exception as e:
+                error = e
+
+            with cond:
+                if error:
+                    # keep the items buffered, put_block() and flush() raise the error.
+                    self._flush_error = error
+                    cond.notify_all()
+                    return
+                for key, data_bytes in pending:
+                    if self._buffer.get(key) is data_bytes:
+                        del self._buffer[key]
+                self._flushed_seq = pending_seq
+                cond.notify_all()
+
+    def flush(self):
+        """
+        Group commit: block until everything buffered so far is committed.
+        """
+
+        if not self.group_commit:
+            return
+
+        cond = self._buffer_cond
+        with cond:
+            seq = self._buffered_seq
+            self._flush_requested = True
+            cond.notify_all()
+            cond.wait_for(lambda: self._flushed_seq >= seq or self._flush_error)
+            if self._flush_error:
+                raise self._flush_error
+
+    def close(self):
+        """
+        Flush the group commit buffer, stop the flusher and close the environment.
+        """
+
+        if self._flusher:
+            with self._buffer_cond:
+                self._closing = True
+                self._buffer_cond.notify_all()
+            self._flusher.join()
+            self._flusher = None
+            if self._flush_error:
+                raise self._flush_error
+
+        self.save_bloom()
+        self.env.close()
+
+    def iter_items(self, db_name, start=None, stop=None, prefix=None, reverse=False, batch=SCAN_BATCH_SIZE, after=None):
+        """
+        Yield (key, value) of a table in key order, see iter_batches().
+        """
+
+        for items in self.iter_batches(db_name, start, stop, prefix, reverse, batch, after):
+            for item in items:
+                yield item
+
+    def iter_batches(self, db_name, start=None, stop=None, prefix=None, reverse=False, batch=SCAN_BATCH_SIZE, after=None):
+        """
+        Yield lists of up to batch (key, value) of a table, from start (included) to stop (excluded),
+        only keys starting with prefix if given, descending if reverse=True.
+        Every batch is read in a new read transaction positioned with cursor.set_range(), so a long scan
+        doesn't pin old pages, but it may see writes committed between batches.
+        The last key of a batch is the resume token: pass it as after to continue an interrupted scan.
+        The group commit buffer is not scanned.
+        """
+
+        start = to_bytes(start) or None
+        stop = to_bytes(stop) or None
+        position = to_bytes(after) or None
+
+        if prefix is not None:
+            prefix = to_bytes(prefix)
+            prefix_stop = _prefix_end(prefix)
+            start = max(start, prefix) if start else prefix
+            if prefix_stop is not None:
+                stop = min(stop, prefix_stop) if stop else prefix_stop
+
+        db = self._get_db_handle(db_name, create=False)
+        while db is not None:
+            items = []
+            done = False
+            with self._begin(db=db) as txn:
+                cursor = txn.cursor()
+                if not reverse:
+                    if position is not None:
+                        found = cursor.set_range(position)
+                        if found and cursor.key() == position:
+                            found = cursor.next()
+                    elif start is not None:
+                        found = cursor.set_range(start)
+                    else:
+                        found = cursor.first()
+
+                    while found and len(items) < batch:
+                        key = cursor.key()
+                        if stop is not None and key >= stop:
+                            done = True
+                            break
+                        items.append((key, cursor.value()))
+                        found = cursor.next()
+                else:
+                    upper = position if position is not None else stop
+                    if upper is not None:
+                        found = cursor.prev() if cursor.set_range(upper) else cursor.last()
+                    else:
+                        found = cursor.last()
+
+                    while found and len(items) < batch:
+                        key = cursor.key()
+                        if start is not None and key < start:
+                            done = True
+                            break
+                        items.append((key, cursor.value()))
+                        found = cursor.prev()
+
+            if items:
+                yield items
+                position = items[-1][0]
+
+            if done or not found or not items:
+                return
+
+    def parallel_scan(self, db_name, fn, workers=None, decode=False, reduce=add, initial=None):
+        """
+        Apply fn to every record of a table in worker processes, and reduce the results.
+        fn(key, value) is called for every record, or fn(block) with a decoded Block if decode=True.
+        Results are combined with reduce(a, b), starting from initial (the first result if None),
+        None results are skipped. fn and reduce must be picklable, e.g. module level functions.
+        Every worker opens its own read-only environment, and scans ranges of the 32 bytes key space.
+
+            def block_count(key, value):
+                return 1
+
+            count = storage.parallel_scan('state', block_count, workers=8)
+        """
+
+        self.flush()
+        if self._to_db_name(db_name) not in self._get_db_names():
+            return initial
+
+        workers = workers or os.cpu_count()
+        ranges = partition_ranges(workers * PARTITIONS_PER_WORKER)
+        jobs = [(self.db_path, self.schema, self.compact_state, db_name, start, stop, fn, decode, reduce)
+                for start, stop in ranges]
+
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(workers) as pool:
+            results = pool.map(_scan_partition, jobs, chunksize=1)
+
+        return _reduce_results(results, reduce, initial)
 
     def _get_block_all_db(self, block_hash):
         """
@@ -120,9 +1285,10 @@ class Storage(object):
 
         db_list = self._get_db_names()
         db_dict = {}
-        for db_name in db_list:
-            data = self.get_block(db_name, block_hash)
-            db_dict[db_name] = data
+        with self.snapshot() as snap:
+            for db_name in db_list:
+                data = snap.get_block(db_name, block_hash)
+                db_dict[db_name] = data
 
         return db_dict
 
@@ -131,12 +1297,9 @@ class Storage(object):
         for debug purpose: search key and value for the data, in a single db.
         """
 
-        db = self._get_db_handle(db_name)
-        with self.env.begin(db=db) as txn:
-            cursor = txn.cursor()
-            for key, value in cursor:
-                if data in key or data in value:
-                    return key, value
+        for key, value in self.iter_items(db_name):
+            if data in key or data in value:
+                return key, value
 
         return None, None
 
@@ -163,10 +1326,11 @@ class Storage(object):
 
         db_list = self._get_db_names()
         db_dict = {}
-        for db_name in db_list:
-            value = self._get_data(db_name, key_bytes)
-            if value:
-                db_dict[db_name] = value.hex()
+        with self.snapshot() as snap:
+            for db_name in db_list:
+                value = snap.get(db_name, key_bytes)
+                if value:
+                    db_dict[db_name] = value.hex()
 
         return db_dict
 
@@ -175,12 +1339,549 @@ class Storage(object):
         for debug purpose: return how many items are there in the table.
         """
 
-        cnt = 0
-        db = self._get_db_handle(db_name)
-        with self.env.begin(db=db) as txn:
-            cursor = txn.cursor()
-            for key, value in cursor:
-                cnt += 1
+        return self.table_stats(db_name)['entries']
+
+
+
+def _prefix_end(prefix):
+    """
+    Return the smallest key greater than every key starting with prefix, None if there isn't one.
+    """
+
+    prefix = bytearray(prefix)
+    while prefix and prefix[-1] == 0xff:
+        prefix.pop()
+    if not prefix:
+        return None
+    prefix[-1] += 1
+    return bytes(prefix)
+
+
+class MapGrowthBlocked(lmdb.MapFullError):
+    """
+    The map is full and can't grow: the thread that needs the room holds a transaction itself.
+    """
+
+
+class _TxnGate(object):
+
+    def __init__(self):
+        """
+        env.set_mapsize() is only allowed while no transaction is active in the process,
+        so every transaction is begun inside the gate, and resize() waits until the gate is empty.
+        Transactions are counted per thread that began them, and released with that thread's token, so
+        a snapshot may be closed from another thread. A thread that holds a transaction enters again
+        without waiting for a resize, it would wait for itself.
+        """
+
+        self._cond      = threading.Condition()
+        self._active    = 0
+        self._resizing  = False
+        self._owners    = {}    # thread ident -> transactions it began and are still open
+
+    def enter(self):
+        """
+        Enter the gate, return the token to pass to exit().
+        """
+
+        owner = threading.get_ident()
+        with self._cond:
+            if not self._owners.get(owner):
+                self._cond.wait_for(lambda: not self._resizing)
+            self._owners[owner] = self._owners.get(owner, 0) + 1
+            self._active += 1
+        return owner
+
+    def exit(self, owner):
+        with self._cond:
+            self._owners[owner] -= 1
+            if not self._owners[owner]:
+                del self._owners[owner]
+            self._active -= 1
+            if not self._active:
+                self._cond.notify_all()
+
+    def __enter__(self):
+        self.enter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.exit(threading.get_ident())
+
+    def resize(self, fn):
+        """
+        Call fn() when no transaction is active: it waits for every open snapshot and iterator
+        (iter_chain(), iter_blocks() of a snapshot...) of the other threads to be closed.
+        Raise MapGrowthBlocked if this thread holds one, it can't wait for itself.
+        """
+
+        with self._cond:
+            held = self._owners.get(threading.get_ident(), 0)
+            if held:
+                raise MapGrowthBlocked('the map is full and can not grow while this thread holds %d open '
+                                       'transaction(s), close its snapshots and iterators first' % held)
+            self._cond.wait_for(lambda: not self._resizing)
+            self._resizing = True
+            try:
+                self._cond.wait_for(lambda: not self._active)
+                fn()
+            finally:
+                self._resizing = False
+                self._cond.notify_all()
+
+
+def migrate_schema(src, dst, batch_size=BATCH_SIZE):
+    """
+    Copy every block of Storage src into Storage dst, e.g. from the typed to the unified schema.
+    Return (inserted, overwritten) counts.
+    """
+
+    return dst.put_blocks(src.iter_block_items(), batch_size=batch_size)
+
+
+def partition_ranges(count):
+    """
+    Split the 32 bytes key space into count (start, stop) ranges for iter_items(), None means unbounded.
+    """
+
+    bounds = [(i << 256) // count for i in range(count + 1)]
+    keys = [bound.to_bytes(32, 'big') for bound in bounds[1:-1]]
+    return list(zip([None] + keys, keys + [None]))
+
+
+def _reduce_results(results, reduce, initial):
+    acc = initial
+    for result in results:
+        if result is None:
+            continue
+        acc = result if acc is None else reduce(acc, result)
+    return acc
+
+
+def _scan_partition(job):
+    """
+    parallel_scan() worker: scan one key range in a fresh read-only Storage.
+    """
+
+    db_path, schema, compact_state, db_name, start, stop, fn, decode, reduce = job
+    storage = Storage(db_path, readonly=True, schema=schema, compact_state=compact_state)
+    db_name = storage._to_db_name(db_name)
+
+    def results():
+        for key, value in storage.iter_items(db_name, start=start, stop=stop):
+            if decode:
+                block_type, data = storage._item_block(db_name, value) or (db_name.decode(), value)
+                block = Block(type=block_type)
+                block.from_storage_bytes(data)
+                block._set_hash_bytes(key)
+                yield fn(block)
+            else:
+                yield fn(key, value)
+
+    try:
+        return _reduce_results(results(), reduce, None)
+    finally:
+        storage.close()
+
+
+def pack_block_info(block_type, account, height, balance):
+    """
+    Pack an idx_block_info value, balance is None if unknown.
+    """
+
+    balance_bytes = b'' if balance is None else balance.to_bytes(16, 'big')
+    return bytes([BLOCK_TYPE_CODES[block_type]]) + account + height.to_bytes(8, 'big') + balance_bytes
 
-        return cnt
 
+def unpack_block_info(info):
+    """
+    Reverse pack_block_info(), return (block_type, account, height, balance).
+    """
+
+    block_type = BLOCK_TYPES[info[0] - 2]
+    account = bytes(info[1:33])
+    height = int.from_bytes(info[33:41], 'big')
+    balance = int.from_bytes(info[41:57], 'big') if len(info) > 41 else None
+    return block_type, account, height, balance
+
+
+class Snapshot(object):
+
+    def __init__(self, storage, buffers=False):
+        """
+        A read transaction and its cursors, reused for many lookups:
+
+            with storage.snapshot() as snap:
+                data = snap.get_block('state', block_hash)
+
+        Lookups see the database as it was when the snapshot began (plus the group commit buffer).
+        A Snapshot belongs to the thread that created it, keep it short-lived so it doesn't pin old pages.
+
+        With buffers=True, values (and Blocks from read_block()/iter_blocks()) are memoryviews into the
+        lmdb map. They are only valid until the snapshot is closed, anything that outlives it must be
+        copied out with bytes(value) or block.detach(). Using them afterwards is undefined.
+        """
+
+        self.storage    = storage
+        self.buffers    = buffers
+        # only the handles opened before the transaction begins are usable in it, see _get_db().
+        self._handles   = dict(storage._db_handle_dict)
+        self._begin     = storage._begin(buffers=buffers)
+        self.txn        = self._begin.__enter__()
+        self._cursors   = {}
+        self._db_names  = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.txn:
+            self._cursors = {}
+            self.txn = None
+            # the read transaction is aborted on exit.
+            self._begin.__exit__(None, None, None)
+
+    def _get_db(self, db_name):
+        """
+        Return the handle of a table in this snapshot, None if the table doesn't exist in it.
+        A handle opened after the transaction began is invalid in it, a table first used here
+        is opened in the snapshot transaction instead.
+        """
+
+        db_name = self.storage._to_db_name(db_name)
+        db = self._handles.get(db_name)
+        if db is None and db_name in self.get_db_names():
+            db = self._handles[db_name] = self.storage.env.open_db(db_name, txn=self.txn, create=False)
+        return db
+
+    def _get_cursor(self, db_name):
+        """
+        One cursor per db for the lifetime of the snapshot, None if the table doesn't exist.
+        """
+
+        db_name = self.storage._to_db_name(db_name)
+        if db_name not in self._cursors:
+            db = self._get_db(db_name)
+            self._cursors[db_name] = None if db is None else self.txn.cursor(db=db)
+
+        return self._cursors[db_name]
+
+    def _get_buffered(self, db_name, key_bytes):
+        buffer = self.storage._buffer
+        if buffer:
+            return buffer.get((self.storage._to_db_name(db_name), key_bytes))
+        return None
+
+    def get(self, db_name, key_bytes):
+        if not key_bytes:
+            return None
+
+        data = self._get_buffered(db_name, key_bytes)
+        if data is not None:
+            return data
+
+        cursor = self._get_cursor(db_name)
+        return None if cursor is None else cursor.get(key_bytes)
+
+    def get_block(self, block_type, block_hash):
+        block_hash_bytes = self.storage._to_block_hash_bytes(block_hash)
+        value = self.get(self.storage._block_table(block_type), block_hash_bytes)
+        return self.storage._decode_block_value(block_type, value, self.get)
+
+    def get_block_any(self, block_hash, hint=None):
+        """
+        Return (block_type, data) of a block of unknown type, (None, None) if not found.
+        The table of the hint block type is tried first.
+        """
+
+        block_hash_bytes = self.storage._to_block_hash_bytes(block_hash)
+        if hint is not None:
+            data = self.get_block(hint, block_hash_bytes)
+            if data is not None:
+                return hint, data
+
+        tables = self.get_db_names()
+        for db_name in self.storage._block_tables():
+            if db_name in tables:
+                value = self.get(db_name, block_hash_bytes)
+                if value is not None:
+                    return self.storage._item_block(db_name, value, self.get)
+
+        return None, None
+
+    def get_many(self, db_name, keys, buffered=True):
+        """
+        Get the values of many keys, in the order of keys, None if not found.
+        The keys are looked up in sorted order with a single cursor, so neighbouring pages are reused.
+        With buffered=False, the group commit buffer is not read, only the snapshot.
+        """
+
+        keys_bytes = [to_bytes(key) for key in keys]
+        values = [None] * len(keys_bytes)
+        cursor = self._get_cursor(db_name)
+
+        for i in sorted(range(len(keys_bytes)), key=keys_bytes.__getitem__):
+            key_bytes = keys_bytes[i]
+            data = self._get_buffered(db_name, key_bytes) if buffered else None
+            if data is None and key_bytes and cursor is not None and cursor.set_key(key_bytes):
+                data = cursor.value()
+            values[i] = data
+
+        return values
+
+    def read_block(self, block_type, block_hash):
+        """
+        Return the decoded Block, or None if not found.
+        With buffers=True, the Block fields point into the lmdb map, see __init__().
+        """
+
+        data = self.get_block(block_type, block_hash)
+        if data is None:
+            return None
+
+        block = Block(type=self.storage._to_db_name(block_type).decode())
+        block.from_storage_bytes(data, copy=False)
+        block._set_hash_bytes(self.storage._to_block_hash_bytes(block_hash))
+        return block
+
+    def iter_blocks(self, block_type):
+        """
+        Yield every decoded Block in the table, in hash order.
+        With buffers=True, nothing is copied, see __init__().
+        """
+
+        type_name = self.storage._to_db_name(block_type).decode()
+        db_name = self.storage._block_table(block_type)
+        for key, value in self._get_cursor(db_name) or ():
+            data = self.storage._decode_block_value(type_name, value, self.get)
+            if data is None:
+                continue
+            block = Block(type=type_name)
+            block.from_storage_bytes(data, copy=False)
+            block._set_hash_bytes(key)
+            yield block
+
+    def iter_all_blocks(self):
+        """
+        Yield every decoded Block of every block table, see iter_blocks().
+        """
+
+        tables = self.get_db_names()
+        for db_name in self.storage._block_tables():
+            if db_name not in tables:
+                continue
+            for key, value in self._get_cursor(db_name):
+                block_type, data = self.storage._item_block(db_name, value, self.get)
+                block = Block(type=block_type)
+                block.from_storage_bytes(data, copy=False)
+                block._set_hash_bytes(key)
+                yield block
+
+    def _index_cursor(self, db_name, method):
+        """
+        Return the cursor of an index table, raise ValueError if the storage has no indexes:
+        an account missing from an index that isn't maintained is not an unknown account.
+        """
+
+        cursor = self._get_cursor(db_name) if self.storage.indexes else None
+        if cursor is None:
+            raise ValueError('%s() needs indexes=True, see rebuild_indexes()' % method)
+        return cursor
+
+    def get_block_info(self, block_hash):
+        """
+        Return (block_type, account, height, balance) from idx_block_info, None if not indexed.
+        """
+
+        cursor = self._index_cursor(b'idx_block_info', 'get_block_info')
+        info = cursor.get(self.storage._to_block_hash_bytes(block_hash))
+        if info is None:
+            return None
+        return unpack_block_info(info)
+
+    def get_frontier(self, account):
+        cursor = self._index_cursor(b'idx_frontiers', 'get_frontier')
+        frontier = cursor.get(self.storage._to_account_bytes(account))
+        return None if frontier is None else bytes(frontier)
+
+    def _iter_prefix(self, db_name, prefix):
+        """
+        Yield (key, value) of the keys starting with prefix, with cursor.set_range().
+        """
+
+        cursor = self._get_cursor(db_name)
+        if cursor is None or not cursor.set_range(prefix):
+            return
+        for key, value in cursor:
+            if bytes(key[:len(prefix)]) != prefix:
+                return
+            yield key, value
+
+    def get_chain(self, account):
+        self._index_cursor(b'idx_chains', 'get_chain')
+        account_bytes = self.storage._to_account_bytes(account)
+        return [bytes(block_hash) for _, block_hash in self._iter_prefix(b'idx_chains', account_bytes)]
+
+    def get_receivables(self, account):
+        self._index_cursor(b'idx_receivables', 'get_receivables')
+        account_bytes = self.storage._to_account_bytes(account)
+        receivables = []
+        for key, amount in self._iter_prefix(b'idx_receivables', account_bytes):
+            amount = int.from_bytes(amount, 'big') if len(amount) else None
+            receivables.append((bytes(key[32:]), amount))
+        return receivables
+
+    def scan_wallet(self, accounts):
+        """
+        Return {account: {'frontier', 'balance', 'pending', 'receivables'}} for an iterable of Accounts,
+        addresses or verifying keys, keyed as given. pending is the sum of the known receivable amounts,
+        receivables their count, unknown amounts included. frontier and balance are None if unknown.
+        The accounts are sorted, so idx_frontiers and idx_receivables are each walked once in key order
+        with cursor.set_range(), and the balances are read from idx_block_info in frontier order.
+        Only the snapshot is read: index tables are never buffered, so the blocks still in the group commit
+        buffer are not seen. Storage.scan_wallet() flushes the buffer before taking the snapshot.
+        """
+
+        cursor = self._index_cursor(b'idx_receivables', 'scan_wallet')
+        keys = {}
+        for account in accounts:
+            keys.setdefault(self.storage._to_account_bytes(account), []).append(account)
+        account_keys = sorted(keys)
+
+        frontiers = self.get_many(b'idx_frontiers', account_keys, buffered=False)
+        infos = self.get_many(b'idx_block_info', [frontier or b'' for frontier in frontiers], buffered=False)
+
+        pending = {}
+        for account_bytes in account_keys:
+            amount, count = 0, 0
+            found = account_bytes and cursor.set_range(account_bytes)
+            while found and cursor.key()[:32] == account_bytes:
+                amount += int.from_bytes(cursor.value(), 'big')
+                count += 1
+                found = cursor.next()
+            pending[account_bytes] = (amount, count)
+
+        result = {}
+        for account_bytes, frontier, info in zip(account_keys, frontiers, infos):
+            scan = {
+                'frontier':     None if frontier is None else bytes(frontier),
+                'balance':      None if info is None else unpack_block_info(info)[3],
+                'pending':      pending[account_bytes][0],
+                'receivables':  pending[account_bytes][1],
+            }
+            for account in keys[account_bytes]:
+                result[account] = scan
+        return result
+
+    def iter_chain(self, account_or_hash, direction='forward', limit=None):
+        """
+        Yield the decoded Blocks of a chain, from a block hash (included), or from an account: forward from
+        its first block, backward from its frontier (an account needs indexes). At most limit blocks.
+        With indexes, the hashes are read ahead from idx_chains in runs of CHAIN_PREFETCH and looked up in
+        sorted order, so the cursors stay on neighbouring pages. Without, the walk follows the previous and
+        next fields, one lookup per block.
+        Blocks are decoded without another copy of the value, with buffers=True they point into the lmdb map.
+        """
+
+        if direction not in CHAIN_DIRECTIONS:
+            raise ValueError('unknown direction: %s' % direction)
+        backward = direction == 'backward'
+
+        block_hash, block_type = self._chain_start(account_or_hash, backward)
+        if block_hash is None:
+            return
+
+        info = self.get_block_info(block_hash) if self._has_chains() else None
+        if info is not None:
+            blocks = self._walk_chain_index(info[1], info[2], info[0], backward)
+        else:
+            blocks = self._walk_chain_links(block_hash, block_type, backward)
+
+        for block in islice(blocks, limit):
+            yield block
+
+    def _chain_start(self, account_or_hash, backward):
+        """
+        Return (block_hash, block_type or None) where a chain walk starts, (None, None) if not found.
+        """
+
+        key_bytes = to_bytes(account_or_hash, 32)
+        if key_bytes:
+            block_type, _ = self.get_block_any(key_bytes)
+            if block_type is not None:
+                return key_bytes, block_type
+
+        account_bytes = self.storage._to_account_bytes(account_or_hash)
+        if not account_bytes or not self._has_chains():
+            return None, None
+        if backward:
+            return self.get_frontier(account_bytes), None
+        for _, block_hash in self._iter_prefix(b'idx_chains', account_bytes):
+            return bytes(block_hash), None
+        return None, None
+
+    def _has_chains(self):
+        return self.storage.indexes and b'idx_chains' in self.get_db_names()
+
+    def _decode_block(self, block_type, block_hash, data):
+        block = Block(type=block_type)
+        block.from_storage_bytes(data, copy=False)
+        block._set_hash_bytes(block_hash)
+        return block
+
+    def _walk_chain_links(self, block_hash, block_type, backward):
+        """
+        Follow previous (backward) or next (forward) until a zero or unknown hash.
+        The type of the last block is tried first, chains rarely change block type.
+        """
+
+        while True:
+            block_type, data = self.get_block_any(block_hash, hint=block_type)
+            if block_type is None:
+                return
+            block = self._decode_block(block_type, block_hash, data)
+            yield block
+
+            block_hash = block.previous if backward else block.next
+            if not block_hash or block_hash == ZERO_HASH:
+                return
+            block_hash = bytes(block_hash)
+
+    def _walk_chain_index(self, account, height, block_type, backward):
+        """
+        Walk idx_chains from account + height with its own cursor, CHAIN_PREFETCH hashes at a time,
+        looked up with get_many() in the table of the last block type, the others with get_block_any().
+        """
+
+        cursor = self.txn.cursor(db=self._get_db(b'idx_chains'))
+        found = cursor.set_key(account + height.to_bytes(8, 'big'))
+        while found:
+            hashes = []
+            while found and len(hashes) < CHAIN_PREFETCH:
+                if bytes(cursor.key()[:32]) != account:
+                    found = False
+                    break
+                hashes.append(bytes(cursor.value()))
+                found = cursor.prev() if backward else cursor.next()
+
+            values = self.get_many(self.storage._block_table(block_type), hashes)
+            for block_hash, value in zip(hashes, values):
+                data = self.storage._decode_block_value(block_type, value, self.get)
+                if data is None:
+                    # another block type, or a pruned block.
+                    found_type, data = self.get_block_any(block_hash)
+                    if found_type is None:
+                        continue
+                    block_type = found_type
+                yield self._decode_block(block_type, block_hash, data)
+
+    def get_db_names(self):
+        """
+        Return the names of all tables, from the main db of this snapshot.
+        """
+
+        if self._db_names is None:
+            self._db_names = [bytes(key) for key, _ in self.txn.cursor()]
+        return self._db_names
@@ -24,32 +24,74 @@ def bytes_to_hex(b):
     return b.hex()
 
 
-def hex_to_bytes(h):
+def hex_to_bytes(h, length=0):
     """
-    Convert hex string to bytes.
+    Convert hex string to bytes, length is bytes length.
+    If length=0, don't check length.
+    Strict fast path: raise ValueError if h is not a hex string of the given length.
     """
-    is_valid_hex(h, strict=True)
-    return bytes.fromhex(h)
+    if not isinstance(h, str):
+        raise ValueError('hex_to_bytes: data is not str')
+
+    try:
+        b = bytes.fromhex(h)
+    except ValueError:
+        raise ValueError('data is not hex string or length not match')
+
+    if length != 0 and len(b) != length:
+        raise ValueError('data is not hex string or length not match')
+
+    return b
+
+
+def buffer_to_bytes(data, length=0, copy=True):
+    """
+    Convert bytes/bytearray/memoryview to bytes, length is bytes length.
+    If length=0, don't check length.
+    If copy=False, a memoryview is returned as it is, so the caller must keep its owner alive.
+    Strict fast path: raise ValueError if data is not a buffer of the given length.
+    """
+    if type(data) is bytes:
+        b = data
+    elif isinstance(data, memoryview):
+        b = bytes(data) if copy else data
+    elif isinstance(data, (bytes, bytearray)):
+        b = bytes(data)
+    else:
+        raise ValueError('buffer_to_bytes: data is not bytes')
 
+    if length != 0 and len(b) != length:
+        raise ValueError('data is not bytes at given length')
 
-def to_bytes(data, length=0, strict=False):
+    return b
+
+
+def to_bytes(data, length=0, strict=False, copy=True):
     """
     Convert data to bytes if legal, check bytes length, return bytes.
     If illegal, return empty bytes.
+    Every input is inspected only once: buffers are length checked, hex strings are parsed once.
+    bytes are returned without copy, memoryview is only copied if copy=True.
     """
 
-    bytes_data = b''
-    if isinstance(data, (bytes, bytearray)) and length == 0:
-        bytes_data = bytes(data)
-    elif isinstance(data, (bytes, bytearray)) and len(data) == length:
-        bytes_data = bytes(data)
-    elif is_valid_hex(data, length*2):
-        bytes_data = hex_to_bytes(data)
-    elif strict:
-        raise Exception('data is not bytes at given length')
+    bytes_data = None
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        if length == 0 or len(data) == length:
+            bytes_data = buffer_to_bytes(data, copy=copy)
+    elif isinstance(data, str) and (length == 0 or len(data) == length*2):
+        try:
+            bytes_data = bytes.fromhex(data)
+        except ValueError:
+            pass
+
+    if bytes_data is None:
+        if strict:
+            raise ValueError('data is not bytes at given length')
+        bytes_data = b''
 
     return bytes_data
 
+
 def hex_to_int(h):
     """
     Convert hex string to int.
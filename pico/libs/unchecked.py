@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import time
+from collections import OrderedDict
+
+UNCHECKED_MAX_BLOCKS = 100000
+# seconds a block waits for its dependency before it is dropped.
+UNCHECKED_MAX_AGE = 600
+
+
+class UncheckedCache(object):
+
+    def __init__(self, max_blocks=UNCHECKED_MAX_BLOCKS, max_age=UNCHECKED_MAX_AGE):
+        """
+        Blocks that arrived before a block they depend on (their previous, or the send they receive),
+        indexed by the hash of that missing dependency:
+
+            if ledger.apply(block_hash, data) == 'gap_previous':
+                unchecked.add(previous, block_hash, data)
+            ...
+            for block_hash, data in unchecked.release(applied_hash):
+                ledger.apply(block_hash, data)
+
+        A block already waiting is not added again. Beyond max_blocks the oldest blocks are dropped, and so
+        are blocks older than max_age seconds, checked on add(). Ledger.process() runs the whole cascade.
+        """
+
+        self.max_blocks     = max_blocks
+        self.max_age        = max_age
+        self._blocks        = OrderedDict()     # block hash -> (dependency, data, arrival time), oldest first
+        self._waiting       = {}                # dependency -> {block hash: None}, in arrival order
+
+        self.added          = 0
+        self.duplicates     = 0
+        self.evicted        = 0
+        self.expired        = 0
+        self.released       = 0
+        self.arrivals       = 0                 # record_arrival() calls
+        self.released_per_arrival = {}          # blocks released by one arrival -> arrival count
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __contains__(self, block_hash):
+        return bytes(block_hash) in self._blocks
+
+    def add(self, dependency, block_hash, data, now=None):
+        """
+        Keep a block until dependency arrives, return False if it's already waiting.
+        """
+
+        block_hash = bytes(block_hash)
+        if block_hash in self._blocks:
+            self.duplicates += 1
+            return False
+
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        while len(self._blocks) >= self.max_blocks:
+            self._remove(*self._blocks.popitem(last=False))
+            self.evicted += 1
+
+        dependency = bytes(dependency)
+        self._blocks[block_hash] = (dependency, bytes(data), now)
+        self._waiting.setdefault(dependency, {})[block_hash] = None
+        self.added += 1
+        return True
+
+    def _remove(self, block_hash, entry):
+        waiting = self._waiting[entry[0]]
+        del waiting[block_hash]
+        if not waiting:
+            del self._waiting[entry[0]]
+
+    def expire(self, now=None):
+        """
+        Drop the blocks older than max_age, return how many.
+        """
+
+        limit = (time.monotonic() if now is None else now) - self.max_age
+        count = 0
+        while self._blocks:
+            block_hash, entry = next(iter(self._blocks.items()))
+            if entry[2] > limit:
+                break
+            del self._blocks[block_hash]
+            self._remove(block_hash, entry)
+            count += 1
+        self.expired += count
+        return count
+
+    def release(self, dependency):
+        """
+        dependency arrived: remove and return the [(block_hash, data)] waiting for it, in arrival order.
+        """
+
+        released = [(block_hash, self._blocks.pop(block_hash)[1])
+                    for block_hash in self._waiting.pop(bytes(dependency), ())]
+        self.released += len(released)
+        return released
+
+    def record_arrival(self, released):
+        """
+        Count the blocks released by one arrival, the cascade included.
+        """
+
+        self.arrivals += 1
+        self.released_per_arrival[released] = self.released_per_arrival.get(released, 0) + 1
+
+    def stats(self):
+        return {
+            'blocks':               len(self._blocks),
+            'dependencies':         len(self._waiting),
+            'added':                self.added,
+            'duplicates':           self.duplicates,
+            'evicted':              self.evicted,
+            'expired':              self.expired,
+            'released':             self.released,
+            'released_per_arrival': dict(self.released_per_arrival),
+        }
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+from pyblake2 import blake2b
+
+from .account import Account
+from .types_convert import to_bytes
+
+# block hash(32) + digest of signer, signature and work(16) -> b''
+VERIFIED_TABLE = b'verified'
+DIGEST_SIZE = 16
+
+
+def verified_key(block_hash, verifying_key, signature, work):
+    """
+    The block hash covers the fields of the block, the digest covers the signer's verifying key, the signature
+    and the work: a block with the same hash and another signature or work is not verified by this key.
+    The signer is in the digest because the hashes of legacy send/receive/change blocks don't cover
+    the account, a signature checked against one key proves nothing for a block of another account.
+    """
+
+    h = blake2b(digest_size=DIGEST_SIZE)
+    h.update(to_bytes(verifying_key, 32, strict=True))
+    h.update(to_bytes(signature, 64, strict=True))
+    h.update(to_bytes(work, 8, strict=True))
+    return to_bytes(block_hash, 32, strict=True) + h.digest()
+
+
+class VerifiedTable(object):
+
+    def __init__(self, storage):
+        """
+        The results of successful signature and work verifications, in the VERIFIED_TABLE of a Storage.
+        Any process that opens the database shares them, so a block proven valid once is never verified again.
+        Only successes are recorded: a failure may come from a block still missing its account.
+        """
+
+        self.storage = storage
+        if not storage.readonly:
+            storage._get_db_handle(VERIFIED_TABLE)
+
+    def is_verified(self, block_hash, verifying_key, signature, work):
+        key = verified_key(block_hash, verifying_key, signature, work)
+        return self.storage._get_data(VERIFIED_TABLE, key) is not None
+
+    def filter_verified(self, blocks):
+        """
+        Return the set of (block_hash, verifying_key, signature, work) already verified,
+        looked up in one read transaction.
+        """
+
+        blocks = list(blocks)
+        if not blocks:
+            return set()
+        values = self.storage.get_many(VERIFIED_TABLE, [verified_key(*block) for block in blocks])
+        return set(block for block, value in zip(blocks, values) if value is not None)
+
+    def record(self, blocks):
+        """
+        Record an iterable of verified (block_hash, verifying_key, signature, work) in one write transaction.
+        """
+
+        keys = [(verified_key(*block), b'') for block in blocks]
+        db = self.storage._get_db_handle(VERIFIED_TABLE)
+        if keys:
+            self.storage._write(lambda txn: txn.cursor(db=db).putmulti(keys))
+
+    def verify_block(self, block, account=None):
+        """
+        Return True if the signature and the work of a Block are valid, from the table if recorded,
+        else by verifying it and recording the success. account is the address or verifying key of the signer,
+        the account field of open and state blocks by default.
+        The hash is always calculated from the fields, block.hash is not trusted.
+        """
+
+        account = account or block.account
+        if not account:
+            raise ValueError('the account of a %s block must be given' % block.type)
+
+        signer = Account(verifying_key=account)
+        block_hash = block.calculate_hash()
+        entry = (block_hash, signer._verifying_key_bytes, block._signature_bytes, block._work_bytes)
+        if self.is_verified(*entry):
+            return True
+
+        if not (block.work_valid() and signer.signature_valid(block_hash, block._signature_bytes)):
+            return False
+
+        if not self.storage.readonly:
+            self.record([entry])
+        return True
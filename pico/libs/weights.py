@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import heapq
+
+# representative(32) -> weight(16), and POSITION_KEY -> position(8) + last hash(32) of the LedgerState saved.
+WEIGHTS_TABLE = b'rep_weights'
+POSITION_KEY = b'position'
+
+
+class RepWeights(object):
+
+    def __init__(self):
+        """
+        The voting weight of every representative, the sum of the balances of the accounts it represents:
+
+            state.weights = RepWeights.from_state(state)
+            state.apply(block_type, block_hash, data)      # moves the weight of the account
+            weights.top(10)
+
+        Representatives are interned: ids maps a representative to its index in reps and weights,
+        a balance change is one dict lookup and two integer updates. Weights are exact ints, raw amounts
+        need 128 bits, more than the array module holds, so weights is a list indexed by id.
+        Ids are never freed, a representative without weight keeps its slot.
+        """
+
+        self.ids        = {}    # representative -> id
+        self.reps       = []    # id -> representative
+        self.weights    = []    # id -> weight
+        self.total      = 0
+        self._dirty     = set() # ids changed since the last save()
+
+    def __len__(self):
+        return len(self.reps)
+
+    def _intern(self, representative):
+        rep_id = self.ids.get(representative)
+        if rep_id is None:
+            rep_id = self.ids[representative] = len(self.reps)
+            self.reps.append(representative)
+            self.weights.append(0)
+        return rep_id
+
+    def get(self, representative):
+        rep_id = self.ids.get(bytes(representative))
+        return 0 if rep_id is None else self.weights[rep_id]
+
+    def add(self, representative, amount):
+        """
+        Add amount (negative to remove) to the weight of a representative.
+        """
+
+        rep_id = self._intern(bytes(representative))
+        self.weights[rep_id] += amount
+        self.total += amount
+        self._dirty.add(rep_id)
+
+    def move(self, old_representative, old_balance, representative, balance):
+        """
+        An account frontier changed: its old balance leaves its old representative (None for a new account)
+        and its balance goes to its representative.
+        """
+
+        if old_representative == representative and old_balance == balance:
+            return
+        if old_representative is not None and old_balance:
+            self.add(old_representative, -old_balance)
+        if balance:
+            self.add(representative, balance)
+
+    def top(self, n):
+        """
+        Return the n heaviest [(representative, weight)], heaviest first, in O(reps log n).
+        """
+
+        weights = self.weights
+        return [(self.reps[rep_id], weights[rep_id])
+                for rep_id in heapq.nlargest(n, range(len(weights)), key=weights.__getitem__)]
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Sum the balances of the accounts of a LedgerState, once, apply() keeps the table up to date.
+        """
+
+        weights = cls()
+        for _, balance, representative, _ in state.accounts.values():
+            if balance:
+                weights.add(representative, balance)
+        return weights
+
+    def save(self, storage, state=None):
+        """
+        Write the weights changed since the last save() to the WEIGHTS_TABLE of a Storage,
+        in one write transaction. Representatives without weight are deleted.
+        The table is tagged with the position and last hash of state, the LedgerState the weights belong to,
+        so load() can tell a table of another position. Without state, the tag is removed.
+        """
+
+        db = storage._get_db_handle(WEIGHTS_TABLE)
+        dirty = sorted(self._dirty)
+        if not dirty and state is None:
+            return 0
+
+        def write(txn):
+            if state is not None:
+                txn.put(POSITION_KEY, state.position.to_bytes(8, 'big') + state.last_hash, db=db)
+            else:
+                txn.delete(POSITION_KEY, db=db)
+            for rep_id in dirty:
+                if self.weights[rep_id]:
+                    txn.put(self.reps[rep_id], self.weights[rep_id].to_bytes(16, 'big'), db=db)
+                else:
+                    txn.delete(self.reps[rep_id], db=db)
+
+        storage._write(write)
+        self._dirty = set()
+        return len(dirty)
+
+    @classmethod
+    def load(cls, storage, state=None):
+        """
+        Load the table saved in a Storage, empty if it was never saved.
+        With state, raise ValueError if the table was not saved at its position: applying the blocks after
+        the table's position again would count them twice.
+        """
+
+        weights = cls()
+        position = bytes(8 + 32)    # never saved: the weights of an empty ledger
+        if WEIGHTS_TABLE in storage._get_db_names():
+            position = None
+            for key, value in storage.iter_items(WEIGHTS_TABLE):
+                if len(key) == 32:
+                    weights.add(bytes(key), int.from_bytes(value, 'big'))
+                elif bytes(key) == POSITION_KEY:
+                    position = bytes(value)
+
+        if state is not None and position != state.position.to_bytes(8, 'big') + state.last_hash:
+            raise ValueError('weights table is not at the position of the ledger state')
+        weights._dirty = set()
+        return weights
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import asyncio
+
+import lmdb
+import pytest
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.storage import Storage
+from libs.async_storage import AsyncStorage, LatencyHistogram
+
+
+def test_async_storage(new_path, fake_blocks):
+    storage = Storage(new_path('async.ldb'), readonly=False)
+
+    async def main():
+        db = AsyncStorage(storage, readers=2, queue_size=4, coalesce_blocks=50)
+        # 20 concurrent callers, at most 4 queued, coalesced into fewer transactions.
+        results = await asyncio.gather(*[db.put_blocks(fake_blocks(10, start=i * 10)) for i in range(20)])
+        assert results == [(10, 0)] * 20
+        assert await db.put_block(*fake_blocks(1)[0]) == (0, 1)
+
+        assert await db.get_block('state', (42).to_bytes(32, 'big')) == fake_blocks(1, start=42)[0][2]
+        assert await db.get_block_any(b'\xee' * 32) == (None, None)
+        keys = [key async for key, _ in db.iter_items('state', batch=16)]
+        assert keys == [block_hash for _, block_hash, _ in fake_blocks(200)]
+
+        stats = db.stats()
+        assert stats['queue_depth'] == 0
+        assert stats['latency']['put_blocks']['count'] == 21
+        assert stats['latency']['commit']['count'] < 21
+        assert stats['latency']['iter_items']['count'] == 14
+        await db.close()
+
+    asyncio.run(main())
+    assert storage._get_db_size('state') == 200
+
+
+def test_async_storage_error(new_path, fake_blocks):
+    storage = Storage(new_path('async_error.ldb'), readonly=False)
+
+    async def main():
+        db = AsyncStorage(storage)
+        with pytest.raises(lmdb.BadValsizeError):
+            await db.put_blocks([('state', b'short', b'data')])
+        assert await db.put_blocks(fake_blocks(1)) == (1, 0)
+
+        # a bad call coalesced with good ones only fails itself.
+        results = await asyncio.gather(db.put_blocks(fake_blocks(5, start=1)),
+                                       db.put_blocks([('state', b'\x01\x02', b'data')]),
+                                       db.put_blocks(fake_blocks(5, start=6)), return_exceptions=True)
+        assert results[0] == results[2] == (5, 0)
+        assert isinstance(results[1], lmdb.BadValsizeError)
+        await db.close()
+
+        with pytest.raises(ValueError):
+            await db.put_blocks(fake_blocks(1))
+
+    asyncio.run(main())
+    assert storage._get_db_size('state') == 11
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram()
+    for seconds in [0.000001, 0.000003, 0.000003, 0.1]:
+        histogram.record(seconds)
+
+    assert histogram.count == 4
+    assert histogram.percentile(50) == 4e-6
+    assert histogram.percentile(100) >= 0.1
+    assert histogram.stats()['max'] == 0.1
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.bloom import BloomFilter
+
+
+def test_bloom_false_positive_rate():
+    bloom = BloomFilter.for_capacity(10000, 0.01)
+    keys = [os.urandom(32) for _ in range(10000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(os.urandom(32) in bloom for _ in range(10000))
+    assert false_positives < 300
+    assert 0.005 < bloom.false_positive_rate() < 0.02
+
+
+def test_bloom_save_load():
+    path = '/tmp/test-pico-bloom.bloom'
+    bloom = BloomFilter.for_capacity(100)
+    bloom.add(b'short key')
+    bloom.save(path, tag=42)
+
+    loaded, tag = BloomFilter.load(path)
+    assert tag == 42
+    assert b'short key' in loaded
+    assert loaded.count == 1
+    assert BloomFilter.load('/tmp/test-pico-bloom-missing') == (None, None)
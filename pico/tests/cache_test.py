@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.cache import LRUCache, ENTRY_OVERHEAD
+
+
+def test_lru_eviction():
+    cache = LRUCache(3 * (100 + ENTRY_OVERHEAD))
+    for i in range(3):
+        cache.fill(i, bytes(100), cache.token())
+
+    assert cache.get(0) is not None
+    cache.fill(3, bytes(100), cache.token())
+
+    # 1 is the least recently used.
+    assert cache.get(1) is None
+    assert cache.get(0) is not None
+    assert len(cache) == 3
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+
+def test_lru_stale_fill():
+    cache = LRUCache(1024 * 1024)
+    token = cache.token()
+    # a writer commits and invalidates while the reader is reading the old value.
+    cache.invalidate([b'key'])
+    cache.fill(b'key', b'old value', token)
+    assert cache.get(b'key') is None
+
+    cache.fill(b'key', b'new value', cache.token())
+    assert cache.get(b'key') == b'new value'
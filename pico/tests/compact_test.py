@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import lmdb
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.block import Block
+from libs.storage import Storage
+from libs.compact import varint_encode, varint_decode, KeyDictionary, KEYS_TABLE, IDS_TABLE, STATE_STORAGE_LENGTH
+
+
+# the state block of block_test.py, captured from the network, with a next hash.
+STATE_BLOCK_HASH = bytes.fromhex('A5A2E431F88574B2A161C92BD53DAFE05B026902A4C3D9FE33F12234CFFF0D03')
+STATE_BLOCK_NEXT = bytes.fromhex('18563C814A54535B7C12BF76A0E23291BA3769536634AB90AD0305776A533E8E')
+
+
+def make_real_state_block():
+    block = Block(type='state',
+                  account='xrb_1cp3nh6t5hw7t5nehz5decifiz41in5p3yzs91qzib9pn33hoxizqo4zos3f',
+                  previous='1ED7BB8BBF43DBD9AA5D81E1EDC5F59F95DB714056C0CBE86C9E48AD1C1EF3AE',
+                  representative='xrb_1hza3f7wiiqa7ig3jczyxj5yo86yegcmqk3criaz838j91sxcckpfhbhhra1',
+                  balance='000000120D5C7423002A0CDA22000000',
+                  link='8713D7C032E2E8D6C845FF04EC1F63D9E86EE961A2E61B9D7568EDB79CFE8A9F',
+                  signature='B186EF270BFD779A272D7B52727D06B0990E84D358613B5924464CFD9983559AC9B7DD94912D14405E0BBAB681596CFD37A19E406D2623D73C3148A94699940A',
+                  work='FCB4E6B3F4DA6EAE', next=STATE_BLOCK_NEXT.hex().upper())
+    assert block.calculate_hash() == STATE_BLOCK_HASH
+    return block.to_storage_bytes()
+
+
+def test_varint():
+    for i in [0, 1, 127, 128, 300, 2 ** 32, 2 ** 128 - 1]:
+        data = b'\xff' + varint_encode(i) + b'\xff'
+        assert varint_decode(data, 1) == (i, len(data) - 1)
+
+    assert varint_encode(127) == b'\x7f'
+    assert varint_encode(128) == b'\x80\x01'
+
+
+def test_compact_state_block(new_path):
+    data = make_real_state_block()
+    assert len(data) == STATE_STORAGE_LENGTH
+    # the first block of a chain: previous, link and next are zero and omitted, and so is a zero balance.
+    opened = data[:32] + bytes(32) + data[64:96] + bytes(16) + bytes(32) + data[144:216] + bytes(32)
+
+    env = lmdb.open(new_path('keydict.ldb'), subdir=False, max_dbs=4)
+    keys_db, ids_db = env.open_db(KEYS_TABLE), env.open_db(IDS_TABLE)
+    keydict = KeyDictionary()
+    with env.begin(write=True) as txn:
+        values = [keydict.encode_state(txn, keys_db, ids_db, block) for block in [data, opened]]
+
+    # account and representative are new ids, the zero fields and the balance leading zero bytes are dropped.
+    assert len(values[0]) == 1 + 1 + 1 + 32 + 1 + 13 + 32 + 72 + 32
+    assert len(values[1]) == 1 + 1 + 1 + 1 + 72
+    with env.begin(write=True) as txn:
+        # known keys keep their ids.
+        assert keydict.encode_state(txn, keys_db, ids_db, data) == values[0]
+        assert txn.stat(ids_db)['entries'] == 2
+
+    with env.begin() as txn:
+        get = lambda db_name, key: txn.get(key, db=ids_db)
+        assert [KeyDictionary().decode_state(value, get) for value in values] == [data, opened]
+        assert [keydict.decode_state(memoryview(value), get) for value in values] == [data, opened]
+    env.close()
+
+    storage = Storage(new_path('compact_real.ldb'), readonly=False, compact_state=True)
+    storage.put_block('state', STATE_BLOCK_HASH, data)
+    assert storage.get_block('state', STATE_BLOCK_HASH) == data
+    assert storage.get_block_any(STATE_BLOCK_HASH) == ('state', data)
+    storage.close()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import shutil
+
+import pytest
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.block import Block
+
+
+@pytest.fixture
+def new_path(tmp_path):
+    """
+    new_path(name) returns the path of a missing file or directory in the test's temporary directory,
+    a database named again in the same test is removed with its lock, index and Bloom filter files.
+    """
+
+    def new_path(name):
+        path = str(tmp_path / name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        for p in [path, path + '-lock', path + '.idx', path + '.bloom']:
+            if os.path.exists(p):
+                os.remove(p)
+        return path
+
+    return new_path
+
+
+@pytest.fixture
+def fake_blocks():
+    """
+    fake_blocks(count, block_type='state', start=0) returns [(block_type, block_hash, data)], the hashes are
+    the sequence numbers, so they sort in order, data is 248 bytes.
+    """
+
+    def fake_blocks(count, block_type='state', start=0):
+        return [(block_type, i.to_bytes(32, 'big'), i.to_bytes(8, 'big') * 31) for i in range(start, start + count)]
+
+    return fake_blocks
+
+
+@pytest.fixture
+def make_state_block():
+    """
+    make_state_block(account, previous, balance, link, representative=b'\\x01' * 32) returns
+    (block_hash, storage bytes) of a state block with empty signature, work and next.
+    """
+
+    def make_state_block(account, previous, balance, link, representative=b'\x01' * 32):
+        block = Block(type='state', account=account, previous=previous, representative=representative,
+                      balance=balance, link=link)
+        data = account + previous + representative + balance.to_bytes(16, 'big') + link + bytes(64 + 8 + 32)
+        return block.calculate_hash(), data
+
+    return make_state_block
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+
+import pytest
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.storage import Storage
+from libs.importer import import_ledger
+
+
+@pytest.fixture
+def make_source(make_state_block):
+    """
+    make_source(path, count) writes count open state blocks and two bad records, returns the [(block_hash, data)].
+    """
+
+    def make_source(path, count):
+        source = Storage(path, readonly=False)
+        blocks = [make_state_block(i.to_bytes(32, 'big'), bytes(32), i, bytes(32), representative=i.to_bytes(32, 'big'))
+                  for i in range(1, count + 1)]
+        source.put_blocks([('state', block_hash, data) for block_hash, data in blocks])
+        # a record with an unknown layout and one with a wrong hash.
+        source.put_block('state', b'\x01' * 32, b'sideband')
+        source.put_block('state', b'\x02' * 32, blocks[0][1])
+        source.close()
+        return blocks
+
+    return make_source
+
+
+def test_import_ledger(new_path, make_source):
+    source_path = new_path('source.ldb')
+    blocks = make_source(source_path, 50)
+    reports = []
+
+    storage = Storage(new_path('target.ldb'), readonly=False)
+    progress = import_ledger(source_path, storage, workers=2, verify=True, batch_size=8,
+                             checkpoint_path=new_path('checkpoint.json'), report=reports.append)
+
+    assert progress['imported'] == 50
+    assert progress['skipped'] == 2
+    assert reports[-1]['imported'] == 50
+    for block_hash, data in blocks:
+        assert storage.get_block('state', block_hash) == data
+
+
+def test_import_ledger_resume(new_path, make_source):
+    source_path = new_path('source-resume.ldb')
+    blocks = make_source(source_path, 20)
+    keys = sorted(block_hash for block_hash, _ in blocks)
+
+    checkpoint_path = new_path('checkpoint-resume.json')
+    with open(checkpoint_path, 'w') as f:
+        json.dump({'done': [], 'table': 'state', 'after': keys[9].hex()}, f)
+
+    storage = Storage(new_path('target-resume.ldb'), readonly=False)
+    progress = import_ledger(source_path, storage, workers=1, batch_size=4, checkpoint_path=checkpoint_path, report=None)
+
+    assert progress['imported'] == 10
+    assert storage.get_block('state', keys[9]) is None
+    assert storage.get_block('state', keys[10]) is not None
+    with open(checkpoint_path) as f:
+        assert json.load(f)['done'] == ['state']
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.storage import Storage
+from libs.blocklog import BlockLog
+from libs.ledger import LedgerState, Ledger, restore, state_block_hash
+from libs.block import Block
+from libs.weights import RepWeights
+from libs.unchecked import UncheckedCache
+
+
+GENESIS = b'\x99' * 32
+ALICE, BOB, CAROL, REP = b'\xaa' * 32, b'\xbb' * 32, b'\xcc' * 32, b'\x01' * 32
+
+
+def state_block(block_hash, account, previous, balance, link, representative=REP):
+    data = account + previous + representative + balance.to_bytes(16, 'big') + link + bytes(64 + 8 + 32)
+    return 'state', block_hash, data
+
+
+def make_blocks():
+    """
+    Alice opens with 100, sends 30 to Bob, Bob opens with it, Alice sends 20 more, Bob changes representative.
+    """
+
+    h = lambda i: bytes([i]) * 32
+    return [
+        state_block(h(1), ALICE, bytes(32), 100, GENESIS),
+        state_block(h(2), ALICE, h(1), 70, BOB),
+        state_block(h(3), BOB, bytes(32), 30, h(2)),
+        state_block(h(4), ALICE, h(2), 50, BOB),
+        state_block(h(5), BOB, h(3), 30, bytes(32), representative=b'\x02' * 32),
+        # a legacy block of an unknown chain.
+        ('change', h(6), h(7) + REP + bytes(64 + 8 + 32)),
+    ]
+
+
+def test_ledger_state(new_path):
+    state = LedgerState()
+    assert state.apply_blocks(make_blocks()) == 5
+    assert state.skipped == 1
+    assert state.position == 6
+    assert state.get_balance(ALICE) == 50
+    assert state.get_balance(BOB) == 30
+    assert state.get_frontier(BOB) == bytes([5]) * 32
+    assert state.get_representative(BOB) == b'\x02' * 32
+    assert state.pending == {bytes([4]) * 32: (BOB, 20)}
+
+    path = new_path('state.snapshot')
+    state.save(path)
+    loaded = LedgerState.load(path)
+    assert loaded.accounts == state.accounts
+    assert loaded.frontiers == state.frontiers
+    assert loaded.pending == state.pending
+    assert (loaded.position, loaded.last_hash, loaded.skipped) == (6, bytes([6]) * 32, 1)
+    assert LedgerState.load(new_path('missing.snapshot')) is None
+
+
+def test_restore(new_path):
+    blocks = make_blocks()
+    log_path = new_path('blocks.log')
+    snapshot_path = new_path('restore.snapshot')
+    with BlockLog(log_path, readonly=False) as log:
+        log.append_blocks(blocks[:3])
+
+    with BlockLog(log_path) as log:
+        state = restore(snapshot_path, log)
+    assert state.position == 3
+    state.save(snapshot_path)
+
+    with BlockLog(log_path, readonly=False) as log:
+        log.append_blocks(blocks[3:])
+    with BlockLog(log_path) as log:
+        # only the 3 new blocks are applied on top of the snapshot.
+        state = restore(snapshot_path, log)
+        assert state.position == 6
+        assert state.get_balance(ALICE) == 50
+
+    # a snapshot of another log is ignored.
+    other = LedgerState()
+    other.apply_blocks([state_block(b'\xee' * 32, ALICE, bytes(32), 1, GENESIS)])
+    other.save(snapshot_path)
+    with BlockLog(log_path) as log:
+        assert restore(snapshot_path, log).get_balance(ALICE) == 50
+
+
+def test_ledger(new_path):
+    # genesis holds 100 to start with.
+    state = LedgerState()
+    state.apply('state', GENESIS, GENESIS + bytes(32) + REP + (100).to_bytes(16, 'big') + bytes(32 + 104))
+    storage = Storage(new_path('ledger.ldb'), readonly=False)
+    log_path = new_path('ledger.log')
+    ledger = Ledger(storage, state, log=BlockLog(log_path, readonly=False), batch_size=2,
+                    check_hash=False)
+
+    h = lambda i: bytes([i]) * 32
+    blocks = [
+        state_block(h(1), GENESIS, GENESIS, 60, ALICE),
+        state_block(h(2), ALICE, bytes(32), 40, h(1)),
+        state_block(h(3), ALICE, h(2), 40, bytes(32), representative=b'\x02' * 32),
+        state_block(h(4), ALICE, h(3), 25, BOB, representative=b'\x02' * 32),
+        state_block(h(5), BOB, bytes(32), 15, h(4)),
+        state_block(h(6), ALICE, h(4), 20, BOB, representative=b'\x02' * 32),
+    ]
+    assert [ledger.apply(block_hash, data) for _, block_hash, data in blocks] == \
+        ['send', 'open', 'change', 'send', 'open', 'send']
+
+    rejected = [
+        blocks[4],                                      # the frontier itself
+        state_block(h(7), ALICE, h(2), 10, BOB),        # the previous is not the frontier
+        state_block(h(8), CAROL, h(9), 10, BOB),        # an unknown account with a previous
+        state_block(h(9), BOB, h(5), 25, h(20)),        # receives an unknown send
+        state_block(h(10), GENESIS, h(1), 65, h(6)),    # receives a send to Bob
+        state_block(h(11), BOB, h(5), 55, h(1)),        # receives a send already received
+        state_block(h(12), BOB, h(5), 25, h(6)),        # receives 10 of a send of 5
+    ]
+    assert [ledger.apply(block_hash, data) for _, block_hash, data in rejected] == \
+        ['old', 'fork', 'gap_previous', 'gap_source', 'gap_source', 'gap_source', 'bad_amount']
+    assert ledger.apply(h(13), bytes(100)) == 'bad_length'
+    assert ledger.apply(h(14), state_block(h(14), BOB, h(5), 20, h(6))[2]) == 'receive'
+
+    assert state.get_balance(ALICE) == 20
+    assert state.get_balance(BOB) == 20
+    assert state.get_representative(ALICE) == b'\x02' * 32
+    assert state.accounts[ALICE][3] == 4
+    assert not state.pending
+    assert ledger.stats()['results']['open'] == 2
+
+    ledger.close()
+    assert storage._get_db_size('state') == 7
+    # the next field of every block but the frontiers points to the block after it, across batches too.
+    assert storage.get_block('state', h(2))[-32:] == h(3)
+    assert storage.get_block('state', h(3))[-32:] == h(4)
+    assert storage.get_block('state', h(4))[-32:] == h(6)
+    assert storage.get_block('state', h(5))[-32:] == h(14)
+    assert storage.get_block('state', h(6))[-32:] == bytes(32)
+    with BlockLog(log_path) as log:
+        assert len(log) == 7
+        assert restore(new_path('ledger.snapshot'), log).get_balance(BOB) == 20
+
+
+def test_rep_weights(new_path):
+    blocks = make_blocks()
+    state = LedgerState()
+    state.apply_blocks(blocks[:2])
+    state.weights = weights = RepWeights.from_state(state)
+    assert weights.get(REP) == 70
+
+    # Bob opens with 30 on REP, then moves to another representative.
+    state.apply_blocks(blocks[2:])
+    rep2 = b'\x02' * 32
+    assert weights.get(REP) == 50
+    assert weights.get(rep2) == 30
+    assert weights.total == state.get_balance(ALICE) + state.get_balance(BOB)
+    assert weights.top(1) == [(REP, 50)]
+    assert weights.top(5) == [(REP, 50), (rep2, 30)]
+    assert RepWeights.from_state(state).weights == weights.weights
+
+    storage = Storage(new_path('weights.ldb'), readonly=False)
+    assert RepWeights.load(storage).total == 0
+    assert weights.save(storage) == 2
+    assert weights.save(storage) == 0
+
+    # a representative left without weight is deleted from the table.
+    weights.add(rep2, -30)
+    assert weights.save(storage) == 1
+    loaded = RepWeights.load(storage)
+    assert loaded.top(5) == [(REP, 50)]
+    assert loaded.total == 50
+
+    # a table tagged with the state position loads only for a state at that position.
+    weights.save(storage, state)
+    assert RepWeights.load(storage, state).total == 50
+    state.apply_blocks(blocks[:1])
+    try:
+        RepWeights.load(storage, state)
+        assert False
+    except ValueError:
+        pass
+    storage.close()
+
+
+def test_restore_weights(new_path):
+    blocks = make_blocks()
+    log_path = new_path('weights.log')
+    snapshot_path = new_path('weights.snapshot')
+    with BlockLog(log_path, readonly=False) as log:
+        log.append_blocks(blocks)
+
+    # the weights are saved in the snapshot, applying the rest of the log doesn't count a block twice.
+    state = LedgerState()
+    state.weights = RepWeights()
+    state.apply_blocks(blocks[:3])
+    state.save(snapshot_path)
+    loaded = LedgerState.load(snapshot_path)
+    assert loaded.weights.reps == state.weights.reps
+    assert loaded.weights.weights == state.weights.weights
+    with BlockLog(log_path) as log:
+        state = restore(snapshot_path, log)
+    assert state.weights.total == state.get_balance(ALICE) + state.get_balance(BOB) == 80
+    assert state.weights.weights == RepWeights.from_state(state).weights
+
+    # a snapshot without weights, they are summed from its accounts.
+    state = LedgerState()
+    state.apply_blocks(blocks[:3])
+    state.save(snapshot_path)
+    assert LedgerState.load(snapshot_path).weights is None
+    with BlockLog(log_path) as log:
+        assert restore(snapshot_path, log).weights is None
+        assert restore(snapshot_path, log, weights=True).weights.get(REP) == 50
+
+
+def test_ledger_process():
+    state = LedgerState()
+    state.apply('state', GENESIS, GENESIS + bytes(32) + REP + (100).to_bytes(16, 'big') + bytes(32 + 104))
+    unchecked = UncheckedCache(max_blocks=10, max_age=60)
+    ledger = Ledger(state=state, unchecked=unchecked, check_hash=False)
+
+    h = lambda i: bytes([i]) * 32
+    blocks = [
+        state_block(h(1), GENESIS, GENESIS, 60, ALICE),
+        state_block(h(2), ALICE, bytes(32), 40, h(1)),
+        state_block(h(3), ALICE, h(2), 30, BOB),
+        state_block(h(4), ALICE, h(3), 20, BOB),
+        state_block(h(5), BOB, bytes(32), 10, h(3)),
+    ]
+    # everything arrives backwards: h(5) and h(2) wait for their source, h(4) and h(3) for their previous.
+    for _, block_hash, data in reversed(blocks[1:]):
+        assert ledger.process(block_hash, data).startswith('gap_')
+    assert ledger.process(*blocks[3][1:]) == 'gap_previous'
+    assert len(unchecked) == 4
+    assert unchecked.duplicates == 1
+
+    # the send to Alice releases her whole chain, and Bob's open with it.
+    assert ledger.process(*blocks[0][1:]) == 'send'
+    assert len(unchecked) == 0
+    assert state.get_balance(ALICE) == 20
+    assert state.get_balance(BOB) == 10
+    assert unchecked.stats()['released_per_arrival'] == {4: 1}
+    assert unchecked.released == 4
+
+
+def test_ledger_check_hash():
+    state = LedgerState()
+    state.apply('state', GENESIS, GENESIS + bytes(32) + REP + (100).to_bytes(16, 'big') + bytes(32 + 104))
+    ledger = Ledger(state=state)
+
+    data = state_block(None, GENESIS, GENESIS, 60, ALICE)[2]
+    assert ledger.apply(b'\x01' * 32, data) == 'bad_hash'
+    assert state.get_balance(GENESIS) == 100
+
+    # a Block with its hash set as hex, as read from storage or the network.
+    block = Block('state', account=GENESIS.hex(), previous=GENESIS.hex(), representative=REP.hex(),
+                  balance=60, link=ALICE.hex(), signature=bytes(64), work=bytes(8))
+    block.hash = block.calculate_hash().hex().upper()
+    assert block.calculate_hash() == state_block_hash(data)
+    assert ledger.apply_block(block) == 'send'
+    assert state.get_frontier(GENESIS) == state_block_hash(data)
+
+    # a Block with its hash set as bytes, as from_storage_bytes() callers leave it.
+    data = state_block(None, ALICE, bytes(32), 40, state_block_hash(data))[2]
+    block = Block('state')
+    block.from_storage_bytes(data)
+    block.hash = state_block_hash(data)
+    assert ledger.apply_block(block) == 'open'
+    assert state.get_balance(ALICE) == 40
+    assert ledger.stats()['results']['bad_hash'] == 1
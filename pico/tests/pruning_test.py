@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.block import Block
+from libs.storage import Storage
+from libs.pruning import prune_ledger
+
+
+def make_chain(account, steps):
+    """
+    Return [(block_hash, storage bytes)] of a state chain, steps are (balance, link), the next fields are set.
+    """
+
+    blocks = []
+    previous = bytes(32)
+    for balance, link in steps:
+        block = Block(type='state', account=account, previous=previous, representative=account,
+                      balance=balance, link=link)
+        previous = block.calculate_hash()
+        blocks.append([previous, account + block.previous + account + balance.to_bytes(16, 'big') + link + bytes(72)])
+
+    for block, next_block in zip(blocks, blocks[1:]):
+        block[1] += next_block[0]
+    blocks[-1][1] += bytes(32)
+    return [tuple(block) for block in blocks]
+
+
+def make_ledger():
+    """
+    Alice opens with 100, sends 10 to Bob, sends 10 more he never receives, changes her representative,
+    sends 5 to Bob and changes again. Bob receives the first and the last send.
+    """
+
+    alice, bob = b'\xaa' * 32, b'\xbb' * 32
+    a = make_chain(alice, [(100, b'\x99' * 32), (90, bob), (80, bob), (80, bytes(32)), (75, bob), (75, bytes(32))])
+    b = make_chain(bob, [(10, a[1][0]), (15, a[4][0])])
+    return a, b
+
+
+def test_prune_ledger(new_path):
+    a, b = make_ledger()
+    for indexes in [False, True]:
+        storage = Storage(new_path('prune.ldb'), readonly=False, indexes=indexes)
+        storage.put_blocks([('state', block_hash, data) for block_hash, data in a + b])
+        reports = []
+
+        progress = prune_ledger(storage, keep=2, batch_size=1, report=reports.append)
+
+        # a1, a2 and a4 go, a3 is kept as it's not received yet.
+        deleted = [a[0][0], a[1][0], a[3][0]]
+        assert progress['deleted'] == 3
+        # one walk per chain, with or without indexes.
+        assert progress['accounts'] == 2
+        assert progress['pending_kept'] == 1
+        assert progress['transactions'] == len(reports) == 3
+        assert progress['bytes_reclaimed'] >= 0
+        for block_hash, data in a + b:
+            expected = None if block_hash in deleted else data
+            assert storage.get_block('state', block_hash) == expected
+
+        if indexes:
+            assert storage.get_frontier(a[0][1][:32]) == a[5][0]
+            assert storage.get_chain(a[0][1][:32]) == [a[2][0], a[4][0], a[5][0]]
+
+        # nothing more to prune.
+        assert prune_ledger(storage, keep=2)['deleted'] == 0
+        storage.close()
+
+
+def test_prune_forked_chain(new_path):
+    alice, bob = b'\xaa' * 32, b'\xbb' * 32
+    a = make_chain(alice, [(100, b'\x99' * 32), (100, bytes(32)), (100, bytes(32)), (100, bytes(32))])
+    # a second block after a2, another representative: the fork of a3.
+    fork = Block(type='state', account=alice, previous=a[1][0], representative=bob, balance=100, link=bytes(32))
+    f3 = (fork.calculate_hash(), alice + a[1][0] + bob + (100).to_bytes(16, 'big') + bytes(32 + 72 + 32))
+
+    for indexes in [False, True]:
+        storage = Storage(new_path('prune_fork.ldb'), readonly=False, indexes=indexes)
+        storage.put_blocks([('state', block_hash, data) for block_hash, data in a + [f3]])
+
+        progress = prune_ledger(storage, keep=2)
+
+        # without indexes the fork is one more frontier, the history both tips share is deleted once.
+        assert progress['accounts'] == (1 if indexes else 2)
+        assert progress['deleted'] == 2
+        kept = [storage.get_block('state', block_hash) is not None for block_hash, _ in a + [f3]]
+        assert kept == [False, False, True, True, True]
+        if indexes:
+            assert storage.get_frontier(alice) == a[3][0]
+            assert storage.get_chain(alice) == [a[2][0], a[3][0]]
+        assert prune_ledger(storage, keep=2)['deleted'] == 0
+        storage.close()
+
+    # a2 is in the last keep blocks of both tips.
+    storage = Storage(new_path('prune_fork_keep.ldb'), readonly=False)
+    storage.put_blocks([('state', block_hash, data) for block_hash, data in a + [f3]])
+    assert prune_ledger(storage, keep=3)['deleted'] == 1
+    assert storage.get_block('state', a[0][0]) is None
+    assert all(storage.get_block('state', block_hash) is not None for block_hash, _ in a[1:] + [f3])
+    storage.close()
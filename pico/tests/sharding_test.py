@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import threading
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.sharding import ShardedStorage, reshard
+
+
+def spread_blocks(count):
+    """
+    Fake blocks with the leading 2 bytes of the hashes spread, so they fall in every shard.
+    """
+
+    return [('state', (i * 7919 % 65536).to_bytes(2, 'big') + bytes(30), i.to_bytes(8, 'big') * 31) for i in range(count)]
+
+
+def test_sharded_put_get(new_path):
+    storage = ShardedStorage(new_path('put_get'), shards=4, readonly=False)
+    blocks = spread_blocks(400)
+
+    assert storage.put_blocks(blocks[:200]) == (200, 0)
+    threads = [threading.Thread(target=lambda part: [storage.put_block(*block) for block in part], args=(blocks[200 + i::4], ))
+               for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for block_type, block_hash, data in blocks:
+        assert storage.get_block(block_type, block_hash) == data
+    assert storage.get_many('state', [blocks[3][1], b'\xff' * 32]) == [blocks[3][2], None]
+
+    storage.flush()
+    sizes = [shard._get_db_size('state') for shard in storage.shards]
+    assert sum(sizes) == 400
+    assert min(sizes) > 0
+    keys = [key for key, _ in storage.iter_items('state')]
+    assert keys == sorted(block_hash for _, block_hash, _ in blocks)
+    storage.close()
+
+    try:
+        ShardedStorage(storage.db_dir, shards=8, readonly=False)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_reshard(new_path):
+    src_dir = new_path('reshard_src')
+    storage = ShardedStorage(src_dir, shards=2, readonly=False)
+    blocks = spread_blocks(100)
+    storage.put_blocks(blocks)
+    storage.close()
+
+    dst_dir = new_path('reshard_dst')
+    assert reshard(src_dir, dst_dir, 5) == 100
+
+    storage = ShardedStorage(dst_dir, readonly=True)
+    assert len(storage.shards) == 5
+    for block_type, block_hash, data in blocks:
+        assert storage.get_block(block_type, block_hash) == data
+
+
+def test_reshard_options(new_path):
+    # the source options are recorded in shards.json and reused, compact blocks are encoded again per shard.
+    src_dir = new_path('reshard_options_src')
+    storage = ShardedStorage(src_dir, shards=2, readonly=False, schema='unified', compact_state=True)
+    blocks = spread_blocks(100)
+    storage.put_blocks(blocks)
+    notes = [(i.to_bytes(8, 'big'), b'note %d' % i) for i in range(20)]
+    assert storage.put_items('notes', notes) == (20, 0)
+    storage.close()
+
+    dst_dir = new_path('reshard_options_dst')
+    assert reshard(src_dir, dst_dir, 3) == 100 + 20
+
+    storage = ShardedStorage(dst_dir, readonly=True)
+    assert [shard.schema for shard in storage.shards] == ['unified'] * 3
+    for block_type, block_hash, data in blocks:
+        assert storage.get_block(block_type, block_hash) == data
+    assert all(len(value) < 1 + 248 for _, value in storage.iter_items('blocks'))
+    # other tables keep their raw keys.
+    assert sorted(storage.iter_items('notes')) == notes
+    storage.close()
@@ -2,11 +2,16 @@
 
 import os
 import sys
+import threading
+import multiprocessing
+import lmdb
+import pytest
 
 PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, PROJECT_PATH)
 
-from libs.storage import Storage
+from libs.storage import Storage, MapGrowthBlocked, migrate_schema
+from libs.account import Account
 
 
 test_dir = '/tmp/test-pico-storage'
@@ -54,3 +59,474 @@ def test_storage_get_new():
     storage = Storage(GLOBAL_DB_PATH, readonly=True)
     assert storage.get_block('open', GENESIS_OPEN_BLOCK_HASH).hex().upper() == GENESIS_OPEN_BLOCK_HEX_WITH_NEXT
 
+
+def test_storage_put_blocks(new_path, fake_blocks):
+    storage = Storage(new_path('put_blocks.ldb'), readonly=False)
+
+    blocks = fake_blocks(100) + fake_blocks(10, 'open')
+    assert storage.put_blocks(blocks, batch_size=30) == (110, 0)
+    assert storage.put_blocks(fake_blocks(20, start=90)) == (10, 10)
+
+    for block_type, block_hash, data in blocks:
+        assert storage.get_block(block_type, block_hash) == data
+    assert storage._get_db_size('state') == 110
+
+
+def test_storage_group_commit(new_path, fake_blocks):
+    db_path = new_path('group_commit.ldb')
+    storage = Storage(db_path, readonly=False, durability='nosync', group_commit=True, flush_interval=10, flush_entries=50)
+
+    blocks = fake_blocks(120)
+    for block_type, block_hash, data in blocks[:20]:
+        storage.put_block(block_type, block_hash, data)
+
+    # still buffered, but visible to readers.
+    assert storage._buffer
+    assert storage.get_block('state', blocks[0][1]) == blocks[0][2]
+
+    threads = [threading.Thread(target=lambda part: [storage.put_block(*block) for block in part], args=(blocks[i::4], ))
+               for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    storage.flush()
+    assert not storage._buffer
+    assert storage._get_db_size('state') == 120
+    storage.close()
+
+    storage = Storage(db_path, readonly=True)
+    for block_type, block_hash, data in blocks:
+        assert storage.get_block(block_type, block_hash) == data
+
+
+def test_storage_snapshot(new_path, fake_blocks):
+    storage = Storage(new_path('snapshot.ldb'), readonly=False)
+    blocks = fake_blocks(50)
+    storage.put_blocks(blocks)
+
+    with storage.snapshot() as snap:
+        storage.put_block('state', blocks[0][1], b'new data')
+        # the snapshot still sees the old data.
+        assert snap.get_block('state', blocks[0][1]) == blocks[0][2]
+        assert snap.get_block('state', blocks[1][1].hex()) == blocks[1][2]
+
+    assert storage.get_block('state', blocks[0][1]) == b'new data'
+
+    keys = [blocks[7][1], b'\xff' * 32, blocks[3][1].hex(), blocks[42][1]]
+    assert storage.get_many('state', keys) == [blocks[7][2], None, blocks[3][2], blocks[42][2]]
+
+
+def test_storage_snapshot_reopen(new_path, state_chains):
+    alice, bob, blocks = state_chains
+    a1, a2, b1, a3 = [block_hash for block_hash, _ in blocks]
+    db_path = new_path('snapshot_reopen.ldb')
+    storage = Storage(db_path, readonly=False, indexes=True)
+    storage.put_blocks([('state', h, data) for h, data in blocks])
+    storage.close()
+
+    # a new Storage opens its tables in the snapshot, nothing was written through it.
+    for readonly, indexes in [(True, False), (False, False), (True, True)]:
+        storage = Storage(db_path, readonly=readonly, indexes=indexes)
+        with storage.snapshot() as snap:
+            assert snap.get_block('state', a1) == blocks[0][1]
+            assert snap.read_block('state', a2).previous == a1
+            assert snap.get_block_any(b1) == ('state', blocks[2][1])
+            assert snap.get_block('open', a1) is None
+        assert storage.get_many('state', [a3, b'\xff' * 32]) == [blocks[3][1], None]
+        assert storage.block_known(a3)
+        assert [block._hash_bytes for block in storage.iter_chain(a3, 'backward')] == [a3, a2, a1]
+        storage.close()
+
+def test_storage_zero_copy(new_path):
+    storage = Storage(new_path('zero_copy.ldb'), readonly=False)
+    storage.put_block('open', GENESIS_OPEN_BLOCK_HASH, bytes.fromhex(GENESIS_OPEN_BLOCK_HEX_WITH_NEXT))
+
+    with storage.snapshot(buffers=True) as snap:
+        block = snap.read_block('open', GENESIS_OPEN_BLOCK_HASH)
+        assert isinstance(block.account, memoryview)
+        assert block.calculate_hash().hex().upper() == GENESIS_OPEN_BLOCK_HASH
+        assert [b.calculate_hash() for b in snap.iter_blocks('open')] == [block.calculate_hash()]
+        block.detach()
+
+    assert isinstance(block.account, bytes)
+    assert block.to_storage_bytes().hex().upper() == GENESIS_OPEN_BLOCK_HEX_WITH_NEXT
+
+
+@pytest.fixture
+def state_chains(make_state_block):
+    """
+    Alice opens with 100 from genesis, sends 30 to Bob, Bob opens and receives it, Alice sends 20 more to Bob.
+    """
+
+    alice, bob = b'\xaa' * 32, b'\xbb' * 32
+    a1 = make_state_block(alice, bytes(32), 100, b'\x99' * 32)
+    a2 = make_state_block(alice, a1[0], 70, bob)
+    b1 = make_state_block(bob, bytes(32), 30, a2[0])
+    a3 = make_state_block(alice, a2[0], 50, bob)
+    return alice, bob, [a1, a2, b1, a3]
+
+
+def test_storage_indexes(new_path, make_state_block, state_chains):
+    alice, bob, blocks = state_chains
+    a1, a2, b1, a3 = [block_hash for block_hash, _ in blocks]
+
+    storage = Storage(new_path('indexes.ldb'), readonly=False, indexes=True)
+    # the children come first, they are indexed once their previous block arrives in the batch.
+    storage.put_blocks([('state', h, data) for h, data in reversed(blocks)])
+
+    assert storage.get_frontier(alice) == a3
+    assert storage.get_frontier(bob) == b1
+    assert storage.get_chain(alice) == [a1, a2, a3]
+    assert storage.get_receivables(bob) == [(a3, 20)]
+    with storage.snapshot() as snap:
+        assert snap.get_block_info(a3) == ('state', alice, 3, 50)
+
+    plain = Storage(new_path('rebuild_indexes.ldb'), readonly=False)
+    plain.put_blocks([('state', h, data) for h, data in blocks])
+    plain.close()
+
+    storage = Storage(plain.db_path, readonly=False, indexes=True)
+    assert storage.get_frontier(alice) is None
+    assert storage.rebuild_indexes(batch_size=1) == 4
+    assert storage.get_chain(alice) == [a1, a2, a3]
+    assert storage.get_receivables(bob) == [(a3, 20)]
+
+    # children written before their previous block wait for it, across put_blocks() calls.
+    storage = Storage(new_path('indexes_later.ldb'), readonly=False, indexes=True)
+    storage.put_blocks([('state', h, data) for h, data in reversed(blocks[1:])])
+    assert storage.get_frontier(alice) is None
+    # Bob's open doesn't wait for the send it receives, which waits for its own previous.
+    assert storage.get_frontier(bob) == b1
+    assert len(list(storage.iter_items(b'idx_unindexed'))) == 2
+    storage.put_blocks([('state', h, data) for h, data in blocks[:1]])
+    assert storage.get_chain(alice) == [a1, a2, a3]
+    assert list(storage.iter_items(b'idx_unindexed')) == []
+
+    # without indexes=True, index reads fail and create no table.
+    plain = Storage(new_path('no_indexes.ldb'), readonly=False)
+    plain.put_blocks([('state', h, data) for h, data in blocks])
+    for readonly in [False, True]:
+        plain.close()
+        plain = Storage(plain.db_path, readonly=readonly)
+        for read in [plain.get_frontier, plain.get_chain, plain.get_receivables]:
+            with pytest.raises(ValueError):
+                read(alice)
+    assert not any(db_name.startswith(b'idx_') for db_name in plain._get_db_names())
+    plain.close()
+
+    # a second block after a2 is a fork, it's recorded and the frontier is kept.
+    fork_hash, fork = make_state_block(alice, a2, 60, bob)
+    storage.put_blocks([('state', fork_hash, fork)])
+    assert storage.get_frontier(alice) == a3
+    assert [(key, value) for key, value in storage.iter_items(b'idx_forks')] == [(fork_hash, alice + a2)]
+
+def test_storage_iter_items(new_path, fake_blocks):
+    storage = Storage(new_path('iter_items.ldb'), readonly=False)
+    storage.put_blocks(fake_blocks(300))
+    keys = [i.to_bytes(32, 'big') for i in range(300)]
+
+    assert [key for key, _ in storage.iter_items('state', batch=7)] == keys
+    assert [key for key, _ in storage.iter_items('state', reverse=True, batch=7)] == keys[::-1]
+    assert [key for key, _ in storage.iter_items('state', start=keys[10], stop=keys[20])] == keys[10:20]
+    assert [key for key, _ in storage.iter_items('state', start=keys[10], stop=keys[20], reverse=True)] == keys[19:9:-1]
+    # keys[256:300] start with 30 zero bytes and b'\x01'
+    assert [key for key, _ in storage.iter_items('state', prefix=bytes(30) + b'\x01', batch=5)] == keys[256:]
+    assert [len(items) for items in storage.iter_batches('state', stop=keys[25], batch=10)] == [10, 10, 5]
+
+    # resume an interrupted scan with the last key seen.
+    seen = []
+    for key, _ in storage.iter_items('state', batch=16):
+        seen.append(key)
+        if len(seen) == 100:
+            break
+    seen += [key for key, _ in storage.iter_items('state', batch=16, after=seen[-1])]
+    assert seen == keys
+
+
+def value_sum(key, value):
+    return int.from_bytes(value[:8], 'big')
+
+
+def block_balance(block):
+    if block.type != 'state':
+        return None
+    return int.from_bytes(block.balance, 'big')
+
+
+def test_storage_parallel_scan(new_path, state_chains):
+    storage = Storage(new_path('parallel_scan.ldb'), readonly=False)
+    # spread the keys over the whole key space.
+    storage.put_blocks([('state', (i << 248).to_bytes(32, 'big'), i.to_bytes(8, 'big') * 31) for i in range(200)])
+
+    assert storage.parallel_scan('state', value_sum, workers=2) == sum(range(200))
+    assert storage.parallel_scan('empty', value_sum, workers=2, initial=0) == 0
+
+    _, _, blocks = state_chains
+    storage.put_blocks([('state', block_hash, data) for block_hash, data in blocks])
+    assert storage.parallel_scan('state', block_balance, workers=2, decode=True) > 0
+
+
+def test_storage_map_growth(new_path, fake_blocks):
+    storage = Storage(new_path('map_growth.ldb'), readonly=False, map_size=64 * 1024)
+    assert storage.stats()['map_size'] == 64 * 1024
+
+    blocks = fake_blocks(2000)
+    assert storage.put_blocks(blocks, batch_size=500) == (2000, 0)
+    stats = storage.stats()
+    assert stats['map_growths'] > 0
+    assert stats['map_size'] >= stats['used_bytes']
+    assert storage._get_db_size('state') == 2000
+
+    capped = Storage(new_path('map_capped.ldb'), readonly=False, map_size=64 * 1024, max_map_size=128 * 1024)
+    try:
+        capped.put_blocks(blocks)
+        assert False
+    except lmdb.MapFullError:
+        pass
+
+    # a snapshot closed by another thread releases the gate, the next growth doesn't wait forever.
+    storage = Storage(new_path('map_growth_threads.ldb'), readonly=False, map_size=64 * 1024)
+    snap = storage.snapshot()
+    closer = threading.Thread(target=snap.close)
+    closer.start()
+    closer.join()
+    storage.put_blocks(blocks)
+    assert storage._get_db_size('state') == 2000
+
+    # a thread can't grow the map under its own snapshot.
+    storage = Storage(new_path('map_growth_blocked.ldb'), readonly=False, map_size=64 * 1024)
+    with storage.snapshot():
+        try:
+            storage.put_blocks(blocks)
+            assert False
+        except MapGrowthBlocked:
+            pass
+
+
+def test_storage_cache(new_path, fake_blocks):
+    storage = Storage(new_path('cache.ldb'), readonly=False, cache_size=1024 * 1024)
+    blocks = fake_blocks(10)
+    storage.put_blocks(blocks)
+
+    for _ in range(3):
+        assert storage.get_block('state', blocks[0][1]) == blocks[0][2]
+    assert storage.cache.hits == 2
+
+    storage.put_block('state', blocks[0][1], b'new data')
+    assert storage.get_block('state', blocks[0][1]) == b'new data'
+    assert storage.stats()['cache']['misses'] == 2
+
+
+def put_block_in_process(job):
+    db_path, block_hash = job
+    storage = Storage(db_path, readonly=False)
+    storage.put_block('open', block_hash, b'data')
+    storage.close()
+
+
+def test_storage_bloom(monkeypatch, new_path, fake_blocks):
+    db_path = new_path('bloom.ldb')
+    if os.path.exists(db_path + '.bloom'):
+        os.remove(db_path + '.bloom')
+
+    storage = Storage(db_path, readonly=False, bloom=True, indexes=True)
+    blocks = fake_blocks(100)
+    storage.put_blocks(blocks)
+
+    assert storage.block_known(blocks[5][1])
+    assert not storage.block_known(b'\xee' * 32)
+    assert storage.bloom_stats()['count'] == 100
+    assert storage.bloom_stats()['false_positive_rate'] < 0.01
+    storage.close()
+
+    # reloaded from the file, tagged with the last transaction.
+    storage = Storage(db_path, readonly=False, bloom=True, indexes=True)
+    assert storage.bloom_stats()['count'] == 100
+    storage.close()
+
+    # the database changed without the filter, it must be rebuilt.
+    storage = Storage(db_path, readonly=False)
+    storage.put_block('open', b'\xcc' * 32, b'data')
+    storage.close()
+    storage = Storage(db_path, readonly=False, bloom=True)
+    assert storage.block_known(b'\xcc' * 32)
+    assert storage.bloom_stats()['count'] == 101
+
+    # a block committed by another process is missing from the filter, it's looked up in lmdb.
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        pool.map(put_block_in_process, [(db_path, b'\xdd' * 32)])
+    assert storage.block_known(b'\xdd' * 32)
+    assert not storage.block_known(b'\xde' * 32)
+    storage.close()
+
+    # a stale filter is not saved, a reader rebuilds it and saves it for the next reader.
+    reader = Storage(db_path, bloom=True)
+    assert reader.block_known(b'\xdd' * 32)
+    reader.close()
+    monkeypatch.setattr(Storage, 'rebuild_bloom', None)
+    reader = Storage(db_path, bloom=True)
+    assert reader.bloom_stats()['count'] == 102
+    reader.close()
+
+
+def test_storage_unified_schema(new_path, fake_blocks, state_chains):
+    _, _, blocks = state_chains
+    typed = Storage(new_path('typed.ldb'), readonly=False)
+    # open blocks are 200 bytes in storage.
+    opens = [('open', block_hash, bytes(200)) for _, block_hash, _ in fake_blocks(5, start=1)]
+    typed.put_blocks([('state', h, data) for h, data in blocks] + opens)
+
+    unified = Storage(new_path('unified.ldb'), readonly=False, schema='unified', indexes=True)
+    assert migrate_schema(typed, unified) == (9, 0)
+    assert unified._get_db_size('blocks') == 9
+
+    block_hash, data = blocks[0]
+    assert unified.get_block('state', block_hash) == data
+    assert unified.get_block('open', block_hash) is None
+    assert unified.get_block_any(block_hash) == ('state', data)
+    assert unified.get_block_any(b'\xee' * 32) == (None, None)
+    assert typed.get_block_any(block_hash) == ('state', data)
+
+    with unified.snapshot() as snap:
+        assert len(list(snap.iter_blocks('open'))) == 5
+        assert snap.read_block('state', block_hash).calculate_hash() == block_hash
+
+    alice, bob, _ = state_chains
+    assert unified.get_chain(alice) == [h for h, _ in blocks if h != blocks[2][0]]
+    assert unified.rebuild_indexes() == 9
+    assert unified.parallel_scan('blocks', block_balance, workers=2, decode=True) == 100 + 70 + 30 + 50
+
+    # block types may be given as bytes.
+    unified.put_block(b'open', b'\xee' * 32, bytes(200))
+    assert unified.get_block_any(b'\xee' * 32) == ('open', bytes(200))
+
+    # the schema is recorded and checked on open.
+    unified.close()
+    typed.close()
+    for db_path, schema in [(unified.db_path, 'typed'), (typed.db_path, 'unified')]:
+        try:
+            Storage(db_path, schema=schema)
+            assert False
+        except ValueError:
+            pass
+    # a rejected open leaves the environment closed, it can be opened again.
+    Storage(typed.db_path).close()
+
+    # the reference node's own meta table is left alone.
+    node = Storage(new_path('node_meta.ldb'), readonly=False)
+    node._put_data('meta', b'\x00' * 32, b'\x00' * 32)
+    node.close()
+    node = Storage(node.db_path, readonly=False)
+    assert list(node.iter_items('meta')) == [(b'\x00' * 32, b'\x00' * 32)]
+    assert dict(node.iter_items('pico_meta'))[b'schema'] == b'typed'
+    node.close()
+
+
+def test_storage_compact_state(new_path, fake_blocks, state_chains):
+    alice, bob, blocks = state_chains
+    storage = Storage(new_path('compact_state.ldb'), readonly=False, compact_state=True, indexes=True)
+    storage.put_blocks([('state', h, data) for h, data in blocks] + fake_blocks(10, start=1))
+
+    # alice, bob and their representative, plus a key per fake block, its own representative.
+    assert storage._get_db_size('keydict') == 3 + 10
+    for block_hash, data in blocks:
+        assert storage.get_block('state', block_hash) == data
+    assert storage.get_frontier(alice) == blocks[3][0]
+    assert storage.get_receivables(bob) == [(blocks[3][0], 20)]
+
+    with storage.snapshot(buffers=True) as snap:
+        assert snap.read_block('state', blocks[1][0]).calculate_hash() == blocks[1][0]
+    assert storage.rebuild_indexes() == 4
+    storage.close()
+
+    # a reader gets the storage bytes, and the stored values are smaller.
+    reader = Storage(storage.db_path, readonly=True, compact_state=True)
+    assert dict((h, d) for _, h, d in reader.iter_block_items()) == dict(blocks + [(h, d) for _, h, d in fake_blocks(10, start=1)])
+    assert all(len(value) < 248 for _, value in reader.iter_items('state'))
+
+    unified = Storage(new_path('compact_unified.ldb'), readonly=False, schema='unified', compact_state=True)
+    migrate_schema(reader, unified)
+    assert unified.get_block_any(blocks[0][0]) == ('state', blocks[0][1])
+    # the unified values are the type byte and the compact record.
+    values = [value for _, value in unified.iter_items('blocks')]
+    assert len(values) == 14 and all(value[0] == 6 and len(value) < 1 + 248 for value in values)
+    assert unified.parallel_scan('blocks', block_balance, workers=2, decode=True) == 100 + 70 + 30 + 50 + sum(
+        int.from_bytes(d[96:112], 'big') for _, _, d in fake_blocks(10, start=1))
+
+    # compact blocks can't be read without compact_state=True.
+    reader.close()
+    try:
+        Storage(storage.db_path)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_storage_iter_chain(new_path, state_chains):
+    alice, bob, blocks = state_chains
+    a1, a2, b1, a3 = [block_hash for block_hash, _ in blocks]
+
+    storage = Storage(new_path('iter_chain.ldb'), readonly=False, indexes=True)
+    storage.put_blocks([('state', h, data) for h, data in blocks])
+
+    hashes = lambda chain: [block._hash_bytes for block in chain]
+    assert hashes(storage.iter_chain(alice)) == [a1, a2, a3]
+    assert hashes(storage.iter_chain(alice, 'backward')) == [a3, a2, a1]
+    assert hashes(storage.iter_chain(a2, 'backward')) == [a2, a1]
+    assert hashes(storage.iter_chain(alice, limit=2)) == [a1, a2]
+    assert [str(block) for block in storage.iter_chain(alice)] == [h.hex().upper() for h in [a1, a2, a3]]
+    assert hashes(storage.iter_chain(b'\xcc' * 32)) == []
+    with storage.snapshot(buffers=True) as snap:
+        assert [block.calculate_hash() for block in snap.iter_chain(alice)] == [a1, a2, a3]
+    try:
+        list(storage.iter_chain(alice, 'sideways'))
+        assert False
+    except ValueError:
+        pass
+
+    # without indexes, the walk follows the previous and next fields.
+    linked = dict(blocks)
+    linked[a1] = linked[a1][:-32] + a2
+    linked[a2] = linked[a2][:-32] + a3
+    plain = Storage(new_path('iter_chain_links.ldb'), readonly=False)
+    plain.put_blocks([('state', h, data) for h, data in linked.items()])
+    assert hashes(plain.iter_chain(a1)) == [a1, a2, a3]
+    assert hashes(plain.iter_chain(a3, 'backward')) == [a3, a2, a1]
+    assert [bytes(block.next) for block in plain.iter_chain(a2)] == [a3, bytes(32)]
+    assert hashes(plain.iter_chain(alice)) == []
+
+
+def test_storage_scan_wallet(new_path, state_chains):
+    alice, bob, blocks = state_chains
+    a1, a2, b1, a3 = [block_hash for block_hash, _ in blocks]
+
+    storage = Storage(new_path('scan_wallet.ldb'), readonly=False, indexes=True)
+    storage.put_blocks([('state', h, data) for h, data in blocks])
+
+    carol = b'\xcc' * 32
+    bob_account = Account(verifying_key=bob)
+    scan = storage.scan_wallet([carol, alice, bob_account])
+    assert scan['accounts'] == {
+        alice:          {'frontier': a3, 'balance': 50, 'pending': 0, 'receivables': 0},
+        bob_account:    {'frontier': b1, 'balance': 30, 'pending': 20, 'receivables': 1},
+        carol:          {'frontier': None, 'balance': None, 'pending': 0, 'receivables': 0},
+    }
+    assert scan['seconds'] >= scan['seconds_per_account'] > 0
+    assert storage.scan_wallet([])['accounts'] == {}
+    storage.close()
+    reader = Storage(storage.db_path)
+    with pytest.raises(ValueError):
+        reader.scan_wallet([alice])
+    reader.close()
+
+    # in group commit mode, the buffered blocks are flushed and indexed before the scan.
+    buffered = Storage(new_path('scan_wallet_group.ldb'), readonly=False, indexes=True, group_commit=True,
+                       flush_interval=60, flush_entries=100)
+    for block_hash, data in blocks:
+        buffered.put_block('state', block_hash, data)
+    assert buffered.scan_wallet([alice])['accounts'][alice] == \
+        {'frontier': a3, 'balance': 50, 'pending': 0, 'receivables': 0}
+    buffered.close()
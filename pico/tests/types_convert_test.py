@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import pytest
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.types_convert import to_bytes, hex_to_bytes, buffer_to_bytes
+
+GENESIS_HASH = '991CF190094C00F0B68E2E5F75F6BEE95A2E0BD93CEAA4A6734DB9F19B728948'
+
+
+def test_to_bytes_hex():
+    assert to_bytes(GENESIS_HASH, 32) == bytes.fromhex(GENESIS_HASH)
+    assert to_bytes(GENESIS_HASH, 16) == b''
+    assert to_bytes('xrb_not_hex', 0) == b''
+    assert to_bytes(None, 32) == b''
+
+
+def test_to_bytes_buffer():
+    data = bytes.fromhex(GENESIS_HASH)
+    assert to_bytes(data, 32) is data
+    assert to_bytes(bytearray(data), 32) == data
+    assert to_bytes(data, 16) == b''
+
+    view = memoryview(data)
+    assert type(to_bytes(view, 32)) is bytes
+    assert to_bytes(view, 32, copy=False) is view
+
+
+def test_to_bytes_strict():
+    assert to_bytes(b'', strict=True) == b''
+    with pytest.raises(ValueError):
+        to_bytes('zz', 1, strict=True)
+
+
+def test_strict_fast_path():
+    assert hex_to_bytes(GENESIS_HASH, 32) == bytes.fromhex(GENESIS_HASH)
+    assert buffer_to_bytes(memoryview(b'abc'), 3) == b'abc'
+
+    for func, data in [(hex_to_bytes, 'zz'), (hex_to_bytes, b'ab'), (buffer_to_bytes, 'ab'), (buffer_to_bytes, b'ab')]:
+        with pytest.raises(ValueError):
+            func(data, 3)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.unchecked import UncheckedCache
+
+
+def test_unchecked_bounds():
+    unchecked = UncheckedCache(max_blocks=3, max_age=10)
+    h = lambda i: bytes([i]) * 32
+    for i in range(3):
+        assert unchecked.add(h(100), h(i), b'block', now=i)
+    assert not unchecked.add(h(100), h(0), b'block', now=3)
+
+    # the oldest block makes room.
+    unchecked.add(h(101), h(3), b'block', now=3)
+    assert h(0) not in unchecked
+    assert unchecked.evicted == 1
+
+    # blocks older than 10 seconds are dropped.
+    unchecked.add(h(101), h(4), b'block', now=12.5)
+    assert [h(i) in unchecked for i in range(5)] == [False, False, False, True, True]
+    assert unchecked.expired == 2
+    assert unchecked.release(h(100)) == []
+    assert unchecked.release(h(101)) == [(h(3), b'block'), (h(4), b'block')]
+    assert unchecked.stats()['dependencies'] == 0
+
+
+def test_unchecked_eviction():
+    unchecked = UncheckedCache(max_blocks=3, max_age=10)
+    h = lambda i: bytes([i]) * 32
+    unchecked.add(h(100), h(0), b'block 0', now=0)
+    unchecked.add(h(101), h(1), b'block 1', now=1)
+    unchecked.add(h(100), h(2), b'block 2', now=2)
+
+    # the oldest block goes even if its dependency still has other blocks waiting.
+    unchecked.add(h(102), h(3), b'block 3', now=3)
+    assert unchecked.stats()['dependencies'] == 3
+    # a dependency left without blocks is dropped with its last one.
+    unchecked.add(h(102), h(4), b'block 4', now=4)
+    assert unchecked.evicted == 2
+    assert unchecked.stats()['dependencies'] == 2
+    assert unchecked.release(h(101)) == []
+
+    # an evicted block can wait again, it's not a duplicate, block 2 makes room.
+    assert unchecked.add(h(100), h(0), b'block 0', now=5)
+    assert unchecked.duplicates == 0
+    assert unchecked.evicted == 3
+    assert unchecked.release(h(100)) == [(h(0), b'block 0')]
+    assert unchecked.release(h(102)) == [(h(3), b'block 3'), (h(4), b'block 4')]
+    assert len(unchecked) == 0
+    assert unchecked.stats()['dependencies'] == 0
+
+    # a single slot keeps the newest block.
+    single = UncheckedCache(max_blocks=1)
+    for i in range(5):
+        single.add(h(100), h(i), b'block', now=i)
+    assert single.evicted == 4
+    assert single.release(h(100)) == [(h(4), b'block')]
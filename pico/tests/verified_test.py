@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import multiprocessing
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from libs.account import Account
+from libs.block import Block
+from libs.storage import Storage
+from libs.verified import VerifiedTable
+
+
+my_account = Account(signing_key='bdc8a8ef58200a401a85c10a9431282a4084f0cc9c527b546fa3aa5cafecbdb4')
+
+
+def make_open_block():
+    block = Block(type='open', source='78D8D44D421C2C2B0DEE2DEA5DB3EBCA0D5EFED85835A85443FD64B69EB214C8',
+                  representative='xrb_3dmtrrws3pocycmbqwawk6xs7446qxa36fcncush4s1pejk16ksbmakis78m',
+                  account=my_account.xrb_address, work='5EE2F0B881FE6122')
+    block.hash = block.calculate_hash()
+    block.signature = my_account.sign_block(block.hash)
+    return block
+
+
+def is_verified_in_process(job):
+    db_path, entry = job
+    return VerifiedTable(Storage(db_path, readonly=True)).is_verified(*entry)
+
+
+def test_verified_table(new_path):
+    db_path = new_path('verified.ldb')
+    verified = VerifiedTable(Storage(db_path, readonly=False))
+    block = make_open_block()
+    key = my_account._verifying_key_bytes
+    entry = (block.hash, key, block.signature, bytes.fromhex('5EE2F0B881FE6122'))
+
+    assert not verified.is_verified(*entry)
+    assert verified.verify_block(block)
+    assert verified.is_verified(*entry)
+    assert verified.filter_verified([entry, (block.hash, key, bytes(64), entry[3])]) == set([entry])
+
+    # another signature with the same hash is not covered, and fails.
+    forged = make_open_block()
+    forged.signature = bytes(64)
+    assert not verified.verify_block(forged)
+    assert not verified.is_verified(forged.hash, key, forged.signature, entry[3])
+
+    # any other process sees it.
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        assert pool.map(is_verified_in_process, [(db_path, entry)]) == [True]
+
+
+def test_verified_table_tampered(new_path):
+    verified = VerifiedTable(Storage(new_path('tampered.ldb'), readonly=False))
+    assert verified.verify_block(make_open_block())
+
+    # changed fields with the old hash and signature: the hash is calculated again, and the signature fails.
+    tampered = make_open_block()
+    tampered.representative = tampered.account
+    assert not verified.verify_block(tampered)
+
+    # the hash of a legacy send doesn't cover its account: a recorded signature only holds for its signer.
+    send = Block(type='send', previous=make_open_block().hash, destination=my_account.xrb_address,
+                 balance=1, work='5EE2F0B881FE6122', signature=bytes(64))
+    send_hash = send.calculate_hash()
+    other = Account(signing_key='11' * 32)
+    verified.record([(send_hash, my_account._verifying_key_bytes, send.signature, send.work)])
+    assert verified.verify_block(send, account=my_account.xrb_address)
+    assert not verified.verify_block(send, account=other.xrb_address)
+    assert not verified.is_verified(send_hash, other._verifying_key_bytes, send.signature, send.work)